@@ -5,11 +5,11 @@
 #
 # Purpose: This script outputs zonal statistics for historical daily SNODAS rasters given the basin boundaries of an
 # input basin boundary shapefile. The zonal statistics that are calculated are as follows: SWE mean, SWE minimum, SWE
-# maximum, SWE standard deviation, pixel count and percentage of snow coverage. The functions in this script are
-# housed within SNODAS_utilities.py. A more detailed description of each function is documented in the
-# SNODAS_utilities.py file. This script allows the user to interactively input historical dates of interest for
-# processing. The user can decide between a single date and a range of dates. This script does not allow for the user
-# to pick a list of non-sequential dates.
+# maximum, SWE standard deviation, pixel count and percentage of snow coverage. The zonal statistics are calculated
+# by SNODAS_Zonal.py from the downloaded .tar files and the other functions in this script are housed within
+# SNODAS_utilities.py. A more detailed description of each function is documented in those files. This script allows
+# the user to interactively input historical dates of interest for processing. The user can decide between a single
+# date and a range of dates. This script does not allow for the user to pick a list of non-sequential dates.
 
 # Check to see which os is running
 # Import necessary modules
@@ -27,6 +27,22 @@ from pathlib import Path
 
 from qgis.core import QgsApplication
 
+import SNODAS_Zonal
+import utilities
+from SNODAS_CloudSync import sync_folder
+from SNODAS_Export import (
+    SHAPEFILE_FIELD_NAMES,
+    ZIP_COMPRESSION_LEVEL,
+    BasinTemplate,
+    package_day,
+    publish_latest_date,
+    round_statistics,
+    week_change,
+    write_statistics_csvs
+)
+from SNODAS_Graphs import create_basin_graphs
+from SNODAS_Manifest import RunManifest, snodas_product_code
+
 # Read the config file to assign variables. Reference the following for code details:
 # https://wiki.python.org/moin/ConfigParserExamples
 if sys.platform == 'linux' or sys.platform == 'linux2' or sys.platform == 'cygwin' or sys.platform == 'darwin':
@@ -67,6 +83,10 @@ def config_map(section: str) -> dict:
 # The zonal statistics will be calculated for each feature of this layer. The shapefile must be projected into
 # NAD83 Zone 13N. This script was originally developed to process Colorado Watershed Basins as the input shapefile.
 #
+# DOWNSTREAM_ID_FIELD: Optional field name of the basin boundary attribute table holding the id of the basin each basin
+# drains to, empty for outlets. If configured, the totals of every basin and all the basins upstream of it are also
+# exported to SnowpackStatisticsByDate_YYYYMMDD_Upstream.csv in the byDate folder.
+#
 # QGIS_HOME: The full path to QGIS installation on the local machine. This is used to initialize QGIS
 # resources & utilities. More info at: http://docs.qgis.org/testing/en/docs/pyqgis_developer_cookbook/intro.html.
 #
@@ -96,6 +116,31 @@ def config_map(section: str) -> dict:
 #
 # OUTPUT_STATS_BY_BASIN_FOLDER: The name of the byBasin folder. All zonal statistic results in csv format organized by
 # basin are contained here.
+#
+# SHP_ZIP, GEOJSON_ZIP: If either is 'True', the daily shapefile and GeoJSON are packaged into
+# SnowpackStatisticsByDate_YYYYMMDD.zip and .geojson.zip, along with the LatestDate archives for the most recent date.
+# The loose shapefile is not written if SHP_ZIP and DEL_SHP_ORIG are 'True', and the loose GeoJSON is not written if
+# GEOJSON_ZIP is 'True'.
+#
+# ZIP_LEVEL: The zlib compression level of the packaged archives, from 1 (fastest) to 9 (smallest). Defaulted to 6.
+#
+# OUTPUT_GRAPHS_FOLDER: The name of the graphs folder. The snowpack time series graph of each basin, rendered from the
+# byBasin csv files, is contained here.
+#
+# S3_BUCKET, S3_PREFIX: The bucket the byDate, byBasin and graphs folders are uploaded to when UPLOAD_TO_S3 is 'True',
+# and the key prefix of the folders in it. Only the files that changed since the last upload are sent.
+#
+# S3_DELETE: If 'True', files deleted from the output folders are deleted from the bucket too. Otherwise they stay in
+# the bucket.
+#
+# ZONAL_PRODUCTS: The product codes of the SNODAS parameters whose zonal statistics are added to the csv files, Ex:
+# '1034, 1036' for Snow Water Equivalent and Snow Depth. Snow Water Equivalent (1034) is always calculated. The
+# optional minimum, maximum and standard deviation statistics apply to every product.
+#
+# ELEVATION_DEM_PATH, ELEVATION_BREAKPOINTS: The full pathname to a DEM of the basins and the ascending elevations,
+# in the units of the DEM, separating its elevation bands, Ex: '2000, 2500, 3000'. If the DEM is configured, the
+# statistics of every elevation band of every basin are also exported to SnowpackStatisticsByElevationBand_YYYYMMDD.csv
+# in the byDate folder, from the same pass over the grids as the basin statistics.
 
 
 # QGIS_HOME = config_map('ProgramInstall')['qgis_pathname']
@@ -112,21 +157,54 @@ CREATE_SNOW_COVER_FOLDER: str = config_map('Folders')['create_snowcover_tif_fold
 CALCULATE_STATS_FOLDER: str = config_map('Folders')['calculate_stats_folder']
 OUTPUT_STATS_BY_DATE_FOLDER: str = config_map('Folders')['output_stats_by_date_folder']
 OUTPUT_STATS_BY_BASIN_FOLDER: str = config_map('Folders')['output_stats_by_basin_folder']
+OUTPUT_GRAPHS_FOLDER: str = config_map('Folders').get('output_graphs_folder', 'SnowpackGraphsByBasin')
 
 BASIN_SHP_PATH: str = config_map('BasinBoundaryShapefile')['pathname']
+ID_FIELD_NAME: str = config_map('BasinBoundaryShapefile')['basin_id_fieldname']
+DOWNSTREAM_ID_FIELD: str = config_map('BasinBoundaryShapefile').get('downstream_id_fieldname', '')
 
 OUTPUT_CRS_EPSG: str = config_map('Projections')['output_proj_epsg']
 
 DEV_ENVIRONMENT: str = config_map('OutputLayers')['dev_environment']
+GEOJSON_PRECISION: str = config_map('OutputLayers')['geojson_precision']
+GEOJSON_ZIP: str = config_map('OutputLayers')['geojson_zip']
 SHP_ZIP: str = config_map('OutputLayers')['shp_zip']
+ZIP_LEVEL: int = int(config_map('OutputLayers').get('zip_compression_level', ZIP_COMPRESSION_LEVEL))
 DEL_SHP_ORIG: str = config_map('OutputLayers')['shp_delete_originals']
 UPLOAD_TO_S3: str = config_map('OutputLayers')['upload_to_s3']
 UPLOAD_TO_GCP: str = config_map('OutputLayers')['gcp_upload']
 RUN_DAILY_TSTOOL: str = config_map('OutputLayers')['process_daily_tstool_graphs']
 RUN_HIST_TSTOOL: str = config_map('OutputLayers')['process_historical_tstool_graphs']
+S3_BUCKET: str = config_map('OutputLayers').get('s3_bucket', '')
+S3_PREFIX: str = config_map('OutputLayers').get('s3_prefix', '')
+S3_DELETE: str = config_map('OutputLayers').get('s3_delete_removed', 'False')
 
 SAVE_ALL_SNODAS_PARAMS: str = config_map('SNODASParameters')['save_all_parameters']
 
+# Product code of the SNODAS Snow Water Equivalent files.
+SWE_PRODUCT = '1034'
+
+ZONAL_PRODUCTS: list = [SWE_PRODUCT] + [
+    product.strip() for product in config_map('OptionalZonalStatistics').get('zonal_products', '').split(',')
+    if product.strip() not in ('', SWE_PRODUCT)]
+
+ELEVATION_DEM_PATH: str = config_map('OptionalZonalStatistics').get('elevation_dem_pathname', '')
+ELEVATION_BREAKPOINTS: list = [
+    float(value) for value in config_map('OptionalZonalStatistics').get('elevation_breakpoints', '').split(',')
+    if value.strip()]
+
+# Configuration values of the optional statistics, by the name they have in the statistic columns.
+OPTIONAL_STATISTICS = {'Min': config_map('OptionalZonalStatistics')['calculate_swe_minimum'],
+                       'Max': config_map('OptionalZonalStatistics')['calculate_swe_maximum'],
+                       'StdDev': config_map('OptionalZonalStatistics')['calculate_swe_standard_deviation']}
+
+
+def configured_statistics(columns: dict) -> dict:
+    """ Remove the optional statistics that are not configured from columns of statistics. """
+    return {name: values for name, values in columns.items()
+            if not any('_{}_'.format(stat) in name and flag.upper() != 'TRUE'
+                       for stat, flag in OPTIONAL_STATISTICS.items())}
+
 
 def arg_parse() -> None:
     """ Parse command line arguments. Currently implemented options are:\n
@@ -179,6 +257,7 @@ if __name__ == '__main__':
     snow_cover_path = Path(SNODAS_ROOT) / PROCESSED_FOLDER / CREATE_SNOW_COVER_FOLDER
     results_basin_path = Path(SNODAS_ROOT) / PROCESSED_FOLDER / (CALCULATE_STATS_FOLDER + OUTPUT_STATS_BY_BASIN_FOLDER)
     results_date_path = Path(SNODAS_ROOT) / PROCESSED_FOLDER / (CALCULATE_STATS_FOLDER + OUTPUT_STATS_BY_DATE_FOLDER)
+    graph_path = Path(SNODAS_ROOT) / PROCESSED_FOLDER / (CALCULATE_STATS_FOLDER + OUTPUT_GRAPHS_FOLDER)
 
     all_folders = [SNODAS_ROOT, download_path, set_format_path, clip_path, snow_cover_path, results_basin_path,
                    results_date_path]
@@ -263,6 +342,27 @@ if __name__ == '__main__':
     # Create an empty list that will contain all dates that failed to download.
     failed_dates_lst = []
 
+    # Index of the files produced for each date of this run.
+    manifest = RunManifest()
+
+    # Basin labels of the SNODAS grid, or the combined basin and elevation band labels if a DEM is configured, by grid
+    # origin. The labels only change with the origin of the grid, which moved on October 1, 2013, so the basins are
+    # rasterized at most twice in a run.
+    basin_zones = {}
+
+    # Geometry and attributes of the basins in the output projection, built once and reused for the daily GeoJSON and
+    # shapefile. Its features are in the order of the basin labels.
+    template = BasinTemplate(BASIN_SHP_PATH, static_path / 'BasinTemplate', 'EPSG:' + OUTPUT_CRS_EPSG,
+                             int(GEOJSON_PRECISION))
+    local_names = [properties.get('LOCAL_NAME') for properties in template.properties]
+
+    # Drainage tree of the basins, built once, if the downstream basin of each basin is configured.
+    basin_tree = None
+    if DOWNSTREAM_ID_FIELD:
+        basin_tree = SNODAS_Zonal.build_basin_tree(
+            [properties[ID_FIELD_NAME] for properties in template.properties],
+            [properties[DOWNSTREAM_ID_FIELD] for properties in template.properties])
+
     # Iterate through each day of the user-specified range. Refer to:
     # http://stackoverflow.com/questions/6901436/python-expected-an-indented-block
     total_days = (endDate - startDate).days + 1
@@ -316,10 +416,12 @@ if __name__ == '__main__':
             break
 
         else:
-            # Untar current date's data.
-            for file in SNODAS_utilities.list_dir(download_path, '*.tar'):
-                if current_date in str(file):
-                    SNODAS_utilities.untar_snodas_file(file, download_path, set_format_path)
+            # Untar current date's data. Every file produced from here on is recorded in the manifest by (date, stage,
+            # product), so each stage looks its inputs up directly instead of listing the output folders.
+            if possible_file.exists():
+                for member in SNODAS_utilities.untar_snodas_file(current_date_tar, download_path, set_format_path):
+                    # Each product has both a .dat.gz and a .txt.gz member, so untarred files are keyed by name.
+                    manifest.add(current_date, 'untar', member, member.name)
 
             # Check to see if configuration file 'SAVE_ALL_SNODAS_PARAMS' value is valid. If valid, script continues
             # to run. If invalid, error message is printed to console and log file and the script is terminated.
@@ -327,9 +429,8 @@ if __name__ == '__main__':
 
                 # Delete current date's irrelevant files (parameters other than SWE).
                 if SAVE_ALL_SNODAS_PARAMS.upper() == 'FALSE':
-                    for file in os.listdir(set_format_path):
-                        if current_date in file:
-                            SNODAS_utilities.delete_irrelevant_snodas_files(file)
+                    for file in manifest.files(current_date, 'untar'):
+                        SNODAS_utilities.delete_irrelevant_snodas_files(str(file))
                     logger.info('Finished removing files.\n')
 
                 # Move irrelevant files (parameters other than SWE) to 'OtherSNODASParameters'.
@@ -337,114 +438,176 @@ if __name__ == '__main__':
                     parameter_path = set_format_path / 'OtherParameters'
                     if not parameter_path.exists():
                         parameter_path.mkdir()
-                    for file in os.listdir(set_format_path):
-                        if current_date in file:
-                            SNODAS_utilities.move_irrelevant_snodas_files(file, parameter_path)
+                    for file in manifest.files(current_date, 'untar'):
+                        SNODAS_utilities.move_irrelevant_snodas_files(str(file), parameter_path)
+
+                # Only the SWE files are left in the SetFormat folder.
+                swe_files = [file for file in manifest.files(current_date, 'untar')
+                             if snodas_product_code(file) == SWE_PRODUCT]
+                manifest.remove(current_date, 'untar')
 
                 # Extract current date's .gz files. Each SNODAS parameter files are zipped within a .gz file.
-                for file in SNODAS_utilities.list_dir(set_format_path, '*.gz'):
-                    if current_date in str(file):
-                        SNODAS_utilities.extract_snodas_gz_file(file)
+                for file in swe_files:
+                    if file.suffix == '.gz':
+                        extracted = SNODAS_utilities.extract_snodas_gz_file(file, set_format_path)
+                        if extracted.suffix == '.dat':
+                            manifest.add(current_date, 'dat', extracted, SWE_PRODUCT)
 
                 # Convert current date's SNODAS SWE .dat file into .bil format.
-                for file in SNODAS_utilities.list_dir(set_format_path, '*.dat'):
-                    if current_date in str(file):
-                        SNODAS_utilities.convert_snodas_dat_to_bil(file)
-
-                # Create current date's custom .Hdr file. In order to convert today's SNODAS SWE .bil file into a usable
-                # .tif file, a custom .Hdr must be created. Refer to the function in the SNODAS_utilities.py for more
-                # information on the contents of the custom .HDR file.
-                for file in SNODAS_utilities.list_dir(set_format_path, '*.bil'):
-                    if current_date in str(file):
-                        SNODAS_utilities.create_snodas_hdr_file(str(file))
-
-                # Convert current date's .bil files to .tif files
-                for file in SNODAS_utilities.list_dir(set_format_path, '*.bil'):
-                    if current_date in str(file):
-                        SNODAS_utilities.convert_snodas_bil_to_tif(str(file), set_format_path)
-
-                # Delete current date's .bil and .hdr files
-                for file in SNODAS_utilities.list_dir(set_format_path, ('*.bil', '*.hdr', '*.Hdr'),
-                                                      multiple_types=True):
-                    if current_date in str(file):
-                        SNODAS_utilities.delete_snodas_files(file)
+                dat_file = manifest.get(current_date, 'dat', SWE_PRODUCT)
+                if dat_file is not None:
+                    bil_file = SNODAS_utilities.convert_snodas_dat_to_bil(dat_file)
+
+                    # Create current date's custom .Hdr file. In order to convert today's SNODAS SWE .bil file into a
+                    # usable .tif file, a custom .Hdr must be created. Refer to the function in the
+                    # SNODAS_utilities.py for more information on the contents of the custom .HDR file.
+                    SNODAS_utilities.create_snodas_hdr_file(str(bil_file))
+
+                    # Convert current date's .bil files to .tif files
+                    manifest.add(current_date, 'tif',
+                                 SNODAS_utilities.convert_snodas_bil_to_tif(str(bil_file), set_format_path),
+                                 SWE_PRODUCT)
+
+                    # Delete current date's .bil and .hdr files
+                    for file in (bil_file, bil_file.with_suffix('.hdr'), bil_file.with_suffix('.Hdr')):
+                        if file.exists():
+                            SNODAS_utilities.delete_snodas_files(file)
 
                 # Create the extent shapefile if not already created.
                 if not extent_shapefile.exists():
                     SNODAS_utilities.create_extent(BASIN_SHP_PATH, static_path)
 
+                # Each clip stage returns the full pathname of the raster it created, which is the input of the next
+                # stage. A stage returns None if its input was not valid, which stops the chain for the date.
+                tif_file = manifest.get(current_date, 'tif', SWE_PRODUCT)
+
                 # Copy and move current date's .tif file into CLIP_FOLDER
-                for file in SNODAS_utilities.list_dir(set_format_path, '*.tif'):
-                    if current_date in str(file):
-                        SNODAS_utilities.copy_and_move_snodas_tif_file(file, clip_path)
-
-                # Assign datum to current date's .tif file (defaulted to WGS84)
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.assign_snodas_datum(file, clip_path)
-
-                # Clip current date's .tif file to the extent of the basin shapefile
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.snodas_raster_clip(file, clip_path, extent_shapefile)
-
-                # Project current date's .tif file into desired projection (defaulted to NAD83 UTM Zone 13N)
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.assign_snodas_projection(file, clip_path)
-
-                # Create current date's snow cover binary raster
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.snow_coverage(file, clip_path, snow_cover_path)
-
-                # Create .csv files of byBasin and byDate outputs
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.create_csv_files(file, BASIN_SHP_PATH, results_date_path, results_basin_path)
-
-                # Delete rows from basin CSV files if the date is being reprocessed
-                for file in os.listdir(clip_path):
-                    if current_date in file:
-                        SNODAS_utilities.delete_by_basin_csv_repeated_rows(file, BASIN_SHP_PATH, results_basin_path)
-
-                # Calculate zonal statistics and export results
-                for file in os.listdir(clip_path):
-                    # print('The file: {}'.format(file))
-                    if current_date in file:
-                        SNODAS_utilities.z_stat_and_export(file, BASIN_SHP_PATH, results_basin_path, results_date_path,
-                                                           clip_path, snow_cover_path, current,
-                                                           returnedList[0], OUTPUT_CRS_EPSG)
-
-                # If configured, zip files of output shapefile (both today's data and latestDate file)
-                if SHP_ZIP.upper() == 'TRUE':
-                    for file in os.listdir(results_date_path):
-                        if current_date in file and file.endswith('.shp'):
-                            SNODAS_utilities.zip_shapefile(file, results_date_path, DEL_SHP_ORIG)
-                        if 'LatestDate' in file and file.endswith('.shp'):
-                            zip_full_path = results_date_path / 'SnowpackStatisticsByDate_LatestDate.zip'
-                            if zip_full_path.exists():
-                                zip_full_path.unlink()
-
-                            SNODAS_utilities.zip_shapefile(file, results_date_path, DEL_SHP_ORIG)
-
-                # If configured, the time series will run for each processed date of data.
+                if tif_file is not None:
+                    manifest.add(current_date, 'clip',
+                                 SNODAS_utilities.copy_and_move_snodas_tif_file(tif_file, clip_path), SWE_PRODUCT)
+
+                # Assign datum to current date's .tif file (defaulted to WGS84), clip current date's .tif file to the
+                # extent of the basin shapefile, then project it into desired projection (defaulted to NAD83 UTM
+                # Zone 13N).
+                clip_file = manifest.get(current_date, 'clip', SWE_PRODUCT)
+                if clip_file is not None:
+                    clip_file = SNODAS_utilities.assign_snodas_datum(clip_file.name, clip_path)
+                if clip_file is not None:
+                    clip_file = SNODAS_utilities.snodas_raster_clip(clip_file.name, clip_path, extent_shapefile)
+                if clip_file is not None:
+                    clip_file = SNODAS_utilities.assign_snodas_projection(clip_file.name, clip_path)
+                if clip_file is not None:
+                    manifest.add(current_date, 'clip', clip_file, SWE_PRODUCT)
+                else:
+                    manifest.remove(current_date, 'clip')
+
+                clip_file = manifest.get(current_date, 'clip', SWE_PRODUCT)
+                if clip_file is not None:
+                    # Create current date's snow cover binary raster
+                    SNODAS_utilities.snow_coverage(clip_file.name, clip_path, snow_cover_path)
+
+                # Calculate the zonal statistics of the configured products straight from the .tar file, in one pass
+                # over the basin labels, and export them to the byDate and byBasin csv files.
+                grids = {}
+                if possible_file.exists():
+                    grids = {product: utilities.scale_snodas_grid(grid, product) for product, grid in
+                             utilities.read_snodas_tar_grids(possible_file, ZONAL_PRODUCTS).items()}
+                if SWE_PRODUCT in grids:
+                    origin = SNODAS_Zonal.grid_origin(current)
+                    if origin not in basin_zones and ELEVATION_DEM_PATH:
+                        # The labels are also cached on disk, one file for each grid origin.
+                        era = 'Pre2013' if origin == utilities.SNODAS_ORIGIN_PRE2013 else 'Post2013'
+                        band_labels, _, basin_ids = SNODAS_Zonal.elevation_band_labels(
+                            BASIN_SHP_PATH, ID_FIELD_NAME, ELEVATION_DEM_PATH, ELEVATION_BREAKPOINTS, current,
+                            static_path / 'ElevationBandLabels_{}.npz'.format(era))
+                        basin_zones[origin] = band_labels, basin_ids
+                    elif origin not in basin_zones:
+                        basin_zones[origin] = SNODAS_Zonal.rasterize_basins(BASIN_SHP_PATH, ID_FIELD_NAME, current)
+                    labels, basin_ids = basin_zones[origin]
+
+                    moments = 'TRUE' in [flag.upper() for flag in OPTIONAL_STATISTICS.values()]
+                    cell_area = SNODAS_Zonal.snodas_cell_area(current)
+                    if ELEVATION_DEM_PATH:
+                        # The basin sums are the sums of the elevation bands of each basin.
+                        _, band_stats, basin_sums = SNODAS_Zonal.elevation_band_stats(
+                            grids, labels, len(basin_ids), len(ELEVATION_BREAKPOINTS) + 2, cell_area, moments)
+                        SNODAS_Zonal.write_elevation_band_csv(
+                            results_date_path / ('SnowpackStatisticsByElevationBand_' + current_date + '.csv'),
+                            current_date, basin_ids, ELEVATION_BREAKPOINTS, configured_statistics(band_stats),
+                            ID_FIELD_NAME)
+                    else:
+                        basin_sums = SNODAS_Zonal.zone_sums(grids, labels, len(basin_ids), cell_area, moments)
+                    columns = round_statistics(configured_statistics(SNODAS_Zonal.zone_stats(basin_sums)))
+
+                    # Change in SWE volume from the byDate csv file of 7 days before, empty if it was not processed.
+                    week_ago = SNODAS_utilities.format_date_yyyymmdd(current - timedelta(days=7))
+                    columns['SNODAS_SWE_Volume_1WeekChange_acft'] = week_change(
+                        results_date_path, week_ago, basin_ids, columns['SNODAS_SWE_Volume_acft'], ID_FIELD_NAME)
+
+                    write_statistics_csvs(results_date_path, results_basin_path, current_date, basin_ids, local_names,
+                                          columns, returnedList[0], ID_FIELD_NAME)
+
+                    # If configured, export the totals of every basin and all the basins upstream of it, accumulated
+                    # from the per-basin sums of the day down the drainage tree.
+                    if basin_tree is not None:
+                        upstream_columns = round_statistics(configured_statistics(SNODAS_Zonal.zone_stats(
+                            {product: SNODAS_Zonal.upstream_sums(sums, basin_tree)
+                             for product, sums in basin_sums.items()})))
+                        upstream_columns['SNODAS_SWE_Volume_1WeekChange_acft'] = week_change(
+                            results_date_path, week_ago, basin_ids, upstream_columns['SNODAS_SWE_Volume_acft'],
+                            ID_FIELD_NAME, '_Upstream')
+                        write_statistics_csvs(results_date_path, None, current_date, basin_ids, local_names,
+                                              upstream_columns, returnedList[0], ID_FIELD_NAME, '_Upstream')
+
+                    # Write the daily GeoJSON and shapefile of the basins with the SWE statistics. The statistics of
+                    # the other products are only written to the csv files, as their names do not fit in .dbf fields.
+                    layer_columns = {name: values for name, values in columns.items() if name in SHAPEFILE_FIELD_NAMES}
+                    layer_name = 'SnowpackStatisticsByDate_' + current_date
+                    if GEOJSON_ZIP.upper() != 'TRUE':
+                        template.write_geojson(results_date_path / (layer_name + '.geojson'), layer_columns)
+                    if SHP_ZIP.upper() != 'TRUE' or DEL_SHP_ORIG.upper() != 'TRUE':
+                        template.write_shapefile(results_date_path / (layer_name + '.shp'), layer_columns)
+
+                    # Add the date to ListOfDates.txt and, if it is the most recent date, point the
+                    # SnowpackStatisticsByDate_LatestDate files at the files of the date.
+                    latest = publish_latest_date(results_date_path, current_date)
+
+                    # If configured, package the layers of the date, and of the latest date, into archives straight
+                    # from memory.
+                    if SHP_ZIP.upper() == 'TRUE' or GEOJSON_ZIP.upper() == 'TRUE':
+                        package_day(template, results_date_path, current_date, layer_columns, compresslevel=ZIP_LEVEL,
+                                    latest=latest)
+                    print('Zonal statistics of {} are complete. \n'.format(current_date))
+                else:
+                    logger.warning('The SWE grid of {} is not available. The zonal statistics were not processed.'
+                                   .format(current_date))
+
+                # The date is finished. Forget its files so the manifest does not grow over a long range.
+                manifest.drop_date(current_date)
+
+                # If configured, the time series graphs are updated for each processed date of data. Only the graphs
+                # of the basins whose byBasin csv file changed are rendered again.
                 if RUN_DAILY_TSTOOL.upper() == 'TRUE':
-                    SNODAS_utilities.create_snodas_swe_graphs()
+                    create_basin_graphs(results_basin_path, graph_path)
 
                 # If it is the last date in the range, continue.
                 if current == endDate or current == endDate.date():
 
-                    # Remove any duplicates that occurred in the byBasin csv files (rare but could happen.)
-                    SNODAS_utilities.clean_duplicates_from_by_basin_csv(results_basin_path)
-
                     # If configured, the time series will run for the entire historical range.
                     if RUN_HIST_TSTOOL.upper() == 'TRUE':
-                        SNODAS_utilities.create_snodas_swe_graphs()
+                        create_basin_graphs(results_basin_path, graph_path)
 
                     # Push daily statistics to the web if configuration property is set to 'True'.
-                    if UPLOAD_TO_S3.upper() == 'TRUE':
-                        SNODAS_utilities.push_to_aws()
+                    if UPLOAD_TO_S3.upper() == 'TRUE' and not S3_BUCKET:
+                        logger.error('Upload to S3 is set but the s3_bucket configuration property is empty. Skipping '
+                                     'the push to AWS.')
+                    elif UPLOAD_TO_S3.upper() == 'TRUE':
+                        # Only the files that changed since the last push are uploaded.
+                        for folder in (results_date_path, results_basin_path, graph_path):
+                            if not folder.exists():
+                                continue
+                            sync_folder(folder, S3_BUCKET, S3_PREFIX.strip('/') + '/' + folder.name,
+                                        delete=S3_DELETE.upper() == 'TRUE')
                     if UPLOAD_TO_GCP.upper() == 'TRUE':
                         SNODAS_utilities.push_to_gcp()
                     if UPLOAD_TO_S3.upper() != 'TRUE' and UPLOAD_TO_GCP.upper() != 'TRUE':
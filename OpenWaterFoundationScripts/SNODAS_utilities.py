@@ -17,10 +17,8 @@
 
 # Import necessary modules
 import configparser
-import csv
 import ftplib
 import gdal
-import glob
 import gzip
 import logging
 import ogr
@@ -30,29 +28,19 @@ import subprocess
 import sys
 import tarfile
 import time
-import zipfile
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from logging.config import fileConfig
 from pathlib import Path
-from shutil import copy, copyfile
+from shutil import copy
 
-from PyQt5.QtCore import QVariant
 from qgis.analysis import (
     QgsRasterCalculator,
-    QgsRasterCalculatorEntry,
-    QgsZonalStatistics
+    QgsRasterCalculatorEntry
 )
 from qgis.core import (
-    QgsCoordinateReferenceSystem,
     QgsCoordinateTransformContext,
-    QgsExpression,
-    QgsExpressionContext,
-    QgsExpressionContextScope,
-    QgsField,
-    QgsRasterLayer,
-    QgsVectorLayer,
-    QgsVectorFileWriter
+    QgsRasterLayer
 )
 sys.path.append('/usr/share/qgis/python/plugins')
 
@@ -173,8 +161,6 @@ def download_snodas(download_dir: Path, single_date: datetime) -> list:
     # Direct to folder within FTP site storing the SNODAS masked data.
     ftp.cwd(SNODAS_FTP_FOLDER)
 
-    os.chdir(download_dir)
-
     # Move into FTP folder containing the data from single_date's year
     ftp.cwd(str(single_date.year) + '/')
 
@@ -191,7 +177,7 @@ def download_snodas(download_dir: Path, single_date: datetime) -> list:
     filenames = ftp.nlst()
     for file in filenames:
         if file.endswith('{}.tar'.format(day)):
-            local_file = open(file, 'wb')
+            local_file = open(download_dir / file, 'wb')
             ftp.retrbinary('RETR ' + file, local_file.write, 1024)
 
             logger.info('download_snodas: Downloaded {}'.format(single_date))
@@ -259,11 +245,12 @@ def list_dir(path: Path, ext, multiple_types=False):
         return all_files
 
 
-def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> None:
+def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> list:
     """Untar downloaded SNODAS .tar file and extract the contained files to the folder_output
     file: SNODAS .tar file to untar
     folder_input: the full pathname to the folder containing 'file'
-    folder_output: the full pathname to the folder containing the extracted files"""
+    folder_output: the full pathname to the folder containing the extracted files
+    Returns: list of the full pathnames of the extracted files"""
 
     logger.info('untar_snodas_file: Starting {}'.format(file))
 
@@ -273,27 +260,28 @@ def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> No
     # Open .tar file
     tar = tarfile.open(file_full)
 
-    # Change working directory to output folder
-    os.chdir(folder_output)
-
-    # Extract .tar file and save contents in output directory
-    tar.extractall()
+    # Extract .tar file and save contents in output directory. The output directory is passed explicitly rather than
+    # changing the working directory so that several dates can be untarred at the same time.
+    tar.extractall(path=folder_output)
+    extracted = [Path(folder_output) / member.name for member in tar.getmembers() if member.isfile()]
 
     # Close .tar file
     tar.close()
 
     logger.info('untar_snodas_file: {} has been untarred.\n'.format(file))
 
+    return extracted
+
 
 def delete_irrelevant_snodas_files(file: str) -> None:
     """Delete file if not identified by the unique SWE ID. The SNODAS .tar files contain many different SNODAS datasets.
      For this project, the parameter of interest is SWE, uniquely named with ID '1034'. If the configuration file is
      set to 'False' for the value of the 'SaveAllSNODASParameters' section, then the parameters other than SWE are
      deleted.
-     file: file extracted from the downloaded SNODAS .tar file"""
+     file: full pathname of a file extracted from the downloaded SNODAS .tar file"""
 
     # Check for unique identifier '1034'.
-    if '1034' not in file:
+    if '1034' not in Path(file).name:
 
         # Delete file
         Path(file).unlink()
@@ -308,13 +296,13 @@ def move_irrelevant_snodas_files(file: str, folder_output: Path) -> None:
     contain many different SNODAS datasets. For this project, the parameter of interest is SWE, uniquely named with ID
     '1034'. If the configuration file is set to 'True' for the value of the 'SaveAllSNODASParameters' section, then the
     parameters other than SWE are moved to 'OtherParameters' subfolder of the 2_SetEnvironment folder.
-    file: file extracted from the downloaded SNODAS .tar file
+    file: full pathname of a file extracted from the downloaded SNODAS .tar file
     folder_output: full pathname to folder where the other-than-SWE files are contained, OtherParameters"""
 
     logger.info('move_irrelevant_snodas_files: Starting {}'.format(file))
 
     # Check for unique identifier '1034'.
-    if '1034' not in file:
+    if '1034' not in Path(file).name:
 
         # Move copy of file to folder_output. Delete original file from original location.
         copy(file, folder_output)
@@ -329,17 +317,22 @@ def move_irrelevant_snodas_files(file: str, folder_output: Path) -> None:
     logger.info('move_irrelevant_snodas_files: Finished {} \n'.format(file))
 
 
-def extract_snodas_gz_file(file: Path) -> None:
+def extract_snodas_gz_file(file: Path, folder_output: Path = None) -> Path:
     """Extract .dat and .Hdr files from SNODAS .gz file. Each daily SNODAS raster has 2 files associated with it
     (.dat and .Hdr) Both are zipped within a .gz file.
-    file: .gz file to be extracted"""
+    file: .gz file to be extracted
+    folder_output: full pathname to the folder where the extracted file is written. Defaults to the folder of 'file'
+    Returns: full pathname of the extracted file"""
 
     logger.info('extract_snodas_gz_file: Starting {}'.format(file))
 
+    if folder_output is None:
+        folder_output = file.parent
+
     # This block of script was based off of the script from the following resource:
     # http://stackoverflow.com/questions/20635245/using-gzip-module-with-python
     in_file = gzip.open(str(file), 'r')
-    with open(file.stem, 'wb') as out_file:
+    with open(folder_output / file.stem, 'wb') as out_file:
         out_file.write(in_file.read())
     in_file.close()
 
@@ -348,11 +341,14 @@ def extract_snodas_gz_file(file: Path) -> None:
 
     logger.info('extract_snodas_gz_file: {} has been extracted.\n'.format(file))
 
+    return folder_output / file.stem
 
-def convert_snodas_dat_to_bil(file: Path) -> None:
+
+def convert_snodas_dat_to_bil(file: Path) -> Path:
     """Convert SNODAS .dat file into supported file format (.tif). The .dat and .Hdr files are not supported file
     formats to use with QGS processing tools. The QGS processing tools are used to calculate the daily zonal stats.
-    file: .dat file to be converted to .bil format"""
+    file: .dat file to be converted to .bil format
+    Returns: full pathname of the .bil file"""
 
     logger.info('convert_snodas_dat_to_bil: Starting {}'.format(file))
 
@@ -361,6 +357,8 @@ def convert_snodas_dat_to_bil(file: Path) -> None:
 
     logger.info('convert_snodas_dat_to_bil: {} has been converted into .bil format.\n'.format(file))
 
+    return file.with_suffix('.bil')
+
 
 def create_snodas_hdr_file(file: str) -> None:
     """Create custom .hdr file. A custom .Hdr file needs to be created to indicate the raster settings of the .bil file.
@@ -395,11 +393,12 @@ def create_snodas_hdr_file(file: str) -> None:
     logger.info('create_snodas_hdr_file: {} now has a created a custom .hdr file.\n'.format(file))
 
 
-def convert_snodas_bil_to_tif(file: str, folder_output: Path) -> None:
+def convert_snodas_bil_to_tif(file: str, folder_output: Path) -> Path:
     """
     Convert .bil file into .tif file for processing within the QGIS environment.
     file: file to be converted into a .tif file
     folder_output: full pathname to folder where the created .tif files are contained
+    Returns: full pathname of the created .tif file
     """
 
     logger.info('convert_snodas_bil_to_tif: Starting {}'.format(file))
@@ -423,6 +422,8 @@ def convert_snodas_bil_to_tif(file: str, folder_output: Path) -> None:
 
     logger.info('convert_snodas_bil_to_tif: {} has been converted into a .tif file.\n'.format(file))
 
+    return abs_output_tif
+
 
 def delete_snodas_files(file: Path) -> None:
     """Delete file with .bil or .hdr extensions. The .bil and .hdr formats are no longer important to keep because the
@@ -597,11 +598,12 @@ def create_extent(basin_shp: str, folder_output: Path) -> None:
         Path(delete_file).unlink()
 
 
-def copy_and_move_snodas_tif_file(file: Path, folder_output: Path) -> None:
+def copy_and_move_snodas_tif_file(file: Path, folder_output: Path) -> Path:
     """Copy and move created .tif file from original location to folder_output. The copied and moved file will be
     edited. To keep the file as it is, the original is saved within the original folder.
     file: .tif file to be copied and moved to folder_output
-    folder_output: full pathname to the folder holding the newly copied .tif file"""
+    folder_output: full pathname to the folder holding the newly copied .tif file
+    Returns: full pathname of the copied .tif file"""
 
     logger.info('copy_and_move_snodas_tif_file: Starting {}'.format(file))
     # Set full pathname of file
@@ -612,14 +614,17 @@ def copy_and_move_snodas_tif_file(file: Path, folder_output: Path) -> None:
 
     logger.info('copy_and_move_snodas_tif_file: {} has been copied and moved to {}.\n'.format(file, folder_output))
 
+    return folder_output / Path(file).name
 
-def assign_snodas_datum(file: str, folder: Path) -> None:
+
+def assign_snodas_datum(file: str, folder: Path) -> Path:
     """Define WGS84 as datum. Defaulted in configuration file to assign SNODAS grid with WGS84 datum. The
     downloaded SNODAS raster is un-projected however the "SNODAS fields are grids of point estimates of snow cover in
     latitude/longitude coordinates with the horizontal datum WGS84." - SNODAS Data Products at NSIDC User Guide
     http://nsidc.org/data/docs/noaa/g02158_snodas_snow_cover_model/index.html
     file: the name of the .tif file that is to be assigned a projection
-    folder: full pathname to the folder where both the un-projected and projected raster are stored"""
+    folder: full pathname to the folder where both the un-projected and projected raster are stored
+    Returns: full pathname of the raster with the assigned datum, or None if file was not processed"""
 
     logger.info('assign_snodas_datum: Starting {}'.format(file))
 
@@ -657,17 +662,20 @@ def assign_snodas_datum(file: str, folder: Path) -> None:
     else:
         logger.warning("assign_snodas_datum: {} does not end in 'HP001.tif' and has not been assigned projection "
                        "of {}.\n".format(file, CLIP_PROJECTION))
-        return
+        return None
 
     logger.info('assign_snodas_datum: Successfully converted {} to {}.\n'.format(file, output_raster.name))
 
+    return output_raster
+
 
-def snodas_raster_clip(file: str, folder: Path, vector_extent: Path) -> None:
+def snodas_raster_clip(file: str, folder: Path, vector_extent: Path) -> Path:
     """Clip file by vector_extent shapefile. The output filename starts with 'Clip'.
     file: the projected (defaulted to WGS84) .tif file to be clipped
     folder: full pathname to folder where both the un-clipped and clipped rasters are stored
     vector_extent: full pathname to shapefile holding the extent of the basin boundaries. This shapefile must be
-    projected in projection assigned in function assign_snodas_datum (defaulted to WGS84)."""
+    projected in projection assigned in function assign_snodas_datum (defaulted to WGS84).
+    Returns: full pathname of the clipped raster, or None if file was not processed"""
 
     logger.info('snodas_raster_clip: Starting {}'.format(file))
 
@@ -714,16 +722,19 @@ def snodas_raster_clip(file: str, folder: Path, vector_extent: Path) -> None:
                         .format(file_full_output.name, prj, datum))
     else:
         logger.info('snodas_raster_clip: {} does not end with PRJCT.tif. The clip was not processed.\n'.format(file))
-        return
+        return None
     logger.info('snodas_raster_clip: Successfully clipped {} to {}.\n'.format(file, file_full_output.name))
 
+    return file_full_output
+
 
-def assign_snodas_projection(file: str, folder: Path) -> None:
+def assign_snodas_projection(file: str, folder: Path) -> Path:
     """Project clipped raster from it's original datum (defaulted to WGS84) to desired projection (defaulted
     to Albers Equal Area).
     file: clipped file with original projection to be projected into desired projection
     folder: full pathname of folder where both the originally clipped rasters and the projected clipped rasters are
-    contained"""
+    contained
+    Returns: full pathname of the projected raster, or None if file was not processed"""
     logger.info('assign_snodas_projection: Starting {}'.format(file))
     # Check for projected SNODAS rasters.
     if file.startswith('Clip') and file.endswith('.tif'):
@@ -794,19 +805,22 @@ def assign_snodas_projection(file: str, folder: Path) -> None:
                         .format(file_full_output.name, prj, datum))
     else:
         logger.info("assign_snodas_projection: {} does not start with 'Clip' and will not be projected.\n".format(file))
-        return
+        return None
 
     logger.info('assign_snodas_projection: Successfully clipped {} into {}\n'.format(file, str(file_full_output)))
 
+    return file_full_output
 
-def snow_coverage(file: str, folder_input: Path, folder_output: Path) -> None:
+
+def snow_coverage(file: str, folder_input: Path, folder_output: Path) -> Path:
     """Create binary .tif raster indicating snow coverage. If a pixel in the input file is > 0 (there is snow on the
     ground) then the new raster's pixel value is assigned '1'. If a pixel in the input raster is 0 or a null value
     (there is no snow on the ground) then the new raster's pixel value is assigned '0'. The output raster is used to
     calculate the percent of daily snow coverage for each basin.
     file: daily SNODAS SWE .tif raster
     folder_input: full pathname to the folder where the file is stored
-    folder_output: full pathname to the folder where the newly created binary snow cover raster is stored"""
+    folder_output: full pathname to the folder where the newly created binary snow cover raster is stored
+    Returns: full pathname of the snow cover raster, or None if file was not processed"""
 
     logger.info('snow_coverage: Starting {}'.format(file))
 
@@ -862,729 +876,11 @@ def snow_coverage(file: str, folder_input: Path, folder_output: Path) -> None:
             logger.warning('snow_coverage: {} is not a valid object raster layer.'.format(file))
 
         logger.info('snow_coverage: Finished {}.\n'.format(file))
-    else:
-        logger.warning("snow_coverage: {} does not start with 'Repj'. No raster calculation took place.\n".format(file))
 
-
-def create_csv_files(file: str, v_file: str, csv_by_date: Path, csv_by_basin: Path) -> None:
-    """Create empty csv files for output - both by date and by basin. The empty csv files have a header row with
-     each column represented by a different field name (refer to 'fieldnames' section of the function for actual
-     fieldnames). Csv files by date contain one .csv file for each date and is titled
-     'SnowpackStatisticsByDate_YYYYMMDD.csv'. Each byDate file contains the zonal stats for each basin on that date.
-     Csv files by basin contain one .csv file for each watershed basin & is titled 'SnowpackStatisticsByBasin_BasinId'.
-     Each byBasin file contains the zonal stats for that basin for each date that has been processed.
-     file: daily .tif file  to be processed with zonal statistics (clipped, projected)
-     v_file: shapefile of basin boundaries (these boundaries are used as the polygons in the zonal stats calculations)
-     csv_by_date: full pathname of folder containing the results by date (.csv file)
-     csv_by_basin: full pathname of folder containing the results by basin (.csv file)"""
-
-    logger.info('create_csv_files: Starting {}'.format(file))
-
-    # Envelop input shapefile as QGS object vector layer
-    vector_file = QgsVectorLayer(v_file, 'Reprojected Basins', 'ogr')
-
-    # Check to determine if the shapefile is valid as an object. If this test shows that the shapefile is not a valid
-    # vector file, the script does not run the zonal statistic processing (located in the 'else' block of code). If the
-    # user gets the following error message, it is important to address the initialization of the QGIS resources.
-    if not vector_file.isValid():
-        logger.warning('create_csv_files: Vector basin boundary shapefile is not a valid QGS object layer.')
+        return file_full_output_snow
     else:
-
-        # Hold current directory in variable.
-        curr_dir = Path.cwd()
-
-        # Retrieve date of current file. Filename: 'SNODAS_SWE_ClipAndProjYYYYMMDD'. File[22:30] pulls the
-        # 'YYYYMMDD' section.
-        date_name = file[22:30]
-
-        # Define fieldnames for output .csv files. These MUST match the keys of the dictionaries. Fieldnames make up
-        # the header row of the .csv output files. The column headers of the .csv files are in
-        # sequential order as laid out in the fieldnames list.
-        fieldnames = ['Date_YYYYMMDD', ID_FIELD_NAME, 'LOCAL_NAME', 'SNODAS_SWE_Mean_in', 'SNODAS_SWE_Mean_mm',
-                      'SNODAS_EffectiveArea_sqmi', 'SNODAS_SWE_Volume_acft', 'SNODAS_SWE_Volume_1WeekChange_acft',
-                      'SNODAS_SnowCover_percent', 'Updated_Timestamp']
-
-        if CALCULATE_SWE_MAX.upper() == 'TRUE':
-            fieldnames.extend(['SNODAS_SWE_Max_in', 'SNODAS_SWE_Max_mm'])
-
-        if CALCULATE_SWE_MIN.upper() == 'TRUE':
-            fieldnames.extend(['SNODAS_SWE_Min_in', 'SNODAS_SWE_Min_mm'])
-
-        if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-            fieldnames.extend(['SNODAS_SWE_StdDev_in', 'SNODAS_SWE_StdDev_mm'])
-
-        # Create string variable for name of .csv output file by date. Name: SnowpackStatisticsByDate_YYYYMMDD.csv.
-        results_date = 'SnowpackStatisticsByDate_' + date_name + '.csv'
-
-        # Check to see if the output file has already been created.
-        if csv_by_date.joinpath(results_date).exists():
-            if not file.endswith('.aux.xml'):
-                logger.info('create_csv_files: {} has been previously created. Overwriting.'.format(file))
-
-        # Set directory where the output .csv daily files are stored. - By Date
-        os.chdir(csv_by_date)
-
-        logger.info('create_csv_files: Creating {}'.format(results_date))
-
-        # Create .csv file with the appropriate fieldnames as the info in the header row. - By Date
-        with open(results_date, 'w') as csv_file:
-            if LINUX_OS:
-                writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=",")
-            else:
-                writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=",", lineterminator='\n')
-            writer.writeheader()
-
-        # Iterate through each basin of the basin boundary shapefile.
-        for feature in vector_file.getFeatures():
-
-            # Create str variable for the name of output .csv file byBasin. Name: SnowpackStatisticsByBasin_LOCALID.csv.
-            results_basin = 'SnowpackStatisticsByBasin_' + feature[ID_FIELD_NAME] + '.csv'
-
-            # Check to see if the output file has already been created. If so, the script moves onto the raster
-            # processing. If not, a .csv file is created with the appropriate fieldnames as the info in the
-            # header row. - By Basin
-            if not csv_by_basin.joinpath(results_basin).exists():
-
-                # Set directory where the output .csv daily files are stored - By Basin
-                os.chdir(csv_by_basin)
-
-                logger.info('create_csv_files: Creating {}'.format(results_basin))
-
-                # Create .csv file with appropriate fieldnames as the header row. - By Date
-                with open(results_basin, 'w') as csv_file:
-                    writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=",")
-                    writer.writeheader()
-
-                # Return directory back to original
-                os.chdir(curr_dir)
-
-    logger.info('create_csv_files: Finished {}.\n'.format(file))
-
-
-def delete_by_basin_csv_repeated_rows(file: str, v_file: str, csv_by_basin: Path) -> None:
-    """ Check to see if date has already been processed. If so, iterate through by basin csv file and only write rows
-    to new csv file that do not start with the date. Ultimately, delete row of data for today's date so that new data
-    can be overwritten without producing multiple rows of the same date.
-    file: daily .tif file  to be processed with zonal statistics (clipped, projected)
-    v_file: shapefile of basin boundaries (these boundaries are used as the polygons in the zonal stats calculations)
-    csv_by_basin: full pathname of folder containing the results by basin (.csv file) """
-
-    logger.info('delete_by_basin_csv_repeated_rows: Starting {}'.format(file))
-
-    # Envelop input shapefile as QGS object vector layer
-    vector_file = QgsVectorLayer(v_file, 'Reprojected Basins', 'ogr')
-
-    # Check to determine if the shapefile is valid as an object. If this test shows that the shapefile is not a valid
-    # vector file, the script does not run the zonal statistic processing (located in the 'else' block of code). If the
-    # user gets the  following error message, it is important to address the initialization of the QGIS resources.
-    if not vector_file.isValid():
-        logger.warning('delete_by_basin_csv_repeated_rows: Vector basin boundary shapefile is not a valid QGS'
-                       ' object layer.')
-    else:
-        # Hold current directory in a variable, current_dir, to be used at the end of the script.
-        current_dir = Path.cwd()
-        results_basin = None
-
-        # Retrieve date of current file. File name is 'SNODAS_SWE_ClipAndProjYYYYMMDD'. File[22:30] is pulling the
-        # 'YYYYMMDD' section.
-        date_name = file[22:30]
-
-        # Iterate through each basin of the basin boundary shapefile.
-        for feature in vector_file.getFeatures():
-            # Create string variable to be used as the title for the .csv output file - By Basin
-            results_basin = 'SnowpackStatisticsByBasin_' + feature[ID_FIELD_NAME] + '.csv'
-            break
-
-        # Set directory where the output .csv daily files are stored. - By Basin
-        os.chdir(csv_by_basin)
-        # Check to see if the daily raster has already been processed. The first CSV file is read and put into
-        # file_contents. Then it is immediately closed so there are no issues trying to close it later.
-        file_handler = open(results_basin)
-        file_contents = file_handler.read()
-        file_handler.close()
-
-        if date_name in file_contents and file.endswith('.tif'):
-            logger.info('delete_by_basin_csv_repeated_rows: Raster {} has already been processed.'.format(file))
-
-            # Iterate through each basin of the basin boundary shapefile.
-            for feature in vector_file.getFeatures():
-
-                # Create string variable to be used as the title for the input and output .csv file - By Basin
-                results_basin_og = 'SnowpackStatisticsByBasin_' + feature[ID_FIELD_NAME] + '.csv'
-                results_basin_edit = 'SnowpackStatisticsByBasin_' + feature[ID_FIELD_NAME] + 'edit.csv'
-
-                logger.info('delete_by_basin_csv_repeated_rows: Rewriting {}.'.format(results_basin_og))
-
-                # Open input_file and output_file files. Input will be read and output_file will be written.
-                input_file = open(results_basin_og, 'r')
-                output_file = open(results_basin_edit, 'w')
-
-                # If the first row in the input_file file is file's date, it is not written to the new file.
-                # Essentially, it is deleted.
-                writer = csv.writer(output_file)
-                for row in csv.reader(input_file):
-                    if row[0] != date_name:
-                        writer.writerow(row)
-                input_file.close()
-                output_file.close()
-
-                # Delete original, now inaccurate, csvByBasin file.
-                try:
-                    Path(results_basin_og).unlink()
-                except OSError as e:
-                    logger.error('delete_by_basin_csv_repeated_rows: {}'.format(e))
-
-                # Rename the new edited csvByBasin file to its original name of SnowpackStatisticsByBasin_ +
-                # feature[ID_FIELD_NAME] + '.csv'
-                Path(results_basin_edit).rename(results_basin_og)
-
-            # Return directory back to original
-            os.chdir(current_dir)
-
-    logger.info('delete_by_basin_csv_repeated_rows: Finished {} \n'.format(file))
-
-
-def zip_shapefile(file: str, csv_by_date: Path, delete_original: str) -> None:
-    # Code block from http://emilsarcpython.blogspot.com/2015/10/zipping-shapefiles-with-python.html
-    # List of file extensions included in the shapefile
-    # file: the output shapefile (any extension). All other extensions will be included by means of the function.
-    # csv_by_date: full pathname of folder containing the results by date (.csv files, GeoJSON, and shapefiles)
-    # delete_original: Boolean string to determine if the original unzipped shapefile files should be deleted.
-    extensions = ['.shx', '.shp', '.qpj', '.prj', '.dbf', '.cpg']
-
-    # Define naming conventions
-    in_name = Path(file).stem
-    file_to_zip = csv_by_date / (in_name + '.zip')
-    # The third argument for zipfile - ZIP_DEFLATED - is what actually compresses the file. Otherwise, the file
-    # is essentially copied.
-    zip_file = zipfile.ZipFile(str(file_to_zip), 'w', zipfile.ZIP_DEFLATED)
-
-    # Empty list to store files to delete
-    files_to_delete = []
-
-    for fl in os.listdir(csv_by_date):
-        for extension in extensions:
-            if fl == (in_name + extension):
-                # Get full pathname of file
-                in_file = csv_by_date / fl
-                files_to_delete += [str(in_file)]
-                zip_file.write(str(in_file), fl)
-                break
-    zip_file.close()
-
-    # Delete unzipped shapefile files, if configured.
-    if delete_original.upper() == 'TRUE':
-        for fl in files_to_delete:
-            Path(fl).unlink()
-
-
-def z_stat_and_export(file: str, v_file: str, csv_by_basin: Path, csv_by_date: Path, dir_clip: Path,
-                      dir_snow: Path, today_date: datetime, timestamp: str, output_crs_epsg: str) -> None:
-    """Calculate zonal statistics of basin boundary shapefile and the current SNODAS file. The zonal stats export to
-    both the byDate and the byBasin csv files. A daily shapefile and geoJSON is also exported.
-    file: daily raster .tif SNODAS file that is to be processed in the zonal statistics tool (clipped, projected)
-    vfile: the basin boundary shapefile (used as the zone dataset for the zonal statistics calculations)
-    csv_by_date: full pathname to the folder containing results by date (.csv file). Shapefile and GeoJSON saved here.
-    csv_by_basin: full pathname to the folder containing results by basin (.csv file)
-    dir_clip: full pathname to the folder containing all daily clipped, projected .tif SNODAS rasters
-    dir_snow: full pathname to the folder containing all binary snow coverage rasters
-    today_date: date of processed SNODAS data in datetime format
-    timestamp: the download timestamp in datetime format (returned in download_snodas function)
-    output_crs_epsg: the desired projection of the output shapefile and geoJSON (configured in configuration file)"""
-
-    # Create empty dictionary to hold the zonal statistic outputs before they are written to the .csv files.
-    # Shapefiles have a limited number of fields available in the attribute table so the statistics must be calculated,
-    # exported and then deleted from the shapefile.
-    d = {}
-
-    # Hold current directory in a variable, curr_dir, to be called at the end of the script.
-    curr_dir = Path.cwd()
-
-    # Retrieve date of current file. File : SNODAS_SWE_ClipAndProjYYYYMMDD. File[22:30] : YYYYMMDD.
-    date_name = file[22:30]
-
-    # Define fieldnames for output .csv files (the header row). These MUST match the keys of the dictionaries. The
-    # column headers of the .csv files are in sequential order as displayed in the fieldnames list.
-    fieldnames = ['Date_YYYYMMDD', ID_FIELD_NAME, 'LOCAL_NAME', 'SNODAS_SWE_Mean_in', 'SNODAS_SWE_Mean_mm',
-                  'SNODAS_EffectiveArea_sqmi', 'SNODAS_SWE_Volume_acft', 'SNODAS_SWE_Volume_1WeekChange_acft',
-                  'SNODAS_SnowCover_percent', 'Updated_Timestamp']
-
-    if CALCULATE_SWE_MAX.upper() == 'TRUE':
-        fieldnames.extend(['SNODAS_SWE_Max_in', 'SNODAS_SWE_Max_mm'])
-
-    if CALCULATE_SWE_MIN.upper() == 'TRUE':
-        fieldnames.extend(['SNODAS_SWE_Min_in', 'SNODAS_SWE_Min_mm'])
-
-    if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-        fieldnames.extend(['SNODAS_SWE_StdDev_in', 'SNODAS_SWE_StdDev_mm'])
-
-    # Envelop input shapefile (for example, the Colorado River Basin projected shapefile) as a QGS object vector layer.
-    vector_layer = QgsVectorLayer(v_file, 'Reprojected Basins', 'ogr')
-
-    # Check validity of shapefile as a QGS object. If this test shows that the vector is not a valid  vector file,
-    # the script does not run the zonal statistic processing (located in the 'else' block of code). Address the
-    # initialization of the QGIS resources if received following error message.
-    if not vector_layer.isValid():
-        logger.warning('z_stat_and_export: Vector shapefile is not a valid QGS object layer.')
-
-    else:
-        # Check for extension .tif
-        if file.upper().endswith('.TIF'):
-            # Set conditional variables so they are defined
-            e_min = None
-            e_swe_min_in = None
-            e_max = None
-            e_swe_max_in = None
-            e_std = None
-            e_swe_s_dev_in = None
-
-            # Set directory to the directory where the output .csv daily files are contained - By Basin
-            os.chdir(csv_by_basin)
-
-            # Create date value of the working dictionary.
-            d['Date_YYYYMMDD'] = date_name
-
-            logger.info('z_stat_and_export: Processing zonal statistics by basin of {} ...'.format(file))
-
-            # Retrieve the datetime date for 7 days before today and convert to string format (YYYYMMDD).
-            week_ago_date = today_date - timedelta(days=7)
-            week_ago_str = format_date_yyyymmdd(week_ago_date)
-
-            # Create string variable with week_ago_str to be used as the title for the .csv output file - By Date
-            results_date_csv = 'SnowpackStatisticsByDate_' + week_ago_str + '.csv'
-            results_date_csv_full_path = csv_by_date / results_date_csv
-
-            # Set full pathname of rasters for later input into the zonal stat tool
-            snow_file = 'SNODAS_SnowCover_ClipAndProj' + date_name + '.tif'
-            raster_path_h = dir_clip / file
-            raster_path_s = dir_snow / snow_file
-
-            # Open vector_layer for editing
-            vector_layer.startEditing()
-
-            # Create the raster layer, needed by QgsZonalStatistics
-            raster_layer = QgsRasterLayer(str(raster_path_h))
-            snow_raster_layer = QgsRasterLayer(str(raster_path_s))
-
-            # Set input object options for the zonal stat tool - Mean.
-            # input shapefile: must be a valid QGS vector layer.
-            # input raster: Must be a valid QGS raster layer.
-            # field prefix (string): Prefix of the attribute field header containing the zonal statistics.
-            # band (integer): Band of raster in which the calculations are processed.
-            # statistics type: Zonal statistic to be calculated.
-
-            zonal_stats = QgsZonalStatistics(vector_layer, raster_layer, "SWE_", 1, QgsZonalStatistics.Mean)
-            zonal_stats.calculateStatistics(None)
-
-            # output_dict - key: csv field name value: [shapefile attribute field name, attribute field type
-            # ('None' for outputs of zonal statistics because a new field does not need to be created)]
-            output_dict = {
-                ID_FIELD_NAME: [ID_FIELD_NAME, 'None'],
-                'LOCAL_NAME': ['LOCAL_NAME', 'None'],
-                'SNODAS_SWE_Mean_in': ['SWEMean_in', QVariant.Double],
-                'SNODAS_SWE_Mean_mm': ['SWE_mean', 'None'],
-                'SNODAS_EffectiveArea_sqmi': ['Area_sqmi', QVariant.Double],
-                'SNODAS_SWE_Volume_acft': ['SWEVol_af', QVariant.Int],
-                'SNODAS_SWE_Volume_1WeekChange_acft': ['SWEVolC_af', QVariant.Int],
-                'SNODAS_SnowCover_percent': ['SCover_pct', QVariant.Double]
-            }
-
-            if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                output_dict.update({'SNODAS_SWE_Min_mm': ['SWE_min', 'None'],
-                                   'SNODAS_SWE_Min_in': ['SWEMin_in', QVariant.Double]})
-
-            if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                output_dict.update({'SNODAS_SWE_Max_mm': ['SWE_max', 'None'],
-                                   'SNODAS_SWE_Max_in': ['SWEMax_in', QVariant.Double]})
-
-            if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                output_dict.update({'SNODAS_SWE_StdDev_mm': ['SWE_stdev', 'None'],
-                                   'SNODAS_SWE_StdDev_in': ['SWESDev_in', QVariant.Double]})
-
-            # Create new fields in shapefile attribute table. Ignore fields that are already populated by zstats plugin.
-            for key, value in output_dict.items():
-                if value[1] != 'None':
-                    new_field = QgsField(value[0], value[1])
-                    vector_layer.dataProvider().addAttributes([new_field])
-
-            # Set raster calculator expression to populate the 'Mean' field. This field calculates mm. Change the
-            # QGSExpression if different units are desired.
-            e_mean = QgsExpression('SWE_mean')
-
-            # Set the raster calculator expression to populate the 'SWEMean_in' field.
-            # 25.4 is the number of millimeters in an inch.
-            e_swe_mean_in = QgsExpression('SWE_mean / 25.4')
-
-            if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                # Set input object options for the zonal stat tool - Minimum
-                zonal_stats = QgsZonalStatistics(vector_layer, raster_layer, "SWE_", 1, QgsZonalStatistics.Min)
-                # Call zonal stat tool to start processing
-                zonal_stats.calculateStatistics(None)
-
-                # Set raster calculator expression to populate the 'Min' field.
-                e_min = QgsExpression('SWE_min')
-
-                # Set the raster calculator expression to populate the 'SWEMin_in' field.
-                e_swe_min_in = QgsExpression('SWE_min  / 25.4')
-
-            if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                # Set input object options for zonal stat tool - Maximum
-                zonal_stats = QgsZonalStatistics(vector_layer, raster_layer, "SWE_", 1, QgsZonalStatistics.Max)
-                # Call zonal stat tool to start processing
-                zonal_stats.calculateStatistics(None)
-
-                # Set raster calculator expression to populate the 'Max' field.
-                e_max = QgsExpression('SWE_max')
-
-                # Set the raster calculator expression to populate the 'SWEMax_in' field.
-                e_swe_max_in = QgsExpression('SWE_max / 25.4')
-
-            if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                # Set input object options for the zonal stat tool - Standard Deviation
-                zonal_stats = QgsZonalStatistics(vector_layer, raster_layer, "SWE_", 1, QgsZonalStatistics.StDev)
-                # Call zonal stat tool to start processing
-                zonal_stats.calculateStatistics(None)
-
-                # Set raster calculator expression to populate the 'Std Dev' field.
-                e_std = QgsExpression('SWE_stdev')
-
-                # Set the raster calculator expression to populate the 'SWESDev_in' field.
-                e_swe_s_dev_in = QgsExpression('SWE_stdev / 25.4')
-
-            # Set input object options for the zonal stat tool - Count of Total Basin Cells
-            zonal_stats = QgsZonalStatistics(vector_layer, raster_layer, "Cell", 1, QgsZonalStatistics.Count)
-            # Call zonal stat tool to start processing
-            zonal_stats.calculateStatistics(None)
-
-            # Set input object options for the zonal stat tool - Sum of snow cover raster
-            zonal_stats = QgsZonalStatistics(vector_layer, snow_raster_layer, "SCover", 1, QgsZonalStatistics.Sum)
-            # Call zonal stat tool to start processing
-            zonal_stats.calculateStatistics(None)
-
-            # Update changes to fields of shapefile.
-            vector_layer.updateFields()
-
-            # Set raster calculator expression to populate the 'Area_sqmi' field. The area of the cell (square meters)
-            # multiplied by the count of basin cells . There are 2589988.10 sq meters in 1 sq mile.
-            a = QgsExpression('({}) * ({}) * Cellcount / 2589988.10'.format(CELL_SIZE_X, CELL_SIZE_Y))
-
-            # Set raster calculator expression  to populate the 'SCover_pct' field. Sum of basin cells covered by snow
-            # divided by total count of basin cells.
-            e = QgsExpression('SCoversum / Cellcount * 100')
-
-            # Set raster calculator expression to populate 'SWEVol_af' field. Mean SWE (mm) multiplied by effective area
-            # 'Area_sqmi' divided by 304.8. There are 640 acres in 1 square mile. There are 304.8 mm in 1 foot.
-            v = QgsExpression('Area_sqmi * SWE_mean * 640 / 304.8')
-
-            # Create an empty array to hold the components of the zonal stats calculations dictionary. This
-            # array is copied to the .csv output file and then erased only to be filled again
-            # with the next daily raster's dictionary calculations. - By Date. There are two arrays in this
-            # function, array_date and array_basin. The main difference is that the array_basin only holds one
-            # dictionary at a time before it writes to a .csv file (one dictionary per basin and then the
-            # information is deleted). The array_date holds multiple dictionaries at one time (one dictionary
-            # per basin. The information in the array is only deleted after the date changes).
-            array_date = []
-
-            # Set directory to the directory where the output .csv daily files are stored - By Basin
-            os.chdir(csv_by_basin)
-
-            # Define output coordinate reference system
-            output_crs = "EPSG:" + output_crs_epsg
-
-            # Iterate through each basin of the basin boundary shapefile.
-            for feature in vector_layer.getFeatures():
-
-                # Check to see if the SNODAS data has already been processed for the week_ago date.
-                os.chdir(csv_by_date)
-
-                # If so, get the volume value from last week for each basin. The for loop iterates over the basins
-                # and calculates the one-week-change in volume statistic.
-                if results_date_csv_full_path.exists():
-                    with open(results_date_csv) as csv_file:
-                        reader = csv.DictReader(csv_file)
-                        has_rows = False
-                        for row in reader:
-                            has_rows = True
-                            if row['{}'.format(ID_FIELD_NAME)] == feature[ID_FIELD_NAME]:
-                                week_ago_value = row['SNODAS_SWE_Volume_acft']
-                                break
-
-                        if not has_rows:
-                            print('The DictReader is empty.')
-
-                    # Set raster calculator expression to populate 'SWEVolC_af' field.
-                    # 'SWEVol_af' from today - 'SWEVol_af' from 7 days ago
-                    c = QgsExpression('SWEVol_af - {}'.format(week_ago_value))
-
-                else:
-                    c = QgsExpression('noData')
-
-                os.chdir(csv_by_basin)
-
-                # Create string variable to be used as the title for the output .csv file - By Basin
-                results_basin = 'SnowpackStatisticsByBasin_' + feature[ID_FIELD_NAME] + '.csv'
-
-                # Create dictionary that sets rounding properties (to what decimal place) for each field. Key is the
-                # field name. Value[0] is the preset raster calculator expression. Value[1] is the number of decimals
-                # that the field is rounded to.
-                rounding_props = {
-                    'SCover_pct': [e, 2],
-                    'Area_sqmi': [a, 1],
-                    'SWE_mean': [e_mean, 0],
-                    'SWEMean_in': [e_swe_mean_in, 1],
-                    'SWEVol_af': [v, 0],
-                    'SWEVolC_af': [c, 0]
-                }
-
-                if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                    rounding_props['SWE_min'] = [e_min, 0]
-                    rounding_props['SWEMin_in'] = [e_swe_min_in, 1]
-                if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                    rounding_props['SWE_max'] = [e_max, 0]
-                    rounding_props['SWEMax_in'] = [e_swe_max_in, 1]
-                if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                    rounding_props['SWE_stdev'] = [e_std, 0]
-                    rounding_props['SWESDev_in'] = [e_swe_s_dev_in, 1]
-
-                # Perform raster calculations for each field.
-                for key, value in rounding_props.items():
-                    # Both the context and the scope need to be created for each evaluation. If done in the feature for
-                    # loop, a segmentation fault occurs. If done outside the feature for-loop, a double free takes place
-                    context = QgsExpressionContext()
-                    scope = QgsExpressionContextScope()
-                    scope.setFeature(feature)
-                    context.appendScope(scope)
-
-                    expression = value[0]
-                    feature[key] = expression.evaluate(context)
-
-                # Round the raster calculations to appropriate decimal places (defined in rounding dictionary). All
-                # rounding is completed AFTER all calculations have been completed.
-                for key, value in rounding_props.items():
-                    context = QgsExpressionContext()
-                    scope = QgsExpressionContextScope()
-                    scope.setFeature(feature)
-                    context.appendScope(scope)
-
-                    rounding = value[1]
-                    s = QgsExpression('round({},{})'.format(key, rounding))
-                    feature[key] = s.evaluate(context)
-
-                # Update features of basin shapefile.
-                vector_layer.updateFeature(feature)
-
-                # Create empty array (basin) to hold the components of the zonal stats calculations.
-                array_basin = []
-
-                # Append stats to dictionary 'd'.
-                d['Updated_Timestamp'] = timestamp
-
-                for key, value in output_dict.items():
-                    d[key] = feature[value[0]]
-
-                # Append current dictionary to the empty basin array. This array is exported to the
-                # output .csv file at the end of this 'for' loop.
-                array_basin.append(d.copy())
-
-                # Append current dictionary to the empty basin array. This array is exported to the
-                # output .csv file outside of this 'for' loop.
-                array_date.append(d.copy())
-
-                # Export the daily date array to a .csv file. Overwrite the .csv file if it already exists.
-                # Ref: http://stackoverflow.com/questions/28555112/export-a-simple-dictionary-into-excel-file-in-python
-                with open(results_basin, 'a') as csv_file:
-                    csv_writer = csv.DictWriter(csv_file, delimiter=",", fieldnames=fieldnames)
-                    for row in array_basin:
-                        csv_writer.writerow(row)
-                # Read and sort every line but the header.
-                with open(results_basin, 'r') as full_csv_file:
-                    csv_file_contents = list(full_csv_file)
-                    csv_file_contents[1:] = sorted(csv_file_contents[1:])
-                # Write the sorted list to the file.
-                with open(results_basin, 'w') as sorted_csv_file:
-                    for item in csv_file_contents:
-                        sorted_csv_file.write('{}'.format(item))
-
-            # Close edits and save changes to the shapefile.
-            vector_layer.commitChanges()
-
-            # Delete attribute fields of the shapefile used in the calculations but not important for export to final
-            # product shapefile.
-            cell_count_index = vector_layer.dataProvider().fieldNameIndex('CellCount')
-            s_cover_sum_index = vector_layer.dataProvider().fieldNameIndex('SCoversum')
-            vector_layer.dataProvider().deleteAttributes([cell_count_index, s_cover_sum_index])
-
-            # Update shapefile with its newly-named attribute fields.
-            vector_layer.updateFields()
-
-            # Create daily shapefile and daily geoJSON.
-            shapefile_name = 'SnowpackStatisticsByDate_' + date_name + '.shp'
-            geojson_name = 'SnowpackStatisticsByDate_' + date_name + '.geojson'
-            shapefile_name_full = csv_by_date / shapefile_name
-            geojson_name_full = csv_by_date / geojson_name
-
-            # Rename attribute field names defaulted by QGS Zonal Stat tool to the desired field name
-            swe_mean_index = vector_layer.dataProvider().fieldNameIndex('SWE_mean')
-            vector_layer.dataProvider().renameAttributes({swe_mean_index: 'SWEMean_mm'})
-
-            if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                swe_min_index = vector_layer.dataProvider().fieldNameIndex('SWE_min')
-                vector_layer.dataProvider().renameAttributes({swe_min_index: 'SWEMin_mm'})
-
-            if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                swe_max_index = vector_layer.dataProvider().fieldNameIndex('SWE_max')
-                vector_layer.dataProvider().renameAttributes({swe_max_index: 'SWEMax_mm'})
-
-            if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                s_std_dev_index = vector_layer.dataProvider().fieldNameIndex('SWE_stdev')
-                vector_layer.dataProvider().renameAttributes({s_std_dev_index: 'SWESDev_mm'})
-
-            vector_layer.updateFields()
-            vector_layer.commitChanges()
-
-            # Export geojson and shapefile. (layer, full output pathname, file encoding, destination reference system,
-            # output file type, layer options (GeoJSON): number of decimal places used in GeoJSON geometry)
-            # crs_transform = QgsCoordinateTransformContext()
-            # options = QgsVectorFileWriter.SaveVectorOptions()
-            # QgsVectorFileWriter.writeAsVectorFormatV2(layer=vector_layer, fileName=geojson_name_full,
-            #                                           transformContext=crs_transform, options=options)
-
-            QgsVectorFileWriter.writeAsVectorFormat(vector_layer, str(geojson_name_full), "utf-8",
-                                                    QgsCoordinateReferenceSystem(output_crs), "GeoJSON",
-                                                    layerOptions=['COORDINATE_PRECISION=%s' % GEOJSON_PRECISION])
-            QgsVectorFileWriter.writeAsVectorFormat(vector_layer, str(shapefile_name_full), "utf-8",
-                                                    QgsCoordinateReferenceSystem(output_crs), "ESRI Shapefile")
-
-            # Change fieldnames of output GeoJSON file. Envelop GeoJSON file as a QGS object vector layer.
-            # new_name = geojson_name.replace(".geojson", "_intermediate.geojson")
-            # int_geojson_name_full = csv_by_date / new_name
-            # geojson_name_full.rename(int_geojson_name_full)
-
-            vector_file_geojson = QgsVectorLayer(str(geojson_name_full), 'GeoJsonStatistics', 'ogr')
-
-            # Rename attribute fields of GeoJSON.
-            if not LINUX_OS:
-
-                # Open vector_file for editing
-                vector_file_geojson.startEditing()
-
-                # Rename attribute field names defaulted by QGS Zonal Stat tool to the desired field name
-                fields = {'SWEMean_mm': 'SNODAS_SWE_Mean_mm', 'SWEVolC_af': 'SNODAS_SWE_Volume_1WeekChange_acft',
-                          'SWEMean_in': 'SNODAS_SWE_Mean_in', 'Area_sqmi': 'SNODAS_EffectiveArea_sqmi',
-                          'SWEVol_af': 'SNODAS_SWE_Volume_acft', 'SCover_pct': 'SNODAS_SnowCover_percent'}
-
-                if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                    fields.update({'SWEMin_mm': 'SNODAS_SWE_Min_mm', 'SWEMin_in': 'SNODAS_SWE_Min_in'})
-
-                if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                    fields.update({'SWEMax_mm': 'SNODAS_SWE_Max_mm', 'SWEMax_in': 'SNODAS_SWE_Max_in'})
-
-                if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                    fields.update({'SWESDev_mm': 'SNODAS_SWE_StdDev_mm', 'SWESDev_in': 'SNODAS_SWE_StdDev_in'})
-
-                for key, value in fields.items():
-                    index = vector_file_geojson.dataProvider().fieldNameIndex(key)
-                    vector_file_geojson.dataProvider().renameAttributes({index: value})
-
-                # Update the changes to the field names and remove the intermediate GeoJSON file
-                # (with shapefile fieldnames)
-                vector_file_geojson.updateFields()
-                commit_status = vector_file_geojson.commitChanges()
-                print('Layer changes committed.') if commit_status else print('Layer commit failed.')
-
-            # Export geojson. (layer, full output pathname, file encoding, destination reference system,
-            # output file type, layer options (GeoJSON): number of decimal places used in GeoJSON geometry)
-            QgsVectorFileWriter.writeAsVectorFormat(vector_file_geojson, str(geojson_name_full), "utf-8",
-                                                    QgsCoordinateReferenceSystem(output_crs), "GeoJSON",
-                                                    layerOptions=['COORDINATE_PRECISION={}'.format(GEOJSON_PRECISION)])
-
-            # Rename attribute fields of GeoJSON.
-            if LINUX_OS:
-                change_field_names(str(geojson_name_full))
-
-            if GEOJSON_ZIP.upper() == 'TRUE':
-                with zipfile.ZipFile(str(geojson_name_full) + '.zip', 'w', zipfile.ZIP_DEFLATED) as my_zip:
-                    my_zip.write(geojson_name_full)
-                # Delete the uncompressed geojson file.
-                geojson_name_full.unlink()
-
-            # Close the vector_file_geojson so that the vector_layer can open
-            # print('int_geojson_name_full: {}'.format(int_geojson_name_full))
-            # int_geojson_name_full.unlink()
-            vector_layer.startEditing()
-
-            # Delete attribute fields of the shapefile related to the daily calculated zonal statistics.
-            field_names = ['SWEMean_mm', 'SCover_pct', 'SWEMean_in', 'Area_sqmi', 'SWEVolC_af', 'SWEVol_af']
-            if CALCULATE_SWE_MIN.upper() == 'TRUE':
-                field_names.extend(['SWEMin_mm', 'SWEMin_in'])
-            if CALCULATE_SWE_MAX.upper() == 'TRUE':
-                field_names.extend(['SWEMax_mm', 'SWEMax_in'])
-            if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-                field_names.extend(['SWESDev_mm', 'SWESDev_in'])
-
-            for item in field_names:
-                index = vector_layer.dataProvider().fieldNameIndex(item)
-                vector_layer.dataProvider().deleteAttributes([index])
-
-            # Update shapefile with its newly-deleted attribute fields.
-            vector_layer.updateFields()
-            vector_layer.commitChanges()
-
-            # Create a string variable to be used as the title for the .csv output file - By Date.
-            results_date = 'SnowpackStatisticsByDate_' + date_name + '.csv'
-
-            # Set directory to the directory where the output .csv daily files are contained. - By Date.
-            os.chdir(csv_by_date)
-
-            # Update text file, ListOfDates.txt, with list of dates represented by csv files in the ByDate folder.
-            array = glob.glob("*.csv")
-            array.sort(reverse=True)
-            array_recent_date = []
-
-            with open("ListOfDates.txt", 'w') as output_file:
-                for filename in array:
-                    if filename.endswith("LatestDate.csv") is False and "Upstream" not in str(filename):
-                        date = filename[25:33]
-                        try:
-                            int(date)
-                            array_recent_date.append(date)
-                            output_file.write(date + "\n")
-                        except ValueError:
-                            continue
-
-            # Export the daily date array to a .csv file. Overwrite the .csv file if it already exists.
-            # Ref: http://stackoverflow.com/questions/28555112/export-a-simple-dictionary-into-excel-file-in-python
-            with open(results_date, 'a') as csv_file:
-                csv_writer = csv.DictWriter(csv_file, delimiter=",", fieldnames=fieldnames)
-                for row in array_date:
-                    csv_writer.writerow(row)
-
-            # Get most recent processed SNODAS date & make a copy called 'SnowpackStatisticsByDate_LatestDate.csv'
-            # and 'SnowpackStatisticsByDate_LatestDate.geojson' and 'SnowpackStatisticsByDate_LatestDate.zip/.shp'
-            most_recent_date = str(max(array_recent_date))
-            src = 'SnowpackStatisticsByDate_' + most_recent_date + '.csv'
-            dst = 'SnowpackStatisticsByDate_LatestDate.csv'
-            copyfile(str(csv_by_date / src), str(csv_by_date / dst))
-            src = 'SnowpackStatisticsByDate_' + most_recent_date + '.geojson'
-            dst = 'SnowpackStatisticsByDate_LatestDate.geojson'
-            copyfile(str(csv_by_date / src), str(csv_by_date / dst))
-            # List of extensions referring to the output shapefile
-            ext_list = ['.cpg', '.dbf', '.prj', '.qpj', '.shp', '.shx']
-            for item in ext_list:
-                src = 'SnowpackStatisticsByDate_' + most_recent_date + item
-                dst = 'SnowpackStatisticsByDate_LatestDate' + item
-                if Path(src).exists():
-                    copyfile(str(csv_by_date / src), str(csv_by_date / dst))
-
-            # Return working directory back to its original setting before the script began.
-            os.chdir(curr_dir)
-
-            logger.info('z_stat_and_export: Zonal statistics of {} are exported to {}'.format(file, csv_by_basin))
-            print("Zonal statistics of {} are complete. \n".format(date_name))
-
-        else:
-            logger.info('z_stat_and_export: {} is not a .tif file and the zonal statistics were not processed.\n'
-                        .format(file))
+        logger.warning("snow_coverage: {} does not start with 'Repj'. No raster calculation took place.\n".format(file))
+        return None
 
 
 def create_snodas_swe_graphs() -> None:
@@ -1670,10 +966,10 @@ def push_to_gcp() -> None:
     logger.info('push_to_gcp: Pushing files to Google Cloud Platform bucket given details from {}.'
         .format(gcp_shell_script))
 
-    # Call shell script, gcp_shell_script, to push files up to GCP.
-    os.chdir(script_location)
+    # Call shell script, gcp_shell_script, to push files up to GCP. The script is run from script_location without
+    # changing the working directory of this process.
     try:
-        with subprocess.Popen(['bash', gcp_shell_script]) as _:
+        with subprocess.Popen(['bash', gcp_shell_script], cwd=script_location) as _:
             pass
     except OSError as bad_file:
         error_message = 'push_to_gcp: Error pushing to GCP: {}\nConfirm the path to the GCP bash script is correct.'\
@@ -1686,61 +982,6 @@ def push_to_gcp() -> None:
                 .format(gcp_shell_script))
 
 
-def change_field_names(geojson_file: str) -> None:
-    """Renames the attribute field names of the output GeoJSON file for each date. This function is only to be used in
-    the Linux environment because the Windows environment already has a built in attribute field editor within the
-    QGIS software. When the built-in QGIS mechanism is run on the Linux machine the following error is printed.
-    Error 6: AlterFieldDefn() not supported by this layer.
-
-    This function will create a separate geojson file with the updated attribute fields. The original geojson will be
-    deleted and the new geojson will be renamed to the original geojson name.
-
-    Args:
-        geojson_file: the full pathname to the GeoJSON file to be edited.
-
-    Returns: None
-    """
-
-    # Get the text content of the original GeoJSON file.
-    file_handler = open(geojson_file, 'r')
-    geojson_content = file_handler.read()
-    file_handler.close()
-    # with open(geojson_file, 'r') as geojson:
-    #     geojson_content = geojson.read()
-
-    # Rename attribute field names defaulted by QGS Zonal Stat tool to the desired field name
-    fields = {'SWEMean_mm': 'SNODAS_SWE_Mean_mm', 'SWEVolC_af': 'SNODAS_SWE_Volume_1WeekChange_acft',
-              'SWEMean_in': 'SNODAS_SWE_Mean_in', 'Area_sqmi': 'SNODAS_EffectiveArea_sqmi',
-              'SWEVol_af': 'SNODAS_SWE_Volume_acft', 'SCover_pct': 'SNODAS_SnowCover_percent'}
-
-    if CALCULATE_SWE_MIN.upper() == 'TRUE':
-        fields.update({'SWEMin_mm': 'SNODAS_SWE_Min_mm', 'SWEMin_in': 'SNODAS_SWE_Min_in'})
-
-    if CALCULATE_SWE_MAX.upper() == 'TRUE':
-        fields.update({'SWEMax_mm': 'SNODAS_SWE_Max_mm', 'SWEMax_in': 'SNODAS_SWE_Max_in'})
-
-    if CALCULATE_SWE_STD_DEV.upper() == 'TRUE':
-        fields.update({'SWESDev_mm': 'SNODAS_SWE_StdDev_mm', 'SWESDev_in': 'SNODAS_SWE_StdDev_in'})
-
-    # Replace the appropriate files.
-    for key, value in fields.items():
-        geojson_content = geojson_content.replace(key, value)
-
-    # Create an intermediate GeoJSON file that has the same contents of the original GeoJSON but with the new
-    # attribute names.
-    geojson_int_path = geojson_file.replace('.geojson', '_temp.geojson')
-    file_handler = open(geojson_file, 'w')
-    file_handler.write(geojson_content)
-    file_handler.close()
-    # with open(geojson_int_path, 'w') as geojson_int:
-    #     geojson_int.write(geojson_content)
-
-    # Remove the original GeoJSON file and rename the intermediate GeoJSON file to the name of the original GeoJSON.
-    # This file is removed when it is zipped.
-    # Path(geojson_file).unlink()
-    # os.rename(geojson_int_path, geojson_file)
-
-
 # def clean_duplicates_from_by_basin_csv(csv_basin_dir: Path) -> None:
 #     """Sometimes duplicate dates end up in the byBasin csv files. This function will make sure that the duplicates
 #     are removed. """
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import utilities
+from SNODAS_Sparse import SparseGrid
+
+logger = logging.getLogger('utilities')
+
+# Daily flux products that are summed over the water year: Snow Melt Runoff at Base, Sublimation from Snow Pack,
+# Sublimation from Blowing Snow, Solid Precip and Liquid Precip.
+ACCUMULATION_PRODUCTS = ['1044', '1050', '1039', '1025SlL01', '1025SlL00']
+
+LEDGER_NAME = 'ledger.json'
+
+
+def water_year(date) -> int:
+    """
+    Get the water year of a date. The water year starts on October 1 and is named after the year it ends in.
+    Ex: 2022-10-01 and 2023-09-30 are both in water year 2023.
+    date: the date of interest in date or datetime format
+    """
+    return date.year + 1 if date.month >= 10 else date.year
+
+
+def water_year_path(accum_path: Path, wy: int) -> Path:
+    """Return the folder holding the running sums of water year wy."""
+    return Path(accum_path) / 'WY{}'.format(wy)
+
+
+@contextmanager
+def _locked(folder: Path, timeout: float = 600.0):
+    """Hold a lock on folder while its running sums are updated. Creating a directory is atomic on every platform,
+    so the worker processes of a pool that process days of the same water year update the sums one at a time."""
+    lock = folder / '.lock'
+    start = time.time()
+    while True:
+        try:
+            os.mkdir(lock)
+            break
+        except FileExistsError:
+            if time.time() - start > timeout:
+                raise TimeoutError('Could not lock {} within {} seconds. Remove {} if no other process is '
+                                   'running.'.format(folder, timeout, lock))
+            time.sleep(0.1)
+    try:
+        yield
+    finally:
+        os.rmdir(lock)
+
+
+def _save_atomic(path: Path, save) -> None:
+    """Write a file through save(file_object) to a temporary file, then rename it over path so that readers never
+    see a partially written file."""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as tmp_file:
+        save(tmp_file)
+    os.replace(tmp_path, path)
+
+
+def _read_ledger(folder: Path) -> dict:
+    ledger_file = folder / LEDGER_NAME
+    if not ledger_file.exists():
+        return {}
+    with open(ledger_file) as file:
+        return json.load(file)
+
+
+def _write_ledger(folder: Path, ledger: dict) -> None:
+    _save_atomic(folder / LEDGER_NAME, lambda file: file.write(json.dumps(ledger, indent=1, sort_keys=True).encode()))
+
+
+def update_accumulation(accum_path: Path, date, grids: dict) -> list:
+    """
+    Add one day of flux grids to the running water-year sums. The sums are kept in the unscaled integer units of the
+    .dat files (int32, so no precision is lost) and are updated with a single add per product. The day's
+    contribution is saved compressed next to the sums, so reprocessing a day that is already in the sum applies the
+    difference between the new and the old grid instead of re-summing the water year.
+    Parameters
+    ----------
+    accum_path: full pathname to the folder holding the running sums. A WYyyyy sub-folder is created per water year.
+    date: the date of the grids in date or datetime format
+    grids: dictionary of {product code: unscaled int16 array or SparseGrid}, as returned by
+    utilities.read_snodas_tar_grids. A SparseGrid is added to the sums from its nonzero cells only. Products that are
+    not in ACCUMULATION_PRODUCTS are ignored.
+
+    Returns
+    -------
+    list of the products that were updated
+    """
+    folder = water_year_path(accum_path, water_year(date))
+    daily_folder = folder / 'daily'
+    os.makedirs(daily_folder, exist_ok=True)
+    date_str = utilities.format_date_yyyymmdd(date)
+    daily_file = daily_folder / (date_str + '.npz')
+
+    products = [product for product in ACCUMULATION_PRODUCTS if product in grids]
+
+    with _locked(folder):
+        previous = {}
+        if daily_file.exists():
+            with np.load(daily_file) as npz:
+                previous = {product: npz[product] for product in npz.files}
+
+        contributions = dict(previous)
+        for product in products:
+            grid = grids[product]
+            sum_file = folder / (product + '_sum.npy')
+            if sum_file.exists():
+                total = np.load(sum_file)
+            else:
+                total = np.zeros(grid.shape, dtype=np.int32)
+
+            # Null cells do not add to the sum.
+            if isinstance(grid, SparseGrid):
+                grid.add_to(total)
+                new = grid.to_dense(null=0)
+            else:
+                new = np.where(grid == utilities.SNODAS_NODATA, 0, grid).astype(np.int16)
+                total += new
+            if product in previous:
+                total -= previous[product]
+                logger.info('update_accumulation: Replaced {} {} in water year {} sum.'
+                            .format(date_str, product, water_year(date)))
+
+            _save_atomic(sum_file, lambda file: np.save(file, total))
+            contributions[product] = new
+
+        _save_atomic(daily_file, lambda file: np.savez_compressed(file, **contributions))
+
+        ledger = _read_ledger(folder)
+        ledger[date_str] = sorted(contributions)
+        _write_ledger(folder, ledger)
+
+    logger.info('update_accumulation: Added {} to water year {} sums of {}.'.format(date_str, water_year(date),
+                                                                                    products))
+    return products
+
+
+def remove_accumulation_day(accum_path: Path, date) -> list:
+    """
+    Subtract a day that was previously added by update_accumulation from the running sums.
+    Parameters
+    ----------
+    accum_path: full pathname to the folder holding the running sums
+    date: the date to remove in date or datetime format
+
+    Returns
+    -------
+    list of the products that were updated
+    """
+    folder = water_year_path(accum_path, water_year(date))
+    date_str = utilities.format_date_yyyymmdd(date)
+    daily_file = folder / 'daily' / (date_str + '.npz')
+    if not daily_file.exists():
+        return []
+
+    with _locked(folder):
+        with np.load(daily_file) as npz:
+            previous = {product: npz[product] for product in npz.files}
+        for product, contribution in previous.items():
+            sum_file = folder / (product + '_sum.npy')
+            total = np.load(sum_file)
+            total -= contribution
+            _save_atomic(sum_file, lambda file: np.save(file, total))
+        daily_file.unlink()
+
+        ledger = _read_ledger(folder)
+        ledger.pop(date_str, None)
+        _write_ledger(folder, ledger)
+
+    return list(previous)
+
+
+def read_accumulation(accum_path: Path, wy: int, product: str, scaled: bool = True, mmap: bool = False):
+    """
+    Read the running sum of a product for a water year.
+    Parameters
+    ----------
+    accum_path: full pathname to the folder holding the running sums
+    wy: water year
+    product: product code, one of ACCUMULATION_PRODUCTS
+    scaled: if True, return float32 millimeters (the sum divided by the dataSF of the product). If False, return the
+    int32 sum in the unscaled units of the .dat files.
+    mmap: if True and scaled is False, memory-map the sum instead of reading it
+
+    Returns
+    -------
+    the running sum array, or None if nothing has been accumulated for the product
+    """
+    sum_file = water_year_path(accum_path, wy) / (product + '_sum.npy')
+    if not sum_file.exists():
+        return None
+    total = np.load(sum_file, mmap_mode='r' if mmap and not scaled else None)
+    if not scaled:
+        return total
+    return total.astype(np.float32) / utilities.snodas_param_info[product]['dataSF']
+
+
+def accumulated_dates(accum_path: Path, wy: int) -> list:
+    """Return the dates (date format) included in the running sums of a water year, in ascending order."""
+    ledger = _read_ledger(water_year_path(accum_path, wy))
+    return sorted(datetime.strptime(date_str, '%Y%m%d').date() for date_str in ledger)
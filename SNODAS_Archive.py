@@ -0,0 +1,149 @@
+import logging
+import os
+
+from datetime import date, timedelta
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+import utilities
+from SNODAS_Accumulation import water_year
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+logger = logging.getLogger('utilities')
+
+# Chunk shape of the product grids: one day by a block of rows and columns. A single grid or a window of it is read
+# without touching other days, and a point time series decompresses one small chunk per day.
+ARCHIVE_CHUNKS = (1, 256, 512)
+
+
+def archive_file(archive_path: Path, wy: int) -> Path:
+    """Return the archive file of water year wy."""
+    return Path(archive_path) / 'SNODAS_WY{}.h5'.format(wy)
+
+
+def water_year_dates(wy: int) -> list:
+    """Return every date of water year wy, from October 1 to September 30."""
+    first = date(wy - 1, 10, 1)
+    return [first + timedelta(days=day_number) for day_number in range((date(wy, 10, 1) - first).days)]
+
+
+def day_index(current) -> int:
+    """Return the position of a date in the time axis of its water year archive."""
+    if hasattr(current, 'date'):
+        current = current.date()
+    return (current - date(water_year(current) - 1, 10, 1)).days
+
+
+def _compression() -> dict:
+    """Return the dataset compression options: Blosc with ZSTD when hdf5plugin is installed, otherwise gzip, which
+    every HDF5 reader supports."""
+    if hdf5plugin is not None:
+        return dict(hdf5plugin.Blosc(cname='zstd', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    return {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+
+
+def _create_archive(file: Path, wy: int) -> None:
+    """Create an empty archive of water year wy with one (day, row, column) int16 dataset per product and the
+    (day, product) index of the grids it holds."""
+    dates = water_year_dates(wy)
+    with h5py.File(file, 'w') as h5:
+        h5.attrs['water_year'] = wy
+        h5.create_dataset('dates', data=np.array([utilities.format_date_yyyymmdd(d) for d in dates], dtype='S8'))
+        index = h5.create_dataset('index', shape=(len(dates), len(utilities.SNODAS_BAND_ORDER)), dtype=np.uint8)
+        index.attrs['products'] = utilities.SNODAS_BAND_ORDER
+        for product in utilities.SNODAS_BAND_ORDER:
+            grid = h5.create_dataset(product, shape=(len(dates), utilities.SNODAS_NROWS, utilities.SNODAS_NCOLS),
+                                     dtype=np.int16, chunks=ARCHIVE_CHUNKS, fillvalue=utilities.SNODAS_NODATA,
+                                     **_compression())
+            grid.attrs['name'] = utilities.snodas_param_info[product]['name']
+            grid.attrs['units'] = utilities.snodas_param_info[product]['units']
+            grid.attrs['scale_factor'] = 1.0 / utilities.snodas_param_info[product]['dataSF']
+            grid.attrs['_FillValue'] = np.int16(utilities.SNODAS_NODATA)
+
+
+def repack_water_year(download_path: Path, archive_path: Path, wy: int, overwrite: bool = False) -> list:
+    """
+    Repack the daily .tar files of a water year into one archive file. Every product is kept as int16 in the unscaled
+    units of the .dat files, in a chunked, compressed (day, row, column) dataset, and an index records which (date,
+    product) grids are present. A grid is then opened by its position in the water year without reading any .tar
+    header. Dates that are already in the archive are skipped unless overwrite is True, so the archive of the current
+    water year can be brought up to date as new days are downloaded.
+    Parameters
+    ----------
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    archive_path: full pathname to the folder of the archive files
+    wy: water year to repack
+    overwrite: if True, repack dates that are already in the archive
+
+    Returns
+    -------
+    list of the dates that were added to the archive
+    """
+    os.makedirs(archive_path, exist_ok=True)
+    file = archive_file(archive_path, wy)
+    if not file.exists():
+        tmp_file = file.with_name(file.name + '.tmp')
+        _create_archive(tmp_file, wy)
+        os.replace(tmp_file, file)
+
+    added = []
+    with h5py.File(file, 'a') as h5:
+        index = h5['index']
+        for i, current in enumerate(water_year_dates(wy)):
+            tar_file = Path(download_path) / ('SNODAS_' + utilities.format_date_yyyymmdd(current) + '.tar')
+            if not tar_file.exists() or (index[i].any() and not overwrite):
+                continue
+            grids = utilities.read_snodas_tar_grids(tar_file)
+            for product, grid in grids.items():
+                h5[product][i] = grid
+                index[i, utilities.SNODAS_BAND_ORDER.index(product)] = 1
+            added.append(current)
+            logger.info('repack_water_year: Added {} products of {} to {}'.format(len(grids), current, file))
+
+    return added
+
+
+def open_archive(archive_path: Path, wy: int):
+    """Open the archive file of water year wy for reading, or return None if it does not exist."""
+    file = archive_file(archive_path, wy)
+    if not file.exists():
+        return None
+    return h5py.File(file, 'r')
+
+
+def has_grid(h5, current, product: str) -> bool:
+    """Return True if the (date, product) grid is in an open archive."""
+    return bool(h5['index'][day_index(current), utilities.SNODAS_BAND_ORDER.index(product)])
+
+
+def read_archive_grid(archive_path: Path, current, product: str, window=None):
+    """
+    Read one (date, product) grid from the archive of its water year.
+    Parameters
+    ----------
+    archive_path: full pathname to the folder of the archive files
+    current: the date of interest in date or datetime format
+    product: product code, a key of utilities.snodas_param_info
+    window: optional (row_start, row_stop, col_start, col_stop) to read only part of the grid
+
+    Returns
+    -------
+    int16 array in the unscaled units of the .dat file (see utilities.scale_snodas_grid), or None if the grid is not in
+    the archive
+    """
+    h5 = open_archive(archive_path, water_year(current))
+    if h5 is None:
+        return None
+    with h5:
+        if not has_grid(h5, current, product):
+            return None
+        if window is None:
+            return h5[product][day_index(current)]
+        row_start, row_stop, col_start, col_stop = window
+        return h5[product][day_index(current), row_start:row_stop, col_start:col_stop]
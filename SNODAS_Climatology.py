@@ -0,0 +1,289 @@
+import logging
+import os
+import warnings
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+import utilities
+
+logger = logging.getLogger('utilities')
+
+# Percentiles kept for each day of year, in addition to the minimum and the maximum. The 50th percentile is the median.
+CLIMATOLOGY_PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+
+
+def day_of_year(date) -> int:
+    """
+    Get the day of year of a date on a 365 day calendar, so the same calendar day has the same number every year.
+    February 29 shares day 59 with February 28.
+    date: the date of interest in date or datetime format
+    """
+    doy = date.timetuple().tm_yday
+    leap = date.year % 4 == 0 and (date.year % 100 != 0 or date.year % 400 == 0)
+    if leap and doy >= 60:
+        doy -= 1
+    return doy
+
+
+def stat_names(percentiles=None) -> list:
+    """Return the names of the climatology statistics in ascending order. Ex: ['min', 'p05', ..., 'p95', 'max']"""
+    if percentiles is None:
+        percentiles = CLIMATOLOGY_PERCENTILES
+    return ['min'] + ['p{:02d}'.format(p) for p in percentiles] + ['max']
+
+
+def climatology_file(climatology_path: Path, doy: int) -> Path:
+    """Return the file holding the climatology of day of year doy."""
+    return Path(climatology_path) / 'doy_{:03d}.npz'.format(doy)
+
+
+def swe_archive_files(processed_path: Path, years=None) -> dict:
+    """
+    List the multiband rasters of the archive.
+    Parameters
+    ----------
+    processed_path: full pathname to the folder of the multiband rasters (YYYYMMDDWGS84.tif)
+    years: water years to include. Defaults to all years in the folder.
+
+    Returns
+    -------
+    dictionary of {date: full pathname of the multiband .tif file}
+    """
+    files = {}
+    for file in Path(processed_path).glob('*WGS84.tif'):
+        try:
+            date = datetime.strptime(file.name[:8], '%Y%m%d').date()
+        except ValueError:
+            continue
+        wy = date.year + 1 if date.month >= 10 else date.year
+        if years is None or wy in years:
+            files[date] = file
+    return files
+
+
+def build_swe_climatology(processed_path: Path, climatology_path: Path, labels=None, years=None, percentiles=None,
+                          block_rows: int = 256, overwrite: bool = False) -> list:
+    """
+    Build the day-of-year climatology of SWE from the archive of multiband rasters. For every day of year, the rasters
+    of that day in each year are read one block of rows at a time and reduced to the minimum, the percentiles and the
+    maximum of each pixel, so no more than block_rows rows of each year are held in memory. When basin labels are given,
+    the mean SWE of each basin is computed from the same blocks and its statistics across the years are saved too.
+
+    Each day of year is saved to its own file (see climatology_file) in the unscaled integer millimeters of the .dat
+    files, with -9999 where no year has data. Days that already have a file are skipped unless overwrite is True, so an
+    interrupted build can be restarted.
+    Parameters
+    ----------
+    processed_path: full pathname to the folder of the multiband rasters (YYYYMMDDWGS84.tif)
+    climatology_path: full pathname to the folder where the climatology is saved
+    labels: optional int array of shape (SNODAS_NROWS, SNODAS_NCOLS) with the basin id of each pixel, 0 outside basins
+    years: water years to include. Defaults to all years in the archive.
+    percentiles: percentiles to keep. Defaults to CLIMATOLOGY_PERCENTILES. The median is always kept.
+    block_rows: number of rows read from each raster at a time
+    overwrite: if True, rebuild the days of year that already have a file
+
+    Returns
+    -------
+    list of the days of year that were built
+    """
+    percentiles = sorted(set(CLIMATOLOGY_PERCENTILES if percentiles is None else percentiles) | {50})
+    names = stat_names(percentiles)
+    os.makedirs(climatology_path, exist_ok=True)
+
+    by_doy = {}
+    for date, file in sorted(swe_archive_files(processed_path, years).items()):
+        by_doy.setdefault(day_of_year(date), []).append(file)
+
+    basin_ids = None
+    if labels is not None:
+        labels = np.asarray(labels)
+        basin_ids = np.unique(labels[labels > 0])
+        # Map the basin ids onto 1..n so that bincount only needs n + 1 bins.
+        label_index = np.searchsorted(basin_ids, labels) + 1
+        label_index[labels <= 0] = 0
+
+    built = []
+    for doy, files in sorted(by_doy.items()):
+        out_file = climatology_file(climatology_path, doy)
+        if out_file.exists() and not overwrite:
+            continue
+
+        stats = np.full((len(names), utilities.SNODAS_NROWS, utilities.SNODAS_NCOLS), utilities.SNODAS_NODATA,
+                        dtype=np.int16)
+        count = np.zeros((utilities.SNODAS_NROWS, utilities.SNODAS_NCOLS), dtype=np.int16)
+        if basin_ids is not None:
+            basin_sums = np.zeros((len(files), len(basin_ids) + 1))
+            basin_counts = np.zeros((len(files), len(basin_ids) + 1))
+
+        sources = [rasterio.open(file) for file in files]
+        try:
+            for row in range(0, utilities.SNODAS_NROWS, block_rows):
+                nrows = min(block_rows, utilities.SNODAS_NROWS - row)
+                window = Window(0, row, utilities.SNODAS_NCOLS, nrows)
+                block = np.stack([utilities.read_snodas_band(src, '1034', window) for src in sources])
+
+                with warnings.catch_warnings():
+                    # Pixels with no data in any year (ocean, outside the mask) are expected.
+                    warnings.simplefilter('ignore', category=RuntimeWarning)
+                    levels = np.concatenate([np.nanmin(block, axis=0)[np.newaxis],
+                                             np.nanpercentile(block, percentiles, axis=0),
+                                             np.nanmax(block, axis=0)[np.newaxis]])
+                stats[:, row:row + nrows] = np.where(np.isnan(levels), utilities.SNODAS_NODATA, np.rint(levels))
+                count[row:row + nrows] = (~np.isnan(block)).sum(axis=0)
+
+                if basin_ids is not None:
+                    block_labels = label_index[row:row + nrows]
+                    for i, values in enumerate(block):
+                        valid = ~np.isnan(values) & (block_labels > 0)
+                        basin_sums[i] += np.bincount(block_labels[valid], weights=values[valid],
+                                                     minlength=len(basin_ids) + 1)
+                        basin_counts[i] += np.bincount(block_labels[valid], minlength=len(basin_ids) + 1)
+        finally:
+            for src in sources:
+                src.close()
+
+        arrays = {name: stats[i] for i, name in enumerate(names)}
+        arrays['count'] = count
+        arrays['percentiles'] = np.array(percentiles)
+        if basin_ids is not None:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                basin_means = (basin_sums / basin_counts)[:, 1:]
+                basin_levels = np.concatenate([np.nanmin(basin_means, axis=0)[np.newaxis],
+                                               np.nanpercentile(basin_means, percentiles, axis=0),
+                                               np.nanmax(basin_means, axis=0)[np.newaxis]])
+            arrays['basin_ids'] = basin_ids
+            for i, name in enumerate(names):
+                arrays['basin_' + name] = basin_levels[i]
+
+        tmp_file = out_file.with_name(out_file.name + '.tmp')
+        with open(tmp_file, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(tmp_file, out_file)
+        built.append(doy)
+        logger.info('build_swe_climatology: Saved day of year {} from {} years to {}'.format(doy, len(files), out_file))
+
+    return built
+
+
+def load_swe_climatology(climatology_path: Path, date) -> dict:
+    """
+    Load the climatology of the day of year of date.
+    Parameters
+    ----------
+    climatology_path: full pathname to the folder of the climatology (see build_swe_climatology)
+    date: the date of interest in date or datetime format, or a day of year
+
+    Returns
+    -------
+    dictionary of the statistics. The pixel statistics (see stat_names) are float32 arrays with NaN where there is no
+    data. When the climatology was built with basin labels, 'basin_ids' and the 'basin_' statistics are included.
+    """
+    doy = date if isinstance(date, int) else day_of_year(date)
+    with np.load(climatology_file(climatology_path, doy)) as npz:
+        climatology = {key: npz[key] for key in npz.files}
+    for name in stat_names(list(climatology['percentiles'])):
+        grid = climatology[name].astype(np.float32)
+        grid[climatology[name] == utilities.SNODAS_NODATA] = np.nan
+        climatology[name] = grid
+    return climatology
+
+
+def _as_swe(swe):
+    """Return swe as float32 with null cells set to NaN."""
+    swe = np.asarray(swe, dtype=np.float32)
+    return np.where(swe == utilities.SNODAS_NODATA, np.nan, swe)
+
+
+def _percentile_rank(values, levels, ranks):
+    """Interpolate the percentile rank of values between the statistic levels (ascending, one array per rank).
+    A value equal to several tied levels gets the middle of their ranks."""
+    below = np.zeros(values.shape, dtype=np.int8)
+    at_or_below = np.zeros(values.shape, dtype=np.int8)
+    for level in levels:
+        below += values > level
+        at_or_below += values >= level
+    # Bracketing levels and ranks of each value.
+    lower, upper = np.full(values.shape, np.nan, dtype=np.float32), np.full(values.shape, np.nan, dtype=np.float32)
+    lower_rank, upper_rank = np.zeros(values.shape, dtype=np.float32), np.zeros(values.shape, dtype=np.float32)
+    tie_low, tie_high = np.zeros(values.shape, dtype=np.float32), np.zeros(values.shape, dtype=np.float32)
+    for i, (level, rank) in enumerate(zip(levels, ranks)):
+        lower = np.where(below == i + 1, level, lower)
+        lower_rank = np.where(below == i + 1, rank, lower_rank)
+        upper = np.where(below == i, level, upper)
+        upper_rank = np.where(below == i, rank, upper_rank)
+        tie_low = np.where(below == i, rank, tie_low)
+        tie_high = np.where(at_or_below == i + 1, rank, tie_high)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = lower_rank + (values - lower) / (upper - lower) * (upper_rank - lower_rank)
+    result = np.where(below == 0, ranks[0], result)
+    result = np.where(below == len(levels), ranks[-1], result)
+    result = np.where(at_or_below > below, (tie_low + tie_high) / 2, result)
+    return np.where(np.isnan(values) | np.isnan(levels[0]), np.nan, result).astype(np.float32)
+
+
+def swe_percentile_rank(swe, climatology: dict):
+    """
+    Get the percentile rank (0 to 100) of SWE within the climatology of its day of year, interpolated linearly between
+    the saved statistics.
+    Parameters
+    ----------
+    swe: SWE grid in millimeters, with -9999 or NaN as null value
+    climatology: climatology of the day, as returned by load_swe_climatology
+
+    Returns
+    -------
+    float32 array of percentile ranks, NaN where SWE or the climatology has no data
+    """
+    percentiles = list(climatology['percentiles'])
+    levels = [climatology[name] for name in stat_names(percentiles)]
+    return _percentile_rank(_as_swe(swe), levels, [0.0] + percentiles + [100.0])
+
+
+def swe_anomaly(swe, climatology: dict):
+    """
+    Get the anomaly of SWE compared to the median of its day of year.
+    Parameters
+    ----------
+    swe: SWE grid in millimeters, with -9999 or NaN as null value
+    climatology: climatology of the day, as returned by load_swe_climatology
+
+    Returns
+    -------
+    tuple of (difference from the median in millimeters, percent of the median). The percent of the median is NaN
+    where the median is 0.
+    """
+    swe = _as_swe(swe)
+    median = climatology['p50']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = np.where(median > 0, swe / median * 100, np.nan)
+    return swe - median, percent.astype(np.float32)
+
+
+def basin_swe_percentile_rank(basin_swe: dict, climatology: dict) -> dict:
+    """
+    Get the percentile rank of the mean SWE of each basin within the basin climatology of its day of year.
+    Parameters
+    ----------
+    basin_swe: dictionary of {basin id: mean SWE in millimeters}
+    climatology: climatology of the day, as returned by load_swe_climatology from a climatology built with labels
+
+    Returns
+    -------
+    dictionary of {basin id: percentile rank}. Basins that are not in the climatology are left out.
+    """
+    percentiles = list(climatology['percentiles'])
+    basin_ids = list(climatology['basin_ids'])
+    index = {basin_id: i for i, basin_id in enumerate(basin_ids)}
+    known = [basin_id for basin_id in basin_swe if basin_id in index]
+    rows = [index[basin_id] for basin_id in known]
+    values = np.array([basin_swe[basin_id] for basin_id in known], dtype=np.float32)
+    levels = [climatology['basin_' + name][rows] for name in stat_names(percentiles)]
+    ranks = _percentile_rank(values, levels, [0.0] + percentiles + [100.0])
+    return dict(zip(known, ranks.tolist()))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger('utilities')
+
+# File in the synced folder recording what has been uploaded to each destination
+SYNC_MANIFEST_NAME = '.cloud_sync_manifest.json'
+
+# Files larger than this are uploaded in parts of this size, several parts at a time
+MULTIPART_BYTES = 8 * 2 ** 20
+
+# Upload threads of sync_folder
+SYNC_THREADS = 8
+
+# Bytes read at a time when hashing a file
+HASH_BLOCK_BYTES = 2 ** 20
+
+
+def file_md5(path: Path) -> str:
+    """Return the hex MD5 digest of the contents of a file."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_BYTES), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _load_manifest(manifest_file: Path) -> dict:
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file) as file:
+        return json.load(file)
+
+
+def _save_manifest(manifest_file: Path, manifest: dict) -> None:
+    tmp_file = manifest_file.with_name(manifest_file.name + '.tmp')
+    with open(tmp_file, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def changed_files(local_path: Path, pushed: dict) -> list:
+    """
+    Find the files of a folder that differ from what has been pushed. A file whose size and modification time match
+    the manifest is not read. Otherwise it is hashed, so a file that was rewritten with the same contents is not
+    uploaded again.
+    Parameters
+    ----------
+    local_path: full pathname to the folder to sync
+    pushed: {object key: {'size', 'mtime_ns', 'md5'}} of the files already pushed to the destination
+
+    Returns
+    -------
+    list of (object key, full pathname, {'size', 'mtime_ns', 'md5'}) of the new and changed files. Object keys are the
+    paths relative to local_path with '/' separators.
+    """
+    local_path = Path(local_path)
+    changed = []
+    for folder, _, files in os.walk(local_path):
+        for name in files:
+            if name == SYNC_MANIFEST_NAME or name.endswith('.tmp'):
+                continue
+            path = Path(folder) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # A broken link, or a file removed since the folder was listed.
+                continue
+            key = path.relative_to(local_path).as_posix()
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            previous = pushed.get(key)
+            if previous is not None and previous['size'] == entry['size'] and \
+                    previous['mtime_ns'] == entry['mtime_ns']:
+                continue
+            entry['md5'] = file_md5(path)
+            if previous is not None and previous.get('md5') == entry['md5']:
+                # Same contents with a new time stamp. Record the time stamp so the file is not hashed again.
+                pushed[key] = entry
+                continue
+            changed.append((key, path, entry))
+    return changed
+
+
+def sync_folder(local_path: Path, bucket: str, prefix: str = '', threads: int = SYNC_THREADS,
+                multipart_bytes: int = MULTIPART_BYTES, endpoint_url: str = None, client=None,
+                delete: bool = False) -> dict:
+    """
+    Upload the new and changed files of a folder to an S3-compatible bucket, replacing the copy of the whole folder
+    made by the scripts of push_to_aws and push_to_gcp. What has been pushed to each bucket and prefix is recorded in
+    a manifest in the folder, so a daily sync only transfers the files written that day. Files are uploaded by a pool
+    of threads, and large files in parts.
+    Files deleted from the folder stay in the bucket unless delete is True. Only the objects this sync uploaded, as
+    recorded in the manifest, are ever deleted, so other objects under the prefix are left alone.
+    Ex: sync_folder(Path('processed_data/CSV'), 'snodas-tools', 'CSV', endpoint_url='http://localhost:9000') for a
+    local MinIO server, or endpoint_url='https://storage.googleapis.com' for a Google Cloud Storage bucket with HMAC
+    keys.
+    Parameters
+    ----------
+    local_path: full pathname to the folder to sync
+    bucket: name of the bucket
+    prefix: key prefix of the objects in the bucket. Ex: 'SnowpackStatisticsByDate'
+    threads: number of files uploaded at a time
+    multipart_bytes: files larger than this are uploaded in parts of this size
+    endpoint_url: URL of an S3-compatible service. Defaults to AWS S3.
+    client: boto3 S3 client to use instead of creating one. Credentials of a created client come from the usual
+    boto3 sources (environment, ~/.aws).
+    delete: if True, delete the objects of the files that were pushed and have since been deleted from the folder
+
+    Returns
+    -------
+    dictionary with 'uploaded' (list of object keys), 'deleted' (list of object keys), 'failed' (list of object keys)
+    and 'bytes' (bytes uploaded)
+    """
+    local_path = Path(local_path)
+    prefix = prefix.strip('/')
+    destination = '{}/{}'.format(endpoint_url or 's3:/', bucket) + ('/' + prefix if prefix else '')
+    manifest_file = local_path / SYNC_MANIFEST_NAME
+    manifest = _load_manifest(manifest_file)
+    pushed = manifest.setdefault(destination, {})
+
+    changed = changed_files(local_path, pushed)
+    removed = [key for key in pushed if delete and not (local_path / key).exists()]
+    result = {'uploaded': [], 'deleted': [], 'failed': [], 'bytes': 0}
+    if not changed and not removed:
+        _save_manifest(manifest_file, manifest)
+        logger.info('sync_folder: {} is up to date with {}'.format(local_path, destination))
+        return result
+
+    if client is None:
+        client = boto3.client('s3', endpoint_url=endpoint_url)
+    config = TransferConfig(multipart_threshold=multipart_bytes, multipart_chunksize=multipart_bytes,
+                            max_concurrency=max(1, threads // 2), use_threads=True)
+
+    def upload(key, path):
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        client.upload_file(str(path), bucket, _object_key(prefix, key), Config=config,
+                           ExtraArgs={'ContentType': content_type})
+
+    def remove(key, _):
+        client.delete_object(Bucket=bucket, Key=_object_key(prefix, key))
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = {executor.submit(upload, key, path): (key, entry) for key, path, entry in changed}
+        futures.update({executor.submit(remove, key, None): (key, None) for key in removed})
+        # Results are collected in this thread, so the manifest and the result are only changed here.
+        for future in as_completed(futures):
+            key, entry = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                logger.error('sync_folder: Failed to {} {} in {}: {}'
+                             .format('upload' if entry else 'delete', key, destination, error))
+                result['failed'].append(key)
+                continue
+            if entry is None:
+                del pushed[key]
+                result['deleted'].append(key)
+            else:
+                pushed[key] = entry
+                result['uploaded'].append(key)
+                result['bytes'] += entry['size']
+
+    # Only successful transfers are recorded, so failed files are retried by the next sync.
+    _save_manifest(manifest_file, manifest)
+    logger.info('sync_folder: Uploaded {} files ({} KB) of {} to {}, deleted {}, {} failed'
+                .format(len(result['uploaded']), round(result['bytes'] / 1024), local_path, destination,
+                        len(result['deleted']), len(result['failed'])))
+    return result
+
+
+def _object_key(prefix: str, key: str) -> str:
+    return prefix + '/' + key if prefix else key
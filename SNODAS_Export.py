@@ -0,0 +1,578 @@
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import gdal
+import numpy as np
+import ogr
+
+logger = logging.getLogger('utilities')
+
+# Short (10 character) .dbf field names of the statistics written to the daily shapefile, as named by the original
+# QGIS export. Other columns are truncated to 10 characters.
+SHAPEFILE_FIELD_NAMES = {'SNODAS_SWE_Mean_mm': 'SWEMean_mm', 'SNODAS_SWE_Mean_in': 'SWEMean_in',
+                         'SNODAS_EffectiveArea_sqmi': 'Area_sqmi', 'SNODAS_SWE_Volume_acft': 'SWEVol_af',
+                         'SNODAS_SWE_Volume_1WeekChange_acft': 'SWEVolC_af', 'SNODAS_SnowCover_percent': 'SCover_pct',
+                         'SNODAS_SWE_Min_mm': 'SWEMin_mm', 'SNODAS_SWE_Min_in': 'SWEMin_in',
+                         'SNODAS_SWE_Max_mm': 'SWEMax_mm', 'SNODAS_SWE_Max_in': 'SWEMax_in',
+                         'SNODAS_SWE_StdDev_mm': 'SWESDev_mm', 'SNODAS_SWE_StdDev_in': 'SWESDev_in'}
+
+# Decimal places of the statistics written to the GeoJSON and shapefile attributes
+ATTRIBUTE_DECIMALS = 2
+
+# zlib compression level of the packaged outputs, from 1 (fastest) to 9 (smallest)
+ZIP_COMPRESSION_LEVEL = 6
+
+# Components of the shapefile template that are the same every day. Only the .dbf is written daily.
+SHAPEFILE_GEOMETRY_EXTENSIONS = ['.shp', '.shx', '.prj', '.cpg']
+
+
+class BasinTemplate:
+    """
+    The parts of the daily basin GeoJSON and shapefile that never change: the geometry of every basin, reprojected and
+    rounded to the output precision once, and the attributes of the basin shapefile. The template is saved to
+    cache_path and rebuilt only when the basin shapefile, the output crs or the precision change, so the daily export
+    only formats the new statistics and streams them out with the serialized geometry.
+    Features are in the order of the basin shapefile, which is the order of the labels of
+    SNODAS_Zonal.rasterize_basins, so the statistic arrays of the zonal functions can be written as they are.
+    basin_shp: full pathname of the basin boundary shapefile
+    cache_path: full pathname to the folder of the template
+    output_crs: crs of the output geometry. Ex: 'EPSG:4326'
+    precision: decimal places of the GeoJSON coordinates (GEOJSON_PRECISION of the configuration file)
+    """
+
+    def __init__(self, basin_shp: Path, cache_path: Path, output_crs: str = 'EPSG:4326', precision: int = 5):
+        self.basin_shp = Path(basin_shp)
+        self.cache_path = Path(cache_path)
+        self.output_crs = output_crs
+        self.precision = int(precision)
+        self.properties = []
+        self.geometries = []
+        self.field_types = {}
+        self._geometry_files = None
+
+        stat = self.basin_shp.stat()
+        self._key = {'source': str(self.basin_shp.resolve()), 'mtime': stat.st_mtime, 'size': stat.st_size,
+                     'output_crs': output_crs, 'precision': self.precision}
+        if not self._load():
+            self._build()
+
+    @property
+    def _template_file(self) -> Path:
+        return self.cache_path / (self.basin_shp.stem + '_template.json')
+
+    def _shapefile_template(self, ext: str) -> Path:
+        return self.cache_path / (self.basin_shp.stem + '_template' + ext)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def _load(self) -> bool:
+        if not self._template_file.exists() or not self._shapefile_template('.shp').exists():
+            return False
+        with open(self._template_file) as file:
+            template = json.load(file)
+        if template['key'] != self._key:
+            logger.info('BasinTemplate: {} changed and the template is rebuilt'.format(self.basin_shp))
+            return False
+        self.properties = template['properties']
+        self.geometries = template['geometries']
+        self.field_types = template['field_types']
+        return True
+
+    def _build(self) -> None:
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        # Reproject the basins once to a shapefile whose geometry files are reused every day.
+        shp_template = self._shapefile_template('.shp')
+        gdal.VectorTranslate(str(shp_template), str(self.basin_shp), format='ESRI Shapefile', dstSRS=self.output_crs,
+                             reproject=True, layerCreationOptions=['ENCODING=UTF-8'])
+
+        source = ogr.Open(str(shp_template))
+        layer = source.GetLayer()
+        layer_defn = layer.GetLayerDefn()
+        self.field_types = {}
+        for i in range(layer_defn.GetFieldCount()):
+            field_defn = layer_defn.GetFieldDefn(i)
+            if field_defn.GetType() in (ogr.OFTInteger, ogr.OFTInteger64):
+                self.field_types[field_defn.GetName()] = 'N'
+            elif field_defn.GetType() == ogr.OFTReal:
+                self.field_types[field_defn.GetName()] = 'F'
+            else:
+                self.field_types[field_defn.GetName()] = 'C'
+
+        options = ['COORDINATE_PRECISION={}'.format(self.precision)]
+        self.properties, self.geometries = [], []
+        for feature in layer:
+            self.properties.append({name: feature.GetField(name) for name in self.field_types})
+            self.geometries.append(feature.GetGeometryRef().ExportToJson(options))
+        source = None
+
+        tmp_file = self._template_file.with_name(self._template_file.name + '.tmp')
+        with open(tmp_file, 'w') as file:
+            json.dump({'key': self._key, 'field_types': self.field_types, 'properties': self.properties,
+                       'geometries': self.geometries}, file)
+        os.replace(tmp_file, self._template_file)
+        logger.info('BasinTemplate: Built the template of {} basins of {} in {}'
+                    .format(len(self.geometries), self.basin_shp, self.cache_path))
+
+    def _geojson_chunks(self, name: str, columns: dict):
+        """Yield the text of the GeoJSON layer called name, one feature at a time."""
+        values = _rounded_columns(columns, len(self))
+        crs = {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:' + self.output_crs.replace(':', '::')}}
+        yield '{{"type": "FeatureCollection", "name": {}, "crs": {}, "features": [\n'.format(json.dumps(name),
+                                                                                            json.dumps(crs))
+        for i, geometry in enumerate(self.geometries):
+            properties = dict(self.properties[i])
+            properties.update({name: column[i] for name, column in values.items()})
+            yield '{}{{"type": "Feature", "properties": {}, "geometry": {}}}'.format(',\n' if i else '',
+                                                                                   json.dumps(properties), geometry)
+        yield '\n]}\n'
+
+    def geojson_bytes(self, name: str, columns: dict) -> bytes:
+        """Return the UTF-8 GeoJSON layer called name (see write_geojson), to be packaged without writing a file."""
+        return ''.join(self._geojson_chunks(name, columns)).encode('utf-8')
+
+    def write_geojson(self, out_file: Path, columns: dict) -> None:
+        """
+        Write the basins with their attributes and the statistics of a day to a GeoJSON file.
+        Parameters
+        ----------
+        out_file: full pathname of the .geojson file
+        columns: {field name: array of one value per basin}, written with these field names. NaN is written as null.
+        """
+        out_file = Path(out_file)
+        tmp_file = out_file.with_name(out_file.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as file:
+            for chunk in self._geojson_chunks(out_file.stem, columns):
+                file.write(chunk)
+        os.replace(tmp_file, out_file)
+
+    def write_shapefile(self, out_file: Path, columns: dict) -> None:
+        """
+        Write the basins with their attributes and the statistics of a day to a shapefile. The geometry files are
+        linked (or copied) from the template and only the .dbf is written.
+        Parameters
+        ----------
+        out_file: full pathname of the .shp file
+        columns: {field name: array of one value per basin}. Field names are shortened with SHAPEFILE_FIELD_NAMES.
+        """
+        out_file = Path(out_file)
+        for ext in SHAPEFILE_GEOMETRY_EXTENSIONS:
+            template_file = self._shapefile_template(ext)
+            if not template_file.exists():
+                continue
+            if out_file.with_suffix(ext).exists() and os.path.samefile(template_file, out_file.with_suffix(ext)):
+                # Already linked. Renaming a link over another link to the same file would leave the link in place.
+                continue
+            tmp_file = out_file.with_name(out_file.stem + ext + '.tmp')
+            if tmp_file.exists():
+                tmp_file.unlink()
+            try:
+                os.link(template_file, tmp_file)
+            except OSError:
+                shutil.copyfile(template_file, tmp_file)
+            os.replace(tmp_file, out_file.with_suffix(ext))
+
+        dbf_file = out_file.with_suffix('.dbf')
+        tmp_file = dbf_file.with_name(dbf_file.name + '.tmp')
+        write_dbf(tmp_file, self._dbf_fields(columns), len(self))
+        os.replace(tmp_file, dbf_file)
+
+    def _dbf_fields(self, columns: dict) -> list:
+        fields = [(name, self.field_types[name], [properties[name] for properties in self.properties], 8)
+                  for name in self.field_types]
+        fields += [(SHAPEFILE_FIELD_NAMES.get(name, name[:10]), 'F', column, ATTRIBUTE_DECIMALS)
+                   for name, column in _rounded_columns(columns, len(self)).items()]
+        return fields
+
+    def shapefile_members(self, name: str, columns: dict) -> dict:
+        """
+        Return the components of the shapefile called name (see write_shapefile) as {file name: bytes}, to be
+        packaged without writing loose files. The geometry files of the template are read once and kept in memory.
+        """
+        if self._geometry_files is None:
+            self._geometry_files = {}
+            for ext in SHAPEFILE_GEOMETRY_EXTENSIONS:
+                if self._shapefile_template(ext).exists():
+                    with open(self._shapefile_template(ext), 'rb') as file:
+                        self._geometry_files[ext] = file.read()
+        members = {name + ext: contents for ext, contents in self._geometry_files.items()}
+        members[name + '.dbf'] = dbf_bytes(self._dbf_fields(columns), len(self))
+        return members
+
+
+def _rounded_columns(columns: dict, n_features: int) -> dict:
+    """Return the columns as lists of floats rounded to ATTRIBUTE_DECIMALS, with None for NaN."""
+    rounded = {}
+    for name, column in columns.items():
+        column = np.asarray(column, dtype=np.float64)
+        if column.shape != (n_features,):
+            raise ValueError('Column {} has shape {} but there are {} basins'.format(name, column.shape, n_features))
+        rounded[name] = [None if np.isnan(value) else round(float(value), ATTRIBUTE_DECIMALS) for value in column]
+    return rounded
+
+
+def _dbf_value(value, field_type: str, width: int, decimals: int) -> bytes:
+    """Format one .dbf value, right-aligned for numbers and left-aligned for text. None is blank."""
+    if value is None:
+        return b' ' * width
+    if field_type == 'C':
+        return str(value).encode('utf-8')[:width].ljust(width)
+    if field_type == 'N':
+        return str(int(value)).encode('ascii').rjust(width)
+    return '{:.{}f}'.format(value, decimals).encode('ascii').rjust(width)[:width]
+
+
+def write_dbf(dbf_file: Path, fields: list, n_records: int) -> None:
+    """Write a dBASE III .dbf file, the attribute table of a shapefile. See dbf_bytes."""
+    with open(dbf_file, 'wb') as file:
+        file.write(dbf_bytes(fields, n_records))
+
+
+def dbf_bytes(fields: list, n_records: int) -> bytes:
+    """
+    Return the contents of a dBASE III .dbf file, the attribute table of a shapefile.
+    Parameters
+    ----------
+    fields: list of (name of at most 10 characters, type, list of n_records values, decimal places), where type is
+    'C' (text), 'N' (integer) or 'F' (float). The decimal places are only used by 'F' fields.
+    n_records: number of records, the number of features of the shapefile
+
+    Returns
+    -------
+    the bytes of the .dbf file
+    """
+    layout = []
+    for name, field_type, values, decimals in fields:
+        if field_type == 'C':
+            width = max([len(str(value).encode('utf-8')) for value in values if value is not None] + [1])
+            layout.append((min(width, 254), 0))
+        elif field_type == 'N':
+            layout.append((18, 0))
+        else:
+            layout.append((19, decimals))
+
+    today = datetime.now()
+    header_length = 32 + 32 * len(layout) + 1
+    record_length = 1 + sum(width for width, _ in layout)
+    with io.BytesIO() as file:
+        file.write(struct.pack('<BBBBIHH20x', 3, today.year - 1900, today.month, today.day, n_records,
+                               header_length, record_length))
+        for (name, field_type, _, _), (width, decimals) in zip(fields, layout):
+            file.write(struct.pack('<11sc4xBB14x', name.encode('ascii')[:10], field_type.encode('ascii'), width,
+                                   decimals))
+        file.write(b'\r')
+        for i in range(n_records):
+            file.write(b' ' + b''.join(_dbf_value(values[i], field_type, width, decimals)
+                                       for (_, field_type, values, _), (width, decimals) in zip(fields, layout)))
+        file.write(b'\x1a')
+        return file.getvalue()
+
+
+# Name of the files of a day in the by-date folder, and of the files pointing to the most recent day
+BY_DATE_PREFIX = 'SnowpackStatisticsByDate_'
+LATEST_DATE_NAME = 'LatestDate'
+
+# Name of the .csv file of each basin in the by-basin folder
+BY_BASIN_PREFIX = 'SnowpackStatisticsByBasin_'
+
+# Files of a day published as the latest date, by extension. The archives are not linked, since their members are
+# named after the date: package_day builds SnowpackStatisticsByDate_LatestDate.zip and .geojson.zip with LatestDate
+# member names instead.
+LATEST_DATE_EXTENSIONS = ['.csv', '.geojson', '.cpg', '.dbf', '.prj', '.qpj', '.shp', '.shx']
+
+
+def _read_list_of_dates(list_file: Path, csv_by_date: Path) -> list:
+    """Return the dates of ListOfDates.txt, newest first, building it from the .csv files of the folder if needed."""
+    if list_file.exists():
+        with open(list_file) as file:
+            return [line.strip() for line in file if line.strip()]
+
+    dates = set()
+    for csv_file in Path(csv_by_date).glob(BY_DATE_PREFIX + '*.csv'):
+        date_name = csv_file.stem[len(BY_DATE_PREFIX):]
+        if len(date_name) == 8 and date_name.isdigit():
+            dates.add(date_name)
+    return sorted(dates, reverse=True)
+
+
+def update_list_of_dates(csv_by_date: Path, date_name: str) -> list:
+    """
+    Add a date to ListOfDates.txt of the by-date folder, newest first, without listing the folder. The file is only
+    built from the .csv files of the folder when it does not exist yet. It is replaced in one rename, so readers see
+    either the old or the new list.
+    Parameters
+    ----------
+    csv_by_date: full pathname to the by-date folder
+    date_name: date in the format YYYYMMDD
+
+    Returns
+    -------
+    the dates of the list, newest first
+    """
+    list_file = Path(csv_by_date) / 'ListOfDates.txt'
+    dates = _read_list_of_dates(list_file, csv_by_date)
+    if date_name in dates and list_file.exists():
+        return dates
+    dates = sorted(set(dates) | {date_name}, reverse=True)
+
+    tmp_file = list_file.with_name(list_file.name + '.tmp')
+    with open(tmp_file, 'w') as output_file:
+        for date in dates:
+            output_file.write(date + '\n')
+    os.replace(tmp_file, list_file)
+    return dates
+
+
+def _replace_link(src: Path, dst: Path) -> None:
+    """Point dst at src in one rename: a relative symbolic link, or a hard link or copy where links are unsupported."""
+    tmp_file = dst.with_name('.' + dst.name + '.tmp')
+    if tmp_file.is_symlink() or tmp_file.exists():
+        tmp_file.unlink()
+    try:
+        os.symlink(src.name, tmp_file)
+    except (OSError, NotImplementedError):
+        if dst.exists() and not dst.is_symlink() and os.path.samefile(src, dst):
+            return
+        try:
+            os.link(src, tmp_file)
+        except OSError:
+            shutil.copyfile(src, tmp_file)
+    os.replace(tmp_file, dst)
+
+
+def publish_latest_date(csv_by_date: Path, date_name: str) -> bool:
+    """
+    Record a processed date in ListOfDates.txt and, if it is the most recent date, point the
+    SnowpackStatisticsByDate_LatestDate files (.csv, .geojson, shapefile components) at the files of the date. Each
+    latest file is swapped in one rename, so readers never see a half-written file, and nothing is copied. The
+    LatestDate archives are written by package_day(latest=True).
+    Parameters
+    ----------
+    csv_by_date: full pathname to the by-date folder
+    date_name: date in the format YYYYMMDD
+
+    Returns
+    -------
+    True if the date is now the latest date
+    """
+    csv_by_date = Path(csv_by_date)
+    dates = update_list_of_dates(csv_by_date, date_name)
+    if dates[0] != date_name:
+        return False
+
+    for ext in LATEST_DATE_EXTENSIONS:
+        src = csv_by_date / (BY_DATE_PREFIX + date_name + ext)
+        dst = csv_by_date / (BY_DATE_PREFIX + LATEST_DATE_NAME + ext)
+        if src.exists():
+            _replace_link(src, dst)
+        elif dst.is_symlink() or dst.exists():
+            # Do not leave a component of an older date next to the components of the latest date.
+            dst.unlink()
+    logger.info('publish_latest_date: {} is the latest date in {}'.format(date_name, csv_by_date))
+    return True
+
+
+def write_zip(zip_file: Path, members: dict, compresslevel: int = ZIP_COMPRESSION_LEVEL) -> Path:
+    """
+    Write an archive straight from the contents of its members, without writing them as loose files first. The
+    archive is written to a temporary file and renamed into place, so readers never see a partial archive.
+    Parameters
+    ----------
+    zip_file: full pathname of the .zip file
+    members: {file name in the archive: bytes}
+    compresslevel: zlib compression level, from 1 (fastest) to 9 (smallest)
+
+    Returns
+    -------
+    zip_file
+    """
+    zip_file = Path(zip_file)
+    tmp_file = zip_file.with_name(zip_file.name + '.tmp')
+    with zipfile.ZipFile(str(tmp_file), 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name, contents in members.items():
+            archive.writestr(name, contents)
+    os.replace(tmp_file, zip_file)
+    return zip_file
+
+
+def package_day(template: BasinTemplate, csv_by_date: Path, date_name: str, columns: dict,
+                compresslevel: int = ZIP_COMPRESSION_LEVEL, threads: int = 2, latest: bool = False) -> list:
+    """
+    Package the daily layers of the basins as SnowpackStatisticsByDate_YYYYMMDD.zip (the shapefile) and
+    SnowpackStatisticsByDate_YYYYMMDD.geojson.zip, serialized in memory from the template and compressed at the same
+    time by separate threads (zlib releases the GIL while it compresses), so the layers are never written as loose
+    files just to be zipped.
+    For the latest date, SnowpackStatisticsByDate_LatestDate.zip and .geojson.zip are packaged too, from the same
+    serialized layers, with the member names SnowpackStatisticsByDate_LatestDate.*.
+    Ex: package_day(template, csv_by_date, date_name, columns, latest=publish_latest_date(csv_by_date, date_name))
+    Parameters
+    ----------
+    template: BasinTemplate of the basins
+    csv_by_date: full pathname to the by-date folder
+    date_name: date in the format YYYYMMDD
+    columns: {field name: array of one value per basin}
+    compresslevel: zlib compression level, from 1 (fastest) to 9 (smallest)
+    threads: number of archives compressed at a time
+    latest: if True, also package the LatestDate archives
+
+    Returns
+    -------
+    list of the .zip files
+    """
+    name = BY_DATE_PREFIX + date_name
+    shapefile = template.shapefile_members(name, columns)
+    archives = {Path(csv_by_date) / (name + '.zip'): shapefile,
+                Path(csv_by_date) / (name + '.geojson.zip'): {name + '.geojson': template.geojson_bytes(name, columns)}}
+    if latest:
+        # The shapefile components do not hold their name, so only the members are renamed. The GeoJSON holds it.
+        latest_name = BY_DATE_PREFIX + LATEST_DATE_NAME
+        archives[Path(csv_by_date) / (latest_name + '.zip')] = {latest_name + member[len(name):]: contents
+                                                                for member, contents in shapefile.items()}
+        archives[Path(csv_by_date) / (latest_name + '.geojson.zip')] = {
+            latest_name + '.geojson': template.geojson_bytes(latest_name, columns)}
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = [executor.submit(write_zip, zip_file, members, compresslevel)
+                   for zip_file, members in archives.items()]
+        zip_files = [future.result() for future in futures]
+    logger.info('package_day: Packaged {} of {} basins in {}'.format(date_name, len(template), csv_by_date))
+    return zip_files
+
+
+# Statistic columns of the byDate and byBasin .csv files, in the order of the original QGIS export. Columns that are
+# not listed, Ex: the statistics of other products, follow in the order they are computed.
+CSV_FIELD_ORDER = ['SNODAS_SWE_Mean_in', 'SNODAS_SWE_Mean_mm', 'SNODAS_EffectiveArea_sqmi', 'SNODAS_SWE_Volume_acft',
+                   'SNODAS_SWE_Volume_1WeekChange_acft', 'SNODAS_SnowCover_percent', 'Updated_Timestamp',
+                   'SNODAS_SWE_Max_in', 'SNODAS_SWE_Max_mm', 'SNODAS_SWE_Min_in', 'SNODAS_SWE_Min_mm',
+                   'SNODAS_SWE_StdDev_in', 'SNODAS_SWE_StdDev_mm']
+
+# Decimal places of the SWE statistics, as rounded by the original QGIS export. Other statistics are rounded to
+# ATTRIBUTE_DECIMALS.
+STATISTIC_DECIMALS = {'SNODAS_SWE_Mean_in': 1, 'SNODAS_SWE_Mean_mm': 0, 'SNODAS_EffectiveArea_sqmi': 1,
+                      'SNODAS_SWE_Volume_acft': 0, 'SNODAS_SWE_Volume_1WeekChange_acft': 0,
+                      'SNODAS_SnowCover_percent': 2, 'SNODAS_SWE_Max_in': 1, 'SNODAS_SWE_Max_mm': 0,
+                      'SNODAS_SWE_Min_in': 1, 'SNODAS_SWE_Min_mm': 0, 'SNODAS_SWE_StdDev_in': 1,
+                      'SNODAS_SWE_StdDev_mm': 0}
+
+
+def round_statistics(columns: dict) -> dict:
+    """Round each column of statistics to its decimal places in STATISTIC_DECIMALS, or to ATTRIBUTE_DECIMALS."""
+    return {name: np.round(np.asarray(values, dtype=np.float64), STATISTIC_DECIMALS.get(name, ATTRIBUTE_DECIMALS))
+            for name, values in columns.items()}
+
+
+def week_change(csv_by_date: Path, week_ago_name: str, basin_ids: list, volume, id_field: str = 'LOCAL_ID',
+                suffix: str = ''):
+    """
+    Compute the change in SWE volume of every basin since an earlier date, read from the by-date .csv file of that
+    date.
+    Parameters
+    ----------
+    csv_by_date: full pathname to the by-date folder
+    week_ago_name: the earlier date in the format YYYYMMDD
+    basin_ids: id of basins 1 to n, as returned by SNODAS_Zonal.rasterize_basins
+    volume: 'SNODAS_SWE_Volume_acft' of each basin
+    id_field: name of the basin id column
+    suffix: suffix of the name of the by-date .csv file (see write_statistics_csvs)
+
+    Returns
+    -------
+    float64 array of the change of each basin, NaN where the earlier date has no volume for the basin
+    """
+    previous = {}
+    csv_file = Path(csv_by_date) / (BY_DATE_PREFIX + week_ago_name + suffix + '.csv')
+    if csv_file.exists():
+        with open(csv_file, newline='') as file:
+            for row in csv.DictReader(file):
+                try:
+                    previous[row[id_field]] = float(row['SNODAS_SWE_Volume_acft'])
+                except (KeyError, ValueError):
+                    continue
+    week_ago = np.array([previous.get(str(basin_id), np.nan) for basin_id in basin_ids], dtype=np.float64)
+    return np.asarray(volume, dtype=np.float64) - week_ago
+
+
+def statistics_fieldnames(columns: dict, id_field: str = 'LOCAL_ID') -> list:
+    """Return the header of the .csv files of the statistic columns, in the order of CSV_FIELD_ORDER."""
+    fieldnames = ['Date_YYYYMMDD', id_field, 'LOCAL_NAME']
+    fieldnames += [name for name in CSV_FIELD_ORDER if name in columns or name == 'Updated_Timestamp']
+    return fieldnames + [name for name in columns if name not in CSV_FIELD_ORDER]
+
+
+def _write_csv(csv_file: Path, fieldnames: list, rows: list) -> None:
+    """Write the rows of a .csv file to a temporary file and rename it into place."""
+    tmp_file = csv_file.with_name(csv_file.name + '.tmp')
+    with open(tmp_file, 'w', newline='') as file:
+        csv_writer = csv.DictWriter(file, delimiter=',', fieldnames=fieldnames, restval='', extrasaction='ignore')
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+    os.replace(tmp_file, csv_file)
+
+
+def write_statistics_csvs(csv_by_date: Path, csv_by_basin: Path, date_name: str, basin_ids: list, local_names: list,
+                          columns: dict, timestamp: str, id_field: str = 'LOCAL_ID', suffix: str = '') -> Path:
+    """
+    Write the statistics of a day to SnowpackStatisticsByDate_YYYYMMDD.csv, one row per basin, and add them to the
+    SnowpackStatisticsByBasin_<id>.csv file of every basin, sorted by date. A date that was processed before replaces
+    its row, so reprocessing a date never leaves duplicate rows. Columns of a by-basin file that are no longer
+    computed are kept, empty for the new row.
+    Parameters
+    ----------
+    csv_by_date: full pathname to the by-date folder
+    csv_by_basin: full pathname to the by-basin folder. If None, only the by-date file is written.
+    date_name: date in the format YYYYMMDD
+    basin_ids: id of basins 1 to n, as returned by SNODAS_Zonal.rasterize_basins
+    local_names: LOCAL_NAME of each basin, in the same order
+    columns: {column name: array of one value per basin} (see round_statistics). NaN is written as an empty value.
+    timestamp: download timestamp of the day, written to the 'Updated_Timestamp' column
+    id_field: name of the basin id column
+    suffix: added to the name of the by-date .csv file, Ex: '_Upstream' for
+    SnowpackStatisticsByDate_YYYYMMDD_Upstream.csv, which is not one of the dates of ListOfDates.txt
+
+    Returns
+    -------
+    full pathname of the by-date .csv file
+    """
+    fieldnames = statistics_fieldnames(columns, id_field)
+    rows = []
+    for i, basin_id in enumerate(basin_ids):
+        row = {'Date_YYYYMMDD': date_name, id_field: basin_id, 'LOCAL_NAME': local_names[i],
+               'Updated_Timestamp': timestamp}
+        for name, values in columns.items():
+            value = float(values[i])
+            if np.isnan(value):
+                row[name] = ''
+            else:
+                row[name] = int(value) if STATISTIC_DECIMALS.get(name) == 0 else value
+        rows.append(row)
+
+    by_date_file = Path(csv_by_date) / (BY_DATE_PREFIX + date_name + suffix + '.csv')
+    _write_csv(by_date_file, fieldnames, rows)
+    if csv_by_basin is None:
+        return by_date_file
+
+    for row in rows:
+        by_basin_file = Path(csv_by_basin) / (BY_BASIN_PREFIX + str(row[id_field]) + '.csv')
+        basin_fieldnames, basin_rows = fieldnames, []
+        if by_basin_file.exists():
+            with open(by_basin_file, newline='') as file:
+                reader = csv.DictReader(file)
+                header = list(reader.fieldnames or [])
+                basin_fieldnames = header + [name for name in fieldnames if name not in header]
+                basin_rows = [basin_row for basin_row in reader if basin_row.get('Date_YYYYMMDD') != date_name]
+        basin_rows.append(row)
+        basin_rows.sort(key=lambda basin_row: basin_row['Date_YYYYMMDD'])
+        _write_csv(by_basin_file, basin_fieldnames, basin_rows)
+
+    logger.info('write_statistics_csvs: Wrote the statistics of {} basins for {}'.format(len(rows), date_name))
+    return by_date_file
@@ -0,0 +1,183 @@
+import csv
+import json
+import logging
+import multiprocessing as mp
+import os
+
+from datetime import datetime
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.dates as mdates  # noqa: E402
+import matplotlib.pyplot as plt  # noqa: E402
+
+from SNODAS_Accumulation import water_year  # noqa: E402
+
+logger = logging.getLogger('utilities')
+
+# Name of the by-basin .csv files, and of the graph of each basin
+BY_BASIN_PREFIX = 'SnowpackStatisticsByBasin_'
+GRAPH_PREFIX = 'SnowpackGraph_'
+
+# File in the graph folder recording the .csv files each graph was rendered from, and the .csv files without values
+GRAPH_STATE_NAME = '.graph_state.json'
+
+# Size of the graphs in inches and their resolution
+GRAPH_SIZE = (10, 5)
+GRAPH_DPI = 100
+
+# Figure of a worker process, created once and reused for every graph the worker renders
+_figure = None
+
+
+def read_basin_series(csv_file: Path, column: str = 'SNODAS_SWE_Mean_in') -> tuple:
+    """
+    Read the time series of one statistic from a by-basin .csv file.
+    Parameters
+    ----------
+    csv_file: full pathname of a SnowpackStatisticsByBasin_<id>.csv file
+    column: name of the statistic. Ex: 'SNODAS_SWE_Volume_acft'
+
+    Returns
+    -------
+    tuple of (list of dates, list of values) sorted by date. Empty values are skipped.
+    """
+    series = {}
+    with open(csv_file, newline='') as file:
+        for row in csv.DictReader(file):
+            value = row.get(column)
+            if not value:
+                continue
+            try:
+                series[datetime.strptime(row['Date_YYYYMMDD'], '%Y%m%d')] = float(value)
+            except ValueError:
+                continue
+    dates = sorted(series)
+    return dates, [series[date] for date in dates]
+
+
+def _get_figure():
+    global _figure
+    if _figure is None:
+        _figure = plt.figure(figsize=GRAPH_SIZE, dpi=GRAPH_DPI)
+        _figure.add_subplot(1, 1, 1)
+    return _figure
+
+
+def render_basin_graph(task: tuple) -> str:
+    """
+    Render the graph of one basin: one line per water year of the statistic against the day of the water year, with
+    the most recent water year drawn on top. The figure of the process is reused, so only the lines are redrawn.
+    task: tuple of (by-basin .csv file, graph .png file, column, label of the y axis)
+
+    Returns
+    -------
+    the .csv file, or None if it has no values
+    """
+    csv_file, png_file, column, ylabel = task
+    dates, values = read_basin_series(csv_file, column)
+    if not dates:
+        return None
+
+    by_year = {}
+    for date, value in zip(dates, values):
+        # Plot every water year on the dates of 2000-2001 so they line up by day of the water year.
+        wy = water_year(date)
+        try:
+            aligned = date.replace(year=2000 if date.month >= 10 else 2001)
+        except ValueError:
+            # February 29 of a leap year is drawn on February 28.
+            aligned = date.replace(year=2001, day=28)
+        by_year.setdefault(wy, ([], []))
+        by_year[wy][0].append(aligned)
+        by_year[wy][1].append(value)
+
+    figure = _get_figure()
+    axes = figure.axes[0]
+    axes.clear()
+    latest = max(by_year)
+    for wy in sorted(by_year):
+        if wy == latest:
+            axes.plot(by_year[wy][0], by_year[wy][1], color='tab:blue', linewidth=2, label='WY{}'.format(wy), zorder=3)
+        else:
+            axes.plot(by_year[wy][0], by_year[wy][1], color='0.7', linewidth=0.8)
+    axes.set_xlim(datetime(2000, 10, 1), datetime(2001, 9, 30))
+    axes.xaxis.set_major_locator(mdates.MonthLocator())
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%b'))
+    axes.set_ylim(bottom=0)
+    axes.set_ylabel(ylabel)
+    axes.set_title('{} ({} water years, through {})'.format(Path(csv_file).stem[len(BY_BASIN_PREFIX):], len(by_year),
+                                                           dates[-1].strftime('%Y-%m-%d')))
+    axes.grid(True, color='0.9')
+    axes.legend(loc='upper right')
+
+    tmp_file = Path(png_file).with_name(Path(png_file).name + '.tmp')
+    figure.savefig(str(tmp_file), format='png')
+    os.replace(tmp_file, png_file)
+    return str(csv_file)
+
+
+def create_basin_graphs(csv_by_basin: Path, graph_path: Path, column: str = 'SNODAS_SWE_Mean_in',
+                        ylabel: str = 'Mean SWE (in)', processes: int = None, overwrite: bool = False) -> list:
+    """
+    Render the snowpack time series graph of every basin from the by-basin .csv files, replacing the TSTool command
+    file run by create_snodas_swe_graphs. Only the basins whose .csv file changed since their graph was rendered are
+    rendered again, by a pool of processes. A .csv file without values of the column has no graph, and is only read
+    again once it changes.
+    Parameters
+    ----------
+    csv_by_basin: full pathname to the folder of the SnowpackStatisticsByBasin_<id>.csv files
+    graph_path: full pathname to the folder of the graphs. Each graph is named SnowpackGraph_<id>.png.
+    column: statistic to plot
+    ylabel: label of the y axis
+    processes: number of worker processes. Defaults to the CPU count.
+    overwrite: if True, render every graph
+
+    Returns
+    -------
+    list of the .csv files whose graph was rendered
+    """
+    graph_path = Path(graph_path)
+    os.makedirs(graph_path, exist_ok=True)
+    state_file = graph_path / GRAPH_STATE_NAME
+    state = {}
+    if state_file.exists() and not overwrite:
+        with open(state_file) as file:
+            state = json.load(file)
+
+    tasks, stamps = [], {}
+    for csv_file in sorted(Path(csv_by_basin).glob(BY_BASIN_PREFIX + '*.csv')):
+        png_file = graph_path / (GRAPH_PREFIX + csv_file.stem[len(BY_BASIN_PREFIX):] + '.png')
+        stat = csv_file.stat()
+        stamps[str(csv_file)] = [stat.st_size, stat.st_mtime_ns, column]
+        # The state of a .csv file is its stamp and whether it has a graph.
+        previous = state.get(str(csv_file), [])
+        has_graph = previous[3:] != [False]
+        if previous[:3] != stamps[str(csv_file)] or (has_graph and not png_file.exists()):
+            tasks.append((str(csv_file), str(png_file), column, ylabel))
+
+    if not tasks:
+        logger.info('create_basin_graphs: The graphs in {} are up to date'.format(graph_path))
+        return []
+
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        rendered = [render_basin_graph(task) for task in tasks]
+    else:
+        with mp.Pool(processes=processes) as pool:
+            rendered = pool.map(render_basin_graph, tasks, chunksize=max(1, len(tasks) // (processes * 4)))
+    rendered = [csv_file for csv_file in rendered if csv_file is not None]
+
+    for task in tasks:
+        state[task[0]] = stamps[task[0]] + [task[0] in rendered]
+    tmp_file = state_file.with_name(state_file.name + '.tmp')
+    with open(tmp_file, 'w') as file:
+        json.dump(state, file, indent=1)
+    os.replace(tmp_file, state_file)
+
+    logger.info('create_basin_graphs: Rendered {} of {} basin graphs in {} on {} processes'
+                .format(len(rendered), len(stamps), graph_path, processes))
+    return rendered
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import utilities
+
+logger = logging.getLogger('utilities')
+
+# Default memory budget of a GridCache: about 40 dense int16 grids, or 20 float32 grids.
+GRID_CACHE_BYTES = 2 * 2 ** 30
+
+
+class GridCache:
+    """
+    In-process cache of decoded grids, keyed by (date, product, variant), where variant names the form of the grid.
+    Ex: ('20230401', '1034', 'raw') for the int16 grid of the .dat file, ('20230401', '1034', 'scaled') for the float32
+    grid in millimeters. Grids are evicted least recently used first once the memory budget is exceeded.
+
+    With disk_path, every raw grid put in the cache is also saved there as a .npy file of the raw-array cache (see
+    raw_cache_file), and a raw grid that is not in memory is memory-mapped from its .npy file instead of being decoded
+    again, including by a later run. The folder can be shared with open_raw_grid and SNODAS_Points.extract_points
+    (rootdir/raw_cache). The other variants are derived from the raw grid and only kept in memory.
+
+    Cached grids are made read-only, since every caller receives the same array. Copy a grid before changing it.
+    max_bytes: memory budget of the grids held in memory
+    disk_path: optional full pathname to the folder of the raw-array cache
+    """
+
+    def __init__(self, max_bytes: int = GRID_CACHE_BYTES, disk_path: Path = None):
+        self.max_bytes = max_bytes
+        self.disk_path = Path(disk_path) if disk_path is not None else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._grids = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        if self.disk_path is not None:
+            os.makedirs(self.disk_path, exist_ok=True)
+
+    def __len__(self):
+        return len(self._grids)
+
+    def __contains__(self, key):
+        return key in self._grids
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the grids held in memory."""
+        return self._nbytes
+
+    def _disk_file(self, key: tuple) -> Path:
+        """Return the .npy file of key in the raw-array cache, or None if the grid is not saved to disk."""
+        date, product, variant = key
+        if self.disk_path is None or variant != 'raw':
+            return None
+        return raw_cache_file(self.disk_path, date, product)
+
+    def get(self, key: tuple, default=None):
+        """Return the grid of key, from memory or from the .npy tier, or default if it is not cached."""
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                self.hits += 1
+                return grid
+
+        disk_file = self._disk_file(key)
+        if disk_file is not None and disk_file.exists():
+            grid = np.load(disk_file, mmap_mode='r')
+            with self._lock:
+                self.disk_hits += 1
+            self._put_memory(key, grid)
+            return grid
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key: tuple, grid) -> None:
+        """Add a grid to the cache. A raw grid is saved to the raw-array cache too if there is one."""
+        grid.flags.writeable = False
+        disk_file = self._disk_file(key)
+        if disk_file is not None and not disk_file.exists():
+            _save_npy(disk_file, grid)
+        self._put_memory(key, grid)
+
+    def _put_memory(self, key: tuple, grid) -> None:
+        with self._lock:
+            if key in self._grids:
+                self._nbytes -= self._grids.pop(key).nbytes
+            self._grids[key] = grid
+            self._nbytes += grid.nbytes
+            # Always keep the newest grid, even if it alone is over the budget.
+            while self._nbytes > self.max_bytes and len(self._grids) > 1:
+                _, evicted = self._grids.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def get_or_load(self, key: tuple, loader):
+        """Return the grid of key, calling loader() to decode it and adding it to the cache if it is not cached."""
+        grid = self.get(key)
+        if grid is None:
+            grid = loader()
+            if grid is not None:
+                self.put(key, grid)
+        return grid
+
+    def clear(self) -> None:
+        """Empty the memory tier. The raw-array cache is kept."""
+        with self._lock:
+            self._grids.clear()
+            self._nbytes = 0
+
+    def stats(self) -> dict:
+        """Return the hit and miss counters and the memory in use."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    'grids': len(self._grids), 'nbytes': self._nbytes, 'max_bytes': self.max_bytes}
+
+
+def read_snodas_day_grid(download_path: Path, current, product: str, scaled: bool = False, cache: GridCache = None):
+    """
+    Read one product of a day from its .tar file, through a GridCache when one is given, so reading the same day again
+    is a dictionary lookup instead of a decompression.
+    Parameters
+    ----------
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    current: the date of interest in date or datetime format
+    product: product code, a key of utilities.snodas_param_info
+    scaled: if True, return the float32 grid in the units of snodas_param_info (see utilities.scale_snodas_grid).
+    Otherwise return the int16 grid of the .dat file.
+    cache: optional GridCache
+
+    Returns
+    -------
+    the grid, or None if the .tar file or the product does not exist
+    """
+    current_date = utilities.format_date_yyyymmdd(current)
+    tar_file = Path(download_path) / ('SNODAS_' + current_date + '.tar')
+
+    def load_raw():
+        if not tar_file.exists():
+            return None
+        return utilities.read_snodas_tar_grids(tar_file, [product]).get(product)
+
+    def load_scaled():
+        raw = cache.get_or_load((current_date, product, 'raw'), load_raw) if cache is not None else load_raw()
+        return utilities.scale_snodas_grid(raw, product) if raw is not None else None
+
+    loader = load_scaled if scaled else load_raw
+    if cache is None:
+        return loader()
+    return cache.get_or_load((current_date, product, 'scaled' if scaled else 'raw'), loader)
+
+
+def raw_cache_file(cache_path: Path, current, product: str) -> Path:
+    """Return the .npy file of one product of a day in the raw-array cache. Ex: cache_path/20230401/1034.npy
+    current is a date, a datetime or a YYYYMMDD string."""
+    current_date = current if isinstance(current, str) else utilities.format_date_yyyymmdd(current)
+    return Path(cache_path) / current_date / (product + '.npy')
+
+
+def _save_npy(npy_file: Path, grid) -> None:
+    os.makedirs(npy_file.parent, exist_ok=True)
+    # Each process writes its own temporary file. If two processes cache the same day, the last rename wins and both
+    # files hold the same grid.
+    tmp_file = npy_file.with_name('{}.{}.tmp'.format(npy_file.name, os.getpid()))
+    with open(tmp_file, 'wb') as file:
+        np.save(file, grid)
+    os.replace(tmp_file, npy_file)
+
+
+def cache_snodas_tar(tar_file: Path, cache_path: Path, current, products=None) -> dict:
+    """
+    Decode a daily .tar file once and save each product as an uncompressed native-endian int16 .npy file in the
+    raw-array cache. Products that are already cached are not decoded again.
+    Parameters
+    ----------
+    tar_file: full pathname of the SNODAS .tar file
+    cache_path: full pathname to the folder of the raw-array cache
+    current: the date of the .tar file in date or datetime format
+    products: list of product codes to cache. Defaults to all products.
+
+    Returns
+    -------
+    dictionary of {product code: .npy file} of the products of the day that are in the cache
+    """
+    if products is None:
+        products = utilities.SNODAS_BAND_ORDER
+    missing = [product for product in products if not raw_cache_file(cache_path, current, product).exists()]
+    if missing:
+        for product, grid in utilities.read_snodas_tar_grids(tar_file, missing).items():
+            npy_file = raw_cache_file(cache_path, current, product)
+            _save_npy(npy_file, grid)
+    return {product: raw_cache_file(cache_path, current, product) for product in products
+            if raw_cache_file(cache_path, current, product).exists()}
+
+
+def open_raw_grid(cache_path: Path, download_path: Path, current, product: str):
+    """
+    Open one product of a day from the raw-array cache as a read-only memory map, caching the .tar file of the day
+    first if needed. The pages of a memory-mapped grid are shared through the operating system page cache, so the
+    worker processes of a pool that read the same day do not each hold a private copy, and reading a few cells only
+    loads the pages that hold them.
+    Parameters
+    ----------
+    cache_path: full pathname to the folder of the raw-array cache
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    current: the date of interest in date or datetime format
+    product: product code, a key of utilities.snodas_param_info
+
+    Returns
+    -------
+    read-only int16 memmap in the unscaled units of the .dat file, or None if the day or the product is not available
+    """
+    npy_file = raw_cache_file(cache_path, current, product)
+    if not npy_file.exists():
+        tar_file = Path(download_path) / ('SNODAS_' + utilities.format_date_yyyymmdd(current) + '.tar')
+        if not tar_file.exists() or product not in cache_snodas_tar(tar_file, cache_path, current):
+            return None
+    return np.load(npy_file, mmap_mode='r')
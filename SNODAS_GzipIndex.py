@@ -0,0 +1,148 @@
+import gzip
+import io
+import logging
+import os
+import tarfile
+import zlib
+
+from pathlib import Path
+
+import numpy as np
+
+import utilities
+from SNODAS_Manifest import snodas_product_code
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+logger = logging.getLogger('utilities')
+
+# Distance in uncompressed bytes between the seek points of an index. A 46 MB band gets 13 seek points, so reading a
+# window of 300 rows (4.2 MB) decompresses 6.3 MB on average instead of everything before the window. Each seek point
+# stores a 32 KB window, which zlib compresses to a few KB, so the index of a band is about 190 KB on disk.
+GZ_INDEX_SPACING = 4 * 2 ** 20
+
+# Bytes in one row of a band. The .dat files are in BIL order, so rows are stored one after the other.
+ROW_BYTES = utilities.SNODAS_NCOLS * np.dtype(utilities.SNODAS_DTYPE).itemsize
+
+
+def gz_index_file(index_path: Path, member_name: str) -> Path:
+    """Return the file holding the seek-point index of a .dat.gz member."""
+    return Path(index_path) / (Path(member_name).name + '.gzidx')
+
+
+def _open_member(tar, member, index_path: Path, spacing: int, build_index: bool = True):
+    """
+    Open a .dat.gz member of a tar as a seekable file of its decompressed bytes. With indexed_gzip, the seek-point index
+    of the member is imported from index_path, or built and exported there the first time if build_index is True, so
+    later seeks start decompressing from the nearest seek point. Otherwise gzip decompresses and discards everything
+    before the seek.
+    """
+    member_file = tar.extractfile(member)
+    index_file = gz_index_file(index_path, member.name)
+    if indexed_gzip is None or (not build_index and not index_file.exists()):
+        return gzip.GzipFile(fileobj=member_file)
+
+    gz_file = indexed_gzip.IndexedGzipFile(fileobj=member_file, spacing=spacing)
+    if index_file.exists():
+        with open(index_file, 'rb') as file:
+            try:
+                gz_file.import_index(fileobj=io.BytesIO(zlib.decompress(file.read())))
+                return gz_file
+            except zlib.error:
+                logger.warning('_open_member: {} is not a compressed index and is rebuilt'.format(index_file))
+
+    gz_file.build_full_index()
+    index = io.BytesIO()
+    gz_file.export_index(fileobj=index)
+    os.makedirs(index_path, exist_ok=True)
+    tmp_file = index_file.with_name('{}.{}.tmp'.format(index_file.name, os.getpid()))
+    with open(tmp_file, 'wb') as file:
+        file.write(zlib.compress(index.getvalue(), 6))
+    os.replace(tmp_file, index_file)
+    logger.info('_open_member: Saved the seek-point index of {} to {}'.format(member.name, index_file))
+    return gz_file
+
+
+def default_index_path(tar_file: Path) -> Path:
+    """Return the default folder of the seek-point indexes of the members of a .tar file: a 'gzindex' sub-folder of the
+    folder of the .tar file."""
+    return Path(tar_file).parent / 'gzindex'
+
+
+def read_snodas_tar_rows(tar_file: Path, row_start: int, row_stop: int, products=None, index_path: Path = None,
+                         spacing: int = GZ_INDEX_SPACING, build_index: bool = True) -> dict:
+    """
+    Decode only rows row_start to row_stop (exclusive) of the .dat.gz members of a daily SNODAS .tar file. Decompression
+    starts at the seek point just before row_start and stops after row_stop, so a region covering a few hundred rows
+    decompresses a small fraction of each band. The seek-point indexes are built the first time a member is read and
+    are reused afterwards. If indexed_gzip is not installed, the rows before row_start are decompressed and discarded
+    without being kept in memory, and decompression still stops after row_stop.
+    Parameters
+    ----------
+    tar_file: full pathname of the SNODAS .tar file
+    row_start: first row to read
+    row_stop: row after the last row to read
+    products: list of product codes (keys of utilities.snodas_param_info) to decode. Defaults to all products.
+    index_path: full pathname to the folder of the seek-point indexes. Defaults to default_index_path(tar_file).
+    spacing: distance in uncompressed bytes between the seek points of a new index
+    build_index: if False, only use the indexes that already exist (see build_snodas_gz_indexes). Building an index
+    decompresses the whole member once, which only pays off for a .tar file that is read more than once.
+
+    Returns
+    -------
+    dictionary of {product code: native-endian int16 array of shape (row_stop - row_start, SNODAS_NCOLS)} in the
+    unscaled units of the .dat file, like utilities.read_snodas_tar_grids
+    """
+    row_start = max(0, row_start)
+    row_stop = min(utilities.SNODAS_NROWS, row_stop)
+    if row_stop <= row_start:
+        raise ValueError('read_snodas_tar_rows: Empty row window {} to {}'.format(row_start, row_stop))
+    if index_path is None:
+        index_path = default_index_path(tar_file)
+
+    grids = {}
+    with tarfile.open(tar_file) as tar:
+        for member in tar.getmembers():
+            if not member.name.endswith('.dat.gz'):
+                continue
+            product = snodas_product_code(member.name)
+            if product is None or (products is not None and product not in products):
+                continue
+            with _open_member(tar, member, index_path, spacing, build_index) as gz_file:
+                gz_file.seek(row_start * ROW_BYTES)
+                data = gz_file.read((row_stop - row_start) * ROW_BYTES)
+            grids[product] = np.frombuffer(data, dtype=utilities.SNODAS_DTYPE)\
+                .reshape(row_stop - row_start, utilities.SNODAS_NCOLS).astype(np.int16)
+
+    return grids
+
+
+def build_snodas_gz_indexes(tar_file: Path, index_path: Path = None, spacing: int = GZ_INDEX_SPACING) -> list:
+    """
+    Build the seek-point index of every .dat.gz member of a .tar file that does not have one yet, for example right
+    after the .tar file is downloaded.
+    Parameters
+    ----------
+    tar_file: full pathname of the SNODAS .tar file
+    index_path: full pathname to the folder of the seek-point indexes. Defaults to default_index_path(tar_file).
+    spacing: distance in uncompressed bytes between the seek points
+
+    Returns
+    -------
+    list of the index files of the members
+    """
+    if indexed_gzip is None:
+        raise ImportError('build_snodas_gz_indexes: indexed_gzip is required to build seek-point indexes.')
+    if index_path is None:
+        index_path = default_index_path(tar_file)
+
+    index_files = []
+    with tarfile.open(tar_file) as tar:
+        for member in tar.getmembers():
+            if member.name.endswith('.dat.gz'):
+                _open_member(tar, member, index_path, spacing).close()
+                index_files.append(gz_index_file(index_path, member.name))
+    return index_files
@@ -0,0 +1,193 @@
+import logging
+import sqlite3
+import time
+import traceback
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger('utilities')
+
+# Default name of the job-state database. It is saved in the root directory of the run.
+JOB_DB_NAME = 'snodas_jobs.sqlite'
+
+# Stages a date goes through, in order. 'download' retrieves the .tar file from the FTP site and 'process' turns the
+# .tar file into the outputs of the run. The intermediate files of 'process' only live for the duration of the stage,
+# so a stage is the smallest unit that can be safely re-run.
+JOB_STAGES = ['download', 'process']
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    rootdir TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id INTEGER NOT NULL REFERENCES jobs(job_id),
+    date TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    elapsed REAL,
+    error TEXT,
+    PRIMARY KEY (job_id, date, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_status ON stages (job_id, status);
+"""
+
+
+class JobStageError(Exception):
+    """Raised by a stage to mark it as failed with a message instead of a traceback."""
+
+
+class JobStore:
+    """
+    Persistent record of backfill jobs and of each date's progress through each stage, saved in a SQLite database.
+    A job that stops part way through (crash, reboot, killed process) can be resumed from the stages that did not
+    finish, and dates that failed can be retried later without re-running the dates that succeeded.
+
+    Each process must open its own JobStore. SQLite serializes the writes of the worker processes of a pool.
+    db_path: full pathname of the SQLite database. It is created if it does not exist.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60)
+        self.conn.row_factory = sqlite3.Row
+        # Write-ahead logging lets readers carry on while a worker records a stage.
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def create_job(self, start_date, end_date, rootdir) -> int:
+        """
+        Create a job covering every date from start_date to end_date (inclusive), with all stages pending.
+        Parameters
+        ----------
+        start_date: start date in date format
+        end_date: end date in date format
+        rootdir: root directory of the run
+
+        Returns
+        -------
+        the id of the new job
+        """
+        with self.conn:
+            cursor = self.conn.execute('INSERT INTO jobs (start_date, end_date, rootdir, created) VALUES (?, ?, ?, ?)',
+                                       (start_date.isoformat(), end_date.isoformat(), str(rootdir),
+                                        datetime.now().isoformat()))
+            job_id = cursor.lastrowid
+            total_days = (end_date - start_date).days + 1
+            rows = [(job_id, (start_date + timedelta(days=day_number)).isoformat(), stage, PENDING)
+                    for day_number in range(total_days) for stage in JOB_STAGES]
+            self.conn.executemany('INSERT INTO stages (job_id, date, stage, status) VALUES (?, ?, ?, ?)', rows)
+        logger.info('JobStore: Created job {} for {} to {}'.format(job_id, start_date, end_date))
+        return job_id
+
+    def job(self, job_id: int) -> dict:
+        """Return the jobs row of job_id as a dictionary, or None if it does not exist."""
+        row = self.conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def latest_job_id(self) -> int:
+        """Return the id of the most recently created job, or None if there are no jobs."""
+        row = self.conn.execute('SELECT MAX(job_id) FROM jobs').fetchone()
+        return row[0]
+
+    def stage_status(self, job_id: int, date) -> dict:
+        """Return {stage: status} for one date of a job."""
+        rows = self.conn.execute('SELECT stage, status FROM stages WHERE job_id = ? AND date = ?',
+                                 (job_id, _date_key(date)))
+        return {row['stage']: row['status'] for row in rows}
+
+    def incomplete_dates(self, job_id: int) -> list:
+        """Return the dates of a job with a stage that is pending or was left running, in ascending order. Dates with
+        a failed stage are left for reset_failed."""
+        failed = set(self.failed_dates(job_id))
+        return [date for date in self._dates_with_status(job_id, (PENDING, RUNNING)) if date not in failed]
+
+    def failed_dates(self, job_id: int) -> list:
+        """Return the dates of a job with a failed stage, in ascending order."""
+        return self._dates_with_status(job_id, (FAILED,))
+
+    def reset_failed(self, job_id: int) -> list:
+        """Set every failed stage of a job back to pending so it is re-run. Returns the dates that were reset."""
+        dates = self.failed_dates(job_id)
+        with self.conn:
+            self.conn.execute('UPDATE stages SET status = ? WHERE job_id = ? AND status = ?',
+                              (PENDING, job_id, FAILED))
+        return dates
+
+    def summary(self, job_id: int) -> dict:
+        """Return {status: number of stages} for a job."""
+        rows = self.conn.execute('SELECT status, COUNT(*) AS n FROM stages WHERE job_id = ? GROUP BY status',
+                                 (job_id,))
+        return {row['status']: row['n'] for row in rows}
+
+    def stage_errors(self, job_id: int) -> list:
+        """Return (date, stage, error) for every failed stage of a job."""
+        rows = self.conn.execute('SELECT date, stage, error FROM stages WHERE job_id = ? AND status = ? '
+                                 'ORDER BY date, stage', (job_id, FAILED))
+        return [(row['date'], row['stage'], row['error']) for row in rows]
+
+    @contextmanager
+    def stage(self, job_id: int, date, stage: str):
+        """
+        Context manager that records a stage as running when entered, then as done, or as failed with the error if
+        the block raises. The exception is re-raised.
+        Ex:
+            with store.stage(job_id, current, 'download'):
+                download(current)
+        """
+        key = _date_key(date)
+        started = time.time()
+        with self.conn:
+            self.conn.execute('UPDATE stages SET status = ?, attempts = attempts + 1, started = ?, finished = NULL, '
+                              'elapsed = NULL, error = NULL WHERE job_id = ? AND date = ? AND stage = ?',
+                              (RUNNING, started, job_id, key, stage))
+        try:
+            yield
+        except Exception as e:
+            error = str(e) if isinstance(e, JobStageError) else traceback.format_exc()
+            self._finish(job_id, key, stage, FAILED, started, error)
+            raise
+        self._finish(job_id, key, stage, DONE, started, None)
+
+    def _finish(self, job_id, key, stage, status, started, error) -> None:
+        finished = time.time()
+        with self.conn:
+            self.conn.execute('UPDATE stages SET status = ?, finished = ?, elapsed = ?, error = ? '
+                              'WHERE job_id = ? AND date = ? AND stage = ?',
+                              (status, finished, finished - started, error, job_id, key, stage))
+
+    def _dates_with_status(self, job_id, statuses) -> list:
+        placeholders = ', '.join('?' * len(statuses))
+        rows = self.conn.execute('SELECT DISTINCT date FROM stages WHERE job_id = ? AND status IN ({}) '
+                                 'ORDER BY date'.format(placeholders), (job_id,) + tuple(statuses))
+        return [datetime.strptime(row['date'], '%Y-%m-%d').date() for row in rows]
+
+
+def _date_key(date) -> str:
+    """Return the 'yyyy-mm-dd' key of a date or datetime."""
+    if isinstance(date, datetime):
+        date = date.date()
+    return date.isoformat()
@@ -0,0 +1,102 @@
+from pathlib import Path
+
+# Product codes of the SNODAS parameters, longest first so that '1025SlL01' is matched before a four digit code.
+SNODAS_PRODUCT_CODES = ['1025SlL01', '1025SlL00', '1034', '1036', '1038', '1039', '1044', '1050']
+
+
+def snodas_product_code(name) -> str:
+    """
+    Get the product code of a SNODAS file from its name.
+    Ex: 'us_ssmv11034tS__T0001TTNATS2003093005HP001.dat' returns '1034' and
+    'us_ssmv01025SlL01T0024TTNATS2003093005DP001.dat.gz' returns '1025SlL01'.
+    Parameters
+    ----------
+    name: file name or full pathname of a file extracted from a SNODAS .tar file
+
+    Returns
+    -------
+    the product code (a key of utilities.snodas_param_info), or None if the name is not a SNODAS product file
+    """
+    name = Path(name).name
+    if not name.startswith('us_ssmv'):
+        return None
+    # The product code follows the 'us_ssmv' prefix and a one digit vertical code. Ex: us_ssmv1|1034|tS__...
+    code = name[8:17] if name[8:12] == '1025' else name[8:12]
+    return code if code in SNODAS_PRODUCT_CODES else None
+
+
+def snodas_file_date(name) -> str:
+    """
+    Get the date of a SNODAS file from its name in the format YYYYMMDD.
+    Ex: 'us_ssmv11034tS__T0001TTNATS2003093005HP001.dat' returns '20030930'.
+    Parameters
+    ----------
+    name: file name or full pathname of a file extracted from a SNODAS .tar file
+
+    Returns
+    -------
+    the date string, or None if the name does not contain a SNODAS timestamp
+    """
+    name = Path(name).name
+    index = name.find('TTNATS')
+    if index == -1:
+        return None
+    date = name[index + 6:index + 14]
+    return date if len(date) == 8 and date.isdigit() else None
+
+
+class RunManifest:
+    """
+    In-memory index of the files produced during a run, keyed by (date, stage, product). Each stage records the files
+    it writes as it writes them, and the next stage looks its inputs up here instead of globbing the output folders and
+    filtering every file name by date. A lookup costs the same no matter how many days are already stored on disk.
+
+    date: date string in the format YYYYMMDD
+    stage: name of the processing step that produced the file. Ex: 'dat.gz', 'dat', 'bil', 'hdr', 'tif'
+    product: SNODAS product code (see snodas_product_code). When not given it is parsed from the file name, and the
+    file name itself is used for files that are not SNODAS products.
+    """
+
+    def __init__(self):
+        # date -> stage -> product -> Path
+        self._entries = {}
+
+    def add(self, date: str, stage: str, path: Path, product: str = None) -> Path:
+        """Record path as the output of stage for product on date. Returns path."""
+        path = Path(path)
+        if product is None:
+            product = snodas_product_code(path) or path.name
+        self._entries.setdefault(date, {}).setdefault(stage, {})[product] = path
+        return path
+
+    def add_all(self, date: str, stage: str, paths) -> list:
+        """Record every path in paths as an output of stage on date. Returns the paths as a list."""
+        return [self.add(date, stage, path) for path in paths]
+
+    def get(self, date: str, stage: str, product: str, default=None):
+        """Return the path recorded for (date, stage, product), or default."""
+        return self._entries.get(date, {}).get(stage, {}).get(product, default)
+
+    def products(self, date: str, stage: str) -> dict:
+        """Return a copy of the {product: path} mapping of a stage on date."""
+        return dict(self._entries.get(date, {}).get(stage, {}))
+
+    def files(self, date: str, stage: str) -> list:
+        """Return the paths recorded for a stage on date."""
+        return list(self._entries.get(date, {}).get(stage, {}).values())
+
+    def remove(self, date: str, stage: str, product: str = None) -> None:
+        """Forget one product of a stage, or the whole stage if product is None."""
+        stages = self._entries.get(date, {})
+        if product is None:
+            stages.pop(stage, None)
+        else:
+            stages.get(stage, {}).pop(product, None)
+
+    def drop_date(self, date: str) -> None:
+        """Forget every file recorded on date. Called once a day has finished processing."""
+        self._entries.pop(date, None)
+
+    def dates(self) -> list:
+        """Return the dates that have recorded files."""
+        return list(self._entries)
@@ -0,0 +1,224 @@
+import csv
+import logging
+import multiprocessing as mp
+
+from datetime import datetime, timedelta
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+from rasterio.transform import xy
+
+import SNODAS_Archive
+import utilities
+from SNODAS_GridCache import open_raw_grid
+from SNODAS_GzipIndex import read_snodas_tar_rows
+from SNODAS_Accumulation import water_year
+
+logger = logging.getLogger('utilities')
+
+
+def _read_points_tif(tif_file: Path, rows, cols, products: list) -> dict:
+    """Read the points (given by grid row and column, -1 outside the grid) of a multiband raster."""
+    values = {product: np.full(len(rows), np.nan, dtype=np.float32) for product in products}
+    inside = np.flatnonzero(rows >= 0)
+    if len(inside) == 0:
+        return values
+    bands = [utilities.SNODAS_BAND_ORDER.index(product) + 1 for product in products]
+    with rasterio.open(tif_file) as src:
+        xs, ys = xy(src.transform, rows[inside], cols[inside])
+        samples = np.array(list(src.sample(zip(xs, ys), indexes=bands)), dtype=np.float32)
+        # Decode packed int16 bands (see utilities.stack_snodas_bil_to_multiband_tif). Float32 bands have a scale of 1.
+        null = samples == utilities.SNODAS_NODATA
+        samples = samples * np.array([src.scales[bnd - 1] for bnd in bands], dtype=np.float32) + \
+            np.array([src.offsets[bnd - 1] for bnd in bands], dtype=np.float32)
+    samples[null] = np.nan
+    for i, product in enumerate(products):
+        values[product][inside] = samples[:, i]
+    return values
+
+
+def _read_points_archive(h5, dates: list, lons, lats, products: list) -> dict:
+    """Read the time series of the points over consecutive dates of one water year archive. Each point is read as one
+    slice along the time axis of each product. Returns {date: {product: float32 array of the points}} for the dates
+    that have every product in the archive."""
+    first, last = SNODAS_Archive.day_index(dates[0]), SNODAS_Archive.day_index(dates[-1])
+    columns = [utilities.SNODAS_BAND_ORDER.index(product) for product in products]
+    present = h5['index'][first:last + 1][:, columns].all(axis=1)
+    found = [current for current, ok in zip(dates, present) if ok]
+    if not found:
+        return {}
+
+    # The grid origin only changes at the start of a water year, so the cells are the same for every date.
+    rows, cols = utilities.snodas_grid_index(lons, lats, dates[0])
+    series = {product: np.full((len(dates), len(rows)), np.nan, dtype=np.float32) for product in products}
+    for product in products:
+        grid = h5[product]
+        for point in np.flatnonzero(rows >= 0):
+            series[product][:, point] = utilities.scale_snodas_grid(grid[first:last + 1, rows[point], cols[point]],
+                                                                    product)
+    return {current: {product: series[product][i] for product in products}
+            for i, current in enumerate(dates) if present[i]}
+
+
+def _read_points_tar(tar_file: Path, rows, cols, products: list) -> dict:
+    """Read the points (given by grid row and column, -1 outside the grid) of a daily .tar file. Only the rows from the
+    northernmost to the southernmost point of each product are decompressed, starting from the nearest seek point when
+    the .tar file has seek-point indexes (see SNODAS_GzipIndex.build_snodas_gz_indexes), and every point is gathered
+    from them before moving to the next product."""
+    values = {product: np.full(len(rows), np.nan, dtype=np.float32) for product in products}
+    inside = np.flatnonzero(rows >= 0)
+    if len(inside) == 0:
+        return values
+    row_start = int(rows[inside].min())
+    grids = read_snodas_tar_rows(tar_file, row_start, int(rows[inside].max()) + 1, products, build_index=False)
+    for product, grid in grids.items():
+        values[product][inside] = utilities.scale_snodas_grid(grid[rows[inside] - row_start, cols[inside]], product)
+    return values
+
+
+def _read_points_raw_cache(cache_path: Path, download_path: Path, current, rows, cols, products: list) -> dict:
+    """Read the points (given by grid row and column, -1 outside the grid) of a day from the memory-mapped raw-array
+    cache, caching the .tar file of the day first if needed. Only the pages that hold the points are read. Returns None
+    if the day is not available."""
+    values = {product: np.full(len(rows), np.nan, dtype=np.float32) for product in products}
+    inside = np.flatnonzero(rows >= 0)
+    found = False
+    for product in products:
+        grid = open_raw_grid(cache_path, download_path, current, product)
+        if grid is not None:
+            values[product][inside] = utilities.scale_snodas_grid(grid[rows[inside], cols[inside]], product)
+            found = True
+    return values if found else None
+
+
+def _extract_points_day(args):
+    """
+    Read the points of one day, from the raw-array cache if cache_path is given, otherwise from the multiband raster of
+    the day if it exists, otherwise from the .tar file.
+    Parameters
+    ----------
+    args: tuple of (current, download_path, processed_path, cache_path, lons, lats, products)
+
+    Returns
+    -------
+    tuple of (current, {product: float32 array of the points}, or None if the day is not in the archive)
+    """
+    current, download_path, processed_path, cache_path, lons, lats, products = args
+    current_date = utilities.format_date_yyyymmdd(current)
+    rows, cols = utilities.snodas_grid_index(lons, lats, current)
+
+    tif_file = processed_path / (current_date + 'WGS84.tif')
+    tar_file = download_path / ('SNODAS_' + current_date + '.tar')
+    try:
+        if cache_path is not None:
+            values = _read_points_raw_cache(cache_path, download_path, current, rows, cols, products)
+            if values is not None:
+                return current, values
+        if tif_file.exists():
+            return current, _read_points_tif(tif_file, rows, cols, products)
+        if tar_file.exists():
+            return current, _read_points_tar(tar_file, rows, cols, products)
+    except Exception:
+        logger.error('_extract_points_day: Reading the points failed for {}'.format(current), exc_info=True)
+        return current, None
+    logger.warning('_extract_points_day: {} is not in the archive.'.format(current_date))
+    return current, None
+
+
+def extract_points(points, startDate, endDate, rootdir, products=None, processes=1, raw_cache=False) -> tuple:
+    """
+    Extract the values of a list of points for every day of a date range, for example to compare SNODAS with SNOTEL
+    stations. Days that are in a water year archive in rootdir/archive (see SNODAS_Archive.repack_water_year) are read
+    as one time slice per point. Every other day is read once for all of the points: from its multiband raster in
+    rootdir/geotiff when it exists, otherwise from its .tar file in rootdir/RAW_data, where each product is
+    decompressed once and all points are gathered from it. Those days are spread over a process pool.
+    Parameters
+    ----------
+    points: list of (longitude, latitude) in decimal degrees
+    startDate: in the format "yyyy-mm-dd"
+    endDate: in the format "yyyy-mm-dd"
+    rootdir: root directory of the archive (see getSNODAS.download_multiband_range)
+    products: list of product codes (keys of utilities.snodas_param_info). Defaults to ['1034'] (SWE).
+    processes: number of worker processes. 1 reads the days in this process.
+    raw_cache: if True, read the days that are not in an archive from the memory-mapped raw-array cache in
+    rootdir/raw_cache (see SNODAS_GridCache.open_raw_grid), decoding their .tar files into it the first time. Later
+    extractions then only read the pages that hold the points.
+
+    Returns
+    -------
+    tuple of (list of dates, {product: float32 array of shape (number of dates, number of points)}). Values are in the
+    units of utilities.snodas_param_info, NaN where there is no data, the point is outside the grid or the day is not
+    in the archive.
+    """
+    if products is None:
+        products = ['1034']
+    download_path = Path(rootdir).resolve() / 'RAW_data'
+    processed_path = Path(rootdir).resolve() / 'geotiff'
+    cache_path = Path(rootdir).resolve() / 'raw_cache' if raw_cache else None
+
+    startDate = datetime.strptime(startDate, '%Y-%m-%d').date()
+    endDate = datetime.strptime(endDate, '%Y-%m-%d').date()
+    dates = [startDate + timedelta(days=day_number) for day_number in range((endDate - startDate).days + 1)]
+    lons = np.array([point[0] for point in points], dtype=float)
+    lats = np.array([point[1] for point in points], dtype=float)
+
+    tables = {product: np.full((len(dates), len(points)), np.nan, dtype=np.float32) for product in products}
+    if not dates:
+        return dates, tables
+
+    row_of_date = {current: row for row, current in enumerate(dates)}
+
+    def fill(results):
+        for current, values in results:
+            if values is None:
+                continue
+            for product in products:
+                tables[product][row_of_date[current]] = values[product]
+
+    # Read the dates that are in the water year archives first.
+    archive_path = Path(rootdir).resolve() / 'archive'
+    remaining = []
+    for wy, wy_dates in groupby(dates, water_year):
+        wy_dates = list(wy_dates)
+        h5 = SNODAS_Archive.open_archive(archive_path, wy)
+        if h5 is None:
+            remaining += wy_dates
+            continue
+        with h5:
+            found = _read_points_archive(h5, wy_dates, lons, lats, products)
+        fill(found.items())
+        remaining += [current for current in wy_dates if current not in found]
+
+    tasks = [(current, download_path, processed_path, cache_path, lons, lats, products) for current in remaining]
+
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        fill(map(_extract_points_day, tasks))
+    else:
+        # chunksize=1 hands out one day at a time, which balances the load when days take uneven amounts of time.
+        with mp.Pool(processes=processes) as pool:
+            fill(pool.imap_unordered(_extract_points_day, tasks, chunksize=1))
+
+    logger.info('extract_points: Extracted {} points for {} days ({} to {})'.format(len(points), len(dates), startDate,
+                                                                                   endDate))
+    return dates, tables
+
+
+def write_points_csv(out_file: Path, dates: list, table, names: list) -> None:
+    """
+    Save a (time x point) table of extract_points to a .csv file, with one row per date and one column per point.
+    Parameters
+    ----------
+    out_file: full pathname of the .csv file
+    dates: list of dates, as returned by extract_points
+    table: array of shape (number of dates, number of points) of one product
+    names: name of each point, used as the column headers. Ex: SNOTEL station ids
+    """
+    with open(out_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Date'] + list(names))
+        for current, row in zip(dates, table):
+            writer.writerow([current.isoformat()] + ['' if np.isnan(value) else '{:g}'.format(value) for value in row])
@@ -0,0 +1,120 @@
+import logging
+import multiprocessing as mp
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger('utilities')
+
+# Arrays attached by the worker processes of map_shared, by name, and the shared memory blocks that back them.
+_worker_arrays = {}
+_worker_blocks = []
+
+
+class SharedGrids:
+    """
+    Decoded grids placed in multiprocessing shared memory blocks so the worker processes of a pool can read them
+    without each receiving a pickled copy. The process that creates a SharedGrids owns the blocks and releases them on
+    close, or when leaving the with block, once every consumer is finished.
+    Ex:
+        with SharedGrids() as shared:
+            shared.publish('swe', grid)
+            handles = shared.handles()   # small (name, shape, dtype) tuples to pass to workers
+    """
+
+    def __init__(self):
+        self._blocks = {}
+        self._handles = {}
+
+    def publish(self, name: str, array):
+        """Copy array into a new shared memory block. Returns the shared copy, which can be used like array."""
+        array = np.asarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        self._blocks[name] = block
+        self._handles[name] = (block.name, array.shape, array.dtype.str)
+        return shared
+
+    def handles(self) -> dict:
+        """Return {name: (block name, shape, dtype)} of the published grids."""
+        return dict(self._handles)
+
+    def close(self) -> None:
+        """Release every block. Arrays returned by publish must not be used afterwards."""
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+        self._handles.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_grids(handles: dict) -> tuple:
+    """
+    Attach the grids of SharedGrids.handles() in a consumer process, without copying them.
+    Returns
+    -------
+    tuple of ({name: read-only array}, list of the attached blocks). Keep the blocks referenced while the arrays are
+    in use, then close them. The owner unlinks them.
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in handles.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+        blocks.append(block)
+    return arrays, blocks
+
+
+def _attach_worker(handles: dict) -> None:
+    """Pool initializer: attach the shared grids once per worker process."""
+    arrays, blocks = attach_grids(handles)
+    _worker_arrays.update(arrays)
+    _worker_blocks.extend(blocks)
+
+
+def _call_shared(args):
+    func, task = args
+    return func(_worker_arrays, task)
+
+
+def map_shared(func, grids: dict, tasks: list, processes: int = None) -> list:
+    """
+    Run func(grids, task) for every task on a process pool, with grids decoded once in this process and shared with
+    the workers through shared memory instead of being pickled with every task. Only the tasks and the results travel
+    between processes, so keep them small (Ex: a block of rows to process, and the per-zone sums of that block). The
+    shared blocks are released when every task is finished.
+    Parameters
+    ----------
+    func: module-level function taking ({name: read-only array}, task)
+    grids: {name: array} to share
+    tasks: list of picklable tasks
+    processes: number of worker processes. Defaults to the CPU count, and is never more than the number of tasks.
+
+    Returns
+    -------
+    list of the results of func, in the order of tasks
+    """
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        return [func(grids, task) for task in tasks]
+
+    with SharedGrids() as shared:
+        for name, array in grids.items():
+            shared.publish(name, array)
+        with mp.Pool(processes=processes, initializer=_attach_worker, initargs=(shared.handles(),)) as pool:
+            results = pool.map(_call_shared, [(func, task) for task in tasks], chunksize=1)
+    logger.info('map_shared: Ran {} tasks on {} processes with {} shared grids ({} MB)'
+                .format(len(tasks), processes, len(grids),
+                        round(sum(np.asarray(array).nbytes for array in grids.values()) / 2 ** 20)))
+    return results
@@ -0,0 +1,139 @@
+import numpy as np
+
+
+def _run_indices(runs, ncols: int):
+    """Return the flat indices of the cells covered by (row, col_start, col_stop) runs."""
+    if len(runs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    runs = runs.astype(np.int64)
+    lengths = runs[:, 2] - runs[:, 1]
+    starts = runs[:, 0] * ncols + runs[:, 1]
+    # Position of each cell within its run, added to the flat index of the start of the run.
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+class SparseGrid:
+    """
+    Sparse encoding of a SNODAS grid for days when most of the grid has no snow. The cells that are neither 0 nor null
+    are kept row by row (compressed sparse row: the columns and values of each row, and where each row starts), and
+    the null cells, which follow the coastlines and borders, are kept as run-length encoded (row, col_start, col_stop)
+    runs. Every other cell is 0. A summer SWE grid takes a few MB instead of the 46 MB of the dense int16 grid, and the
+    zonal and accumulation kernels below only visit the nonzero cells.
+
+    shape: (rows, columns) of the dense grid
+    row_ptr: int64 array of length rows + 1. The nonzero cells of row r are at positions row_ptr[r] to row_ptr[r + 1]
+    cols: int16 column of each nonzero cell
+    values: value of each nonzero cell, in the dtype of the dense grid
+    null_runs: int32 array of shape (n, 3) of the (row, col_start, col_stop) runs of null cells
+    nodata: null value of the dense grid
+    """
+
+    def __init__(self, shape, row_ptr, cols, values, null_runs, nodata=-9999):
+        self.shape = tuple(shape)
+        self.row_ptr = row_ptr
+        self.cols = cols
+        self.values = values
+        self.null_runs = null_runs
+        self.nodata = nodata
+
+    @classmethod
+    def from_dense(cls, array, nodata=-9999):
+        """Encode a dense 2-D grid."""
+        array = np.asarray(array)
+        nrows, ncols = array.shape
+        rows, cols = np.nonzero((array != 0) & (array != nodata))
+        row_ptr = np.zeros(nrows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=nrows), out=row_ptr[1:])
+
+        # A run starts where a row switches from valid to null and stops where it switches back.
+        null = np.zeros((nrows, ncols + 2), dtype=np.int8)
+        null[:, 1:-1] = array == nodata
+        edges = np.diff(null, axis=1)
+        start_rows, start_cols = np.nonzero(edges == 1)
+        _, stop_cols = np.nonzero(edges == -1)
+        null_runs = np.column_stack([start_rows, start_cols, stop_cols]).astype(np.int32)
+
+        return cls(array.shape, row_ptr, cols.astype(np.int16), array[rows, cols], null_runs, nodata)
+
+    @property
+    def nnz(self) -> int:
+        """Number of nonzero (and not null) cells."""
+        return len(self.values)
+
+    @property
+    def density(self) -> float:
+        """Fraction of the cells that are nonzero."""
+        return self.nnz / (self.shape[0] * self.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the encoded arrays."""
+        return self.row_ptr.nbytes + self.cols.nbytes + self.values.nbytes + self.null_runs.nbytes
+
+    def rows(self):
+        """Return the row of each nonzero cell."""
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.row_ptr))
+
+    def flat_index(self):
+        """Return the flat (row-major) index of each nonzero cell."""
+        return self.rows() * self.shape[1] + self.cols
+
+    def null_index(self):
+        """Return the flat (row-major) index of each null cell."""
+        return _run_indices(self.null_runs, self.shape[1])
+
+    def to_dense(self, null=None):
+        """
+        Decode to a dense grid.
+        null: value given to the null cells. Defaults to the nodata value of the grid.
+        """
+        out = np.zeros(self.shape, dtype=self.values.dtype)
+        flat = out.reshape(-1)
+        flat[self.null_index()] = self.nodata if null is None else null
+        flat[self.flat_index()] = self.values
+        return out
+
+    def add_to(self, total, sign: int = 1) -> None:
+        """
+        Add (sign=1) or subtract (sign=-1) the grid to a dense running total in place. Null cells count as 0.
+        total: C-contiguous array of the shape of the grid
+        """
+        if total.shape != self.shape or not total.flags.c_contiguous:
+            raise ValueError('SparseGrid.add_to: total must be a C-contiguous array of shape {}'.format(self.shape))
+        # Each cell appears once, so fancy-index assignment does not lose repeated updates.
+        flat = total.reshape(-1)
+        index = self.flat_index()
+        flat[index] += sign * self.values.astype(total.dtype)
+
+    def valid_cells(self, labels, n_zones: int):
+        """
+        Count the cells of each zone that are not null. The SNODAS mask is the same every day, so this can be computed
+        once and passed to zonal_stats.
+        labels: int array of the shape of the grid with the zone of each cell, 0 outside every zone
+        n_zones: largest zone id + 1
+        """
+        flat_labels = np.asarray(labels).reshape(-1)
+        return np.bincount(flat_labels, minlength=n_zones) - \
+            np.bincount(flat_labels[self.null_index()], minlength=n_zones)
+
+    def zonal_stats(self, labels, n_zones: int, valid_cells=None) -> dict:
+        """
+        Compute the sum, mean and snow-covered cell count of each zone from the nonzero cells only.
+        labels: int array of the shape of the grid with the zone of each cell, 0 outside every zone
+        n_zones: largest zone id + 1
+        valid_cells: cell count of each zone that is not null, as returned by valid_cells. Computed if not given.
+
+        Returns
+        -------
+        dictionary of arrays of length n_zones: 'sum' (in the unscaled units of the grid), 'count' (cells that are not
+        null), 'nonzero' (cells that are not 0) and 'mean' (NaN for zones with no valid cells)
+        """
+        if valid_cells is None:
+            valid_cells = self.valid_cells(labels, n_zones)
+        zones = np.asarray(labels).reshape(-1)[self.flat_index()]
+        sums = np.bincount(zones, weights=self.values, minlength=n_zones)
+        nonzero = np.bincount(zones, minlength=n_zones)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid_cells > 0, sums / valid_cells, np.nan)
+        return {'sum': sums, 'count': valid_cells, 'nonzero': nonzero, 'mean': mean}
@@ -0,0 +1,161 @@
+import logging
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+
+import utilities
+from SNODAS_GridCache import read_snodas_day_grid
+
+logger = logging.getLogger('utilities')
+
+# Date the grid origin moved by half a cell. See utilities.snodas_grid_index.
+GRID_SHIFT_DATE = datetime(2013, 10, 1).date()
+
+
+def snodas_variable_name(product: str) -> str:
+    """Return the dataset variable name of a product. Ex: '1036' returns 'Snow_Depth'"""
+    return utilities.snodas_param_info[product]['name'].replace(' ', '_')
+
+
+def _tar_date(file: Path):
+    """Return the date of a SNODAS_YYYYMMDD.tar file, or None if the name does not match."""
+    try:
+        return datetime.strptime(Path(file).name, 'SNODAS_%Y%m%d.tar').date()
+    except ValueError:
+        return None
+
+
+class SnodasBackendArray(BackendArray):
+    """
+    Lazily decoded (time, lat, lon) array of one product over a list of daily .tar files. A day is only decompressed
+    when an index into it is computed, and days without a .tar file read as null. With a GridCache, decoded days are
+    kept and shared with other readers of the cache.
+    """
+
+    def __init__(self, tar_files: list, product: str, cache=None):
+        self.tar_files = tar_files
+        self.product = product
+        self.cache = cache
+        self.shape = (len(tar_files), utilities.SNODAS_NROWS, utilities.SNODAS_NCOLS)
+        self.dtype = np.dtype(np.int16)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC,
+                                                  self._raw_indexing_method)
+
+    def _read_day(self, day: int):
+        tar_file = self.tar_files[day]
+        grid = None
+        if tar_file is not None:
+            grid = read_snodas_day_grid(tar_file.parent, _tar_date(tar_file), self.product, cache=self.cache)
+        if grid is None:
+            grid = np.full(self.shape[1:], utilities.SNODAS_NODATA, dtype=np.int16)
+        return grid
+
+    def _raw_indexing_method(self, key: tuple):
+        days = np.arange(self.shape[0])[key[0]]
+        grids = [self._read_day(day)[key[1:]] for day in np.atleast_1d(days)]
+        return grids[0] if np.ndim(days) == 0 else np.stack(grids)
+
+
+class SnodasBackendEntrypoint(BackendEntrypoint):
+    """
+    xarray backend that opens daily SNODAS .tar files as a (time, lat, lon) dataset with one variable per product of
+    utilities.snodas_param_info. The grids are stored as int16 with their scale_factor and _FillValue, so xarray decodes
+    them to the units of snodas_param_info when they are read. Nothing is decompressed when the dataset is opened.
+    Ex:
+        xr.open_dataset('RAW_data', engine=SnodasBackendEntrypoint, start='2022-10-01', end='2023-09-30', chunks={})
+    """
+
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'mask_and_scale', 'start', 'end', 'products',
+                               'grid_cache')
+    description = 'Open daily SNODAS .tar files as a lazily loaded dataset'
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, mask_and_scale=True, start=None, end=None,
+                     products=None, grid_cache=None):
+        """
+        filename_or_obj: a SNODAS_YYYYMMDD.tar file, or a folder of them
+        drop_variables: variable names to leave out
+        mask_and_scale: if True, decode the grids to float with null cells set to NaN
+        start: first date of the time axis in the format "yyyy-mm-dd". Defaults to the first .tar file in the folder.
+        end: last date of the time axis in the format "yyyy-mm-dd". Defaults to the last .tar file in the folder.
+        products: list of product codes to include. Defaults to all products.
+        grid_cache: optional SNODAS_GridCache.GridCache of the decoded days (see open_snodas_range)
+        """
+        path = Path(filename_or_obj)
+        if path.is_dir():
+            tar_files = {_tar_date(file): file for file in path.glob('SNODAS_*.tar') if _tar_date(file) is not None}
+        else:
+            tar_files = {_tar_date(path): path}
+        if not tar_files:
+            raise ValueError('SnodasBackendEntrypoint: No SNODAS_YYYYMMDD.tar files in {}'.format(path))
+
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else min(tar_files)
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else max(tar_files)
+        dates = [start + timedelta(days=day_number) for day_number in range((end - start).days + 1)]
+        files = [tar_files.get(current) for current in dates]
+
+        # The grid origin moved by half a cell on October 1, 2013. A dataset has one set of coordinates, so the
+        # coordinates of the first date are used.
+        if start < GRID_SHIFT_DATE <= end:
+            logger.warning('SnodasBackendEntrypoint: {} to {} crosses {}, when the grid moved by half a cell. The '
+                           'coordinates of {} are used.'.format(start, end, GRID_SHIFT_DATE, start))
+        ulx, uly = utilities.SNODAS_ORIGIN_POST2013 if start >= GRID_SHIFT_DATE else utilities.SNODAS_ORIGIN_PRE2013
+        lat = uly - np.arange(utilities.SNODAS_NROWS) * utilities.SNODAS_CELL_SIZE
+        lon = ulx + np.arange(utilities.SNODAS_NCOLS) * utilities.SNODAS_CELL_SIZE
+
+        variables = {}
+        for product in products or utilities.SNODAS_BAND_ORDER:
+            name = snodas_variable_name(product)
+            if drop_variables is not None and name in drop_variables:
+                continue
+            data = indexing.LazilyIndexedArray(SnodasBackendArray(files, product, grid_cache))
+            attrs = {'long_name': utilities.snodas_param_info[product]['name'],
+                     'units': utilities.snodas_param_info[product]['units'],
+                     'product_code': product,
+                     'scale_factor': np.float32(1.0 / utilities.snodas_param_info[product]['dataSF']),
+                     '_FillValue': np.int16(utilities.SNODAS_NODATA)}
+            variable = xr.Variable(('time', 'lat', 'lon'), data, attrs)
+            variable.encoding['preferred_chunks'] = {'time': 1, 'lat': utilities.SNODAS_NROWS,
+                                                     'lon': utilities.SNODAS_NCOLS}
+            variables[name] = variable
+
+        coords = {'time': np.array(dates, dtype='datetime64[ns]'),
+                  'lat': ('lat', lat, {'units': 'degrees_north'}),
+                  'lon': ('lon', lon, {'units': 'degrees_east'})}
+        dataset = xr.Dataset(variables, coords=coords, attrs={'source': 'NOAA NOHRSC SNODAS', 'crs': 'EPSG:4326'})
+        return xr.decode_cf(dataset, mask_and_scale=mask_and_scale)
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            path = Path(filename_or_obj)
+        except TypeError:
+            return False
+        return _tar_date(path) is not None
+
+
+def open_snodas_range(start, end, download_path, products=None, chunks=None, grid_cache=None):
+    """
+    Open the daily .tar files of a date range as a dask-chunked (time, lat, lon) dataset. Each chunk is one day of one
+    product, and it is only decompressed when it is computed.
+    Parameters
+    ----------
+    start: in the format "yyyy-mm-dd"
+    end: in the format "yyyy-mm-dd"
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    products: list of product codes to include. Defaults to all products.
+    chunks: dask chunks. Defaults to one day per chunk.
+    grid_cache: optional SNODAS_GridCache.GridCache of the decoded days. A GridCache with disk_path=rootdir/raw_cache
+    memory-maps the days already decoded into the raw-array cache of SNODAS_Points.extract_points, and adds to it.
+
+    Returns
+    -------
+    xarray Dataset
+    """
+    return xr.open_dataset(download_path, engine=SnodasBackendEntrypoint, start=start, end=end, products=products,
+                           grid_cache=grid_cache, chunks={} if chunks is None else chunks)
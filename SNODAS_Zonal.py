@@ -0,0 +1,676 @@
+import csv
+import json
+import logging
+import os
+
+from datetime import datetime
+from pathlib import Path
+
+import gdal
+import numpy as np
+import ogr
+import osr
+
+import utilities
+from SNODAS_SharedMemory import map_shared
+
+logger = logging.getLogger('utilities')
+
+# Rows of the grids reduced at a time, and handed to a worker, by zone_sums
+ZONAL_BLOCK_ROWS = 256
+
+# Grid cells (cells of a grid times the number of grids) below which zone_sums reduces the grids in this process. A
+# bincount pass over one CONUS grid is faster than starting a pool and copying the grid to shared memory, so a pool of
+# workers only pays off for several grids at once.
+ZONAL_POOL_MIN_CELLS = 4 * utilities.SNODAS_NROWS * utilities.SNODAS_NCOLS
+
+# Mean radius of the Earth in meters, used for the area of the grid cells
+EARTH_RADIUS_M = 6371008.8
+
+# Unit conversions: square meters in a square mile, cubic meters in an acre-foot and millimeters in an inch
+SQ_METERS_PER_SQ_MILE = 2589988.10
+CUBIC_METERS_PER_ACRE_FOOT = 1233.48184
+MM_PER_INCH = 25.4
+
+# Products that are a depth of water, so that their volume over a zone is reported, and the abbreviations of the units
+# of utilities.snodas_param_info used in column names
+WATER_PRODUCTS = ['1034', '1044', '1050', '1039', '1025SlL01', '1025SlL00']
+UNIT_ABBREVIATIONS = {'millimeters': 'mm', 'kelvin': 'K'}
+
+
+class ZoneMoments:
+    """
+    Streaming count, mean, variance, min and max of the values of each zone, updated one block of cells at a time so
+    a grid can be reduced in bounded memory. Each block is reduced with bincounts about its own per-zone mean, and
+    merged into the running moments with the pairwise update of Chan et al., the parallel form of Welford's algorithm,
+    which stays accurate where the textbook sum of squares loses precision. Moments of blocks reduced by other threads
+    or processes are combined with merge, in any order.
+    n_zones: number of zones, labeled 1 to n_zones. The arrays of the moments are indexed by label - 1.
+    """
+
+    def __init__(self, n_zones: int):
+        self.count = np.zeros(n_zones)
+        self.mean = np.zeros(n_zones)
+        self.m2 = np.zeros(n_zones)
+        self.min = np.full(n_zones, np.inf)
+        self.max = np.full(n_zones, -np.inf)
+
+    @classmethod
+    def from_values(cls, values, zones, n_zones: int):
+        """Return the moments of values, where zones holds the label of each value, 0 outside every zone. NaN values
+        are ignored."""
+        valid = ~np.isnan(values) & (zones > 0)
+        values = values[valid].astype(np.float64)
+        zones = zones[valid] - 1
+        moments = cls(n_zones)
+        moments.count = np.bincount(zones, minlength=n_zones).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            moments.mean = np.where(moments.count > 0,
+                                    np.bincount(zones, weights=values, minlength=n_zones) / moments.count, 0)
+        moments.m2 = np.bincount(zones, weights=(values - moments.mean[zones]) ** 2, minlength=n_zones)
+        np.minimum.at(moments.min, zones, values)
+        np.maximum.at(moments.max, zones, values)
+        return moments
+
+    @classmethod
+    def from_sums(cls, sums: dict):
+        """Return the moments held in per-zone sums computed with moments=True (see zone_sums)."""
+        moments = cls(0)
+        moments.count, moments.mean, moments.m2 = sums['cells'], sums['mean'], sums['m2']
+        moments.min, moments.max = sums['min'], sums['max']
+        return moments
+
+    def sums(self) -> dict:
+        """Return the moments as per-zone sums: 'cells', 'mean', 'm2', 'min' and 'max' (see zone_sums)."""
+        return {'cells': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max}
+
+    def update(self, values, zones) -> None:
+        """Add a block of values, where zones holds the label of each value."""
+        self.merge(ZoneMoments.from_values(values, zones, len(self.count)))
+
+    def merge(self, other) -> None:
+        """Add the moments of other, reduced from different cells, to these moments."""
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(count > 0, other.count / count, 0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    def stats(self, ddof: int = 0) -> dict:
+        """
+        Return dictionary of arrays of length n_zones: 'count' (cells that are not null), 'sum', 'mean', 'variance',
+        'std', 'min' and 'max'. Zones with no valid cells (or no more than ddof) are NaN, except for count and sum.
+        """
+        empty = self.count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+        return {'count': self.count, 'sum': self.mean * self.count,
+                'mean': np.where(empty, np.nan, self.mean), 'variance': variance, 'std': np.sqrt(variance),
+                'min': np.where(empty, np.nan, self.min), 'max': np.where(empty, np.nan, self.max)}
+
+
+def zonal_stats(grids, labels, n_zones: int, processes: int = None, block_rows: int = ZONAL_BLOCK_ROWS,
+                ddof: int = 0) -> dict:
+    """
+    Compute the count, sum, mean, variance, standard deviation, min and max of one or more grids in each zone in one
+    pass, one block of rows at a time (see zone_sums and ZoneMoments). These are the plain statistics of the cell
+    values. The area-weighted statistics of the products are computed by zone_sums and zone_stats.
+    Parameters
+    ----------
+    grids: float grid with null cells set to NaN, Ex: utilities.scale_snodas_grid of a product, or {name: grid}
+    labels: int array of the shape of the grids with the zone of each cell, 1 to n_zones, 0 outside every zone
+    n_zones: number of zones
+    processes: number of worker processes (see zone_sums)
+    block_rows: rows of the grids reduced per task
+    ddof: delta degrees of freedom of the variance. 0 for the population variance, 1 for the sample variance.
+
+    Returns
+    -------
+    dictionary of arrays of length n_zones, as returned by ZoneMoments.stats, or {name: dictionary} for a dictionary
+    of grids
+    """
+    single = not isinstance(grids, dict)
+    product_sums = zone_sums({'grid': grids} if single else grids, labels, n_zones, moments=True, processes=processes,
+                             block_rows=block_rows)
+    stats = {name: ZoneMoments.from_sums(sums).stats(ddof) for name, sums in product_sums.items()}
+    return stats['grid'] if single else stats
+
+
+def zone_sort_index(labels, n_zones: int) -> tuple:
+    """
+    Build, once per label grid, the permutation that groups the cells of the grid by zone. The values of the zone
+    labeled z of any grid with these labels are then the contiguous segment
+    grid.ravel()[order][offsets[z - 1]:offsets[z]], so order statistics (see zone_percentiles) only partition each
+    segment instead of scanning the grid for each zone.
+    Parameters
+    ----------
+    labels: int array of the zone of each cell, 1 to n_zones, 0 outside every zone
+    n_zones: number of zones
+
+    Returns
+    -------
+    tuple of (int array of the flat indices of the cells inside a zone, sorted by zone, int array of length
+    n_zones + 1 of the start of the segment of each zone)
+    """
+    flat = labels.ravel()
+    inside = np.flatnonzero(flat > 0)
+    order = inside[np.argsort(flat[inside], kind='stable')]
+    offsets = np.searchsorted(flat[order], np.arange(1, n_zones + 2))
+    return order, offsets
+
+
+def zone_percentiles(grid, zone_index: tuple, percentiles=(50,), nonzero: bool = False) -> dict:
+    """
+    Compute percentiles of a grid in each zone, Ex: the median SWE of every basin.
+    Parameters
+    ----------
+    grid: float grid with null cells set to NaN
+    zone_index: as returned by zone_sort_index for the labels of the zones
+    percentiles: percentiles to compute, between 0 and 100
+    nonzero: if True, only use the cells with a value that is not 0. Ex: the median SWE of the snow-covered cells.
+
+    Returns
+    -------
+    dictionary of arrays of length n_zones, one per percentile, named as in SNODAS_Climatology. Ex: {'p50': medians}.
+    Zones with no cells to use are NaN.
+    """
+    order, offsets = zone_index
+    values = grid.ravel()[order]
+    results = np.full((len(offsets) - 1, len(percentiles)), np.nan)
+    for zone in range(len(offsets) - 1):
+        segment = values[offsets[zone]:offsets[zone + 1]]
+        segment = segment[~np.isnan(segment)]
+        if nonzero:
+            segment = segment[segment != 0]
+        if segment.size:
+            results[zone] = np.percentile(segment, percentiles)
+    return {'p{:02g}'.format(percentile): results[:, i] for i, percentile in enumerate(percentiles)}
+
+
+def grid_origin(date) -> tuple:
+    """Return the (lon, lat) of the center of the upper left cell of the grid of a date."""
+    if isinstance(date, datetime):
+        date = date.date()
+    return utilities.SNODAS_ORIGIN_POST2013 if date >= datetime(2013, 10, 1).date() else utilities.SNODAS_ORIGIN_PRE2013
+
+
+def rasterize_basins(basin_shp: Path, id_field: str, date) -> tuple:
+    """
+    Burn the basins of a shapefile onto the SNODAS grid of a date. The basins are numbered 1 to n in the order of the
+    shapefile, and cells outside every basin are 0. Basins are reprojected to WGS84 if needed.
+    Parameters
+    ----------
+    basin_shp: full pathname of the basin boundary shapefile
+    id_field: attribute field holding the basin id. Ex: 'LOCAL_ID'
+    date: the date of the grid in date or datetime format. The grid origin changed on October 1, 2013.
+
+    Returns
+    -------
+    tuple of (int32 label array of shape (SNODAS_NROWS, SNODAS_NCOLS), list of the basin ids of labels 1 to n)
+    """
+    source = ogr.Open(str(basin_shp))
+    layer = source.GetLayer()
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = None
+    if layer.GetSpatialRef() is not None and not layer.GetSpatialRef().IsSame(wgs84):
+        transform = osr.CoordinateTransformation(layer.GetSpatialRef(), wgs84)
+
+    # Copy the basins to a memory layer with their label as an integer field, so they are burned in one call.
+    memory = ogr.GetDriverByName('Memory').CreateDataSource('basins')
+    zones = memory.CreateLayer('basins', wgs84, ogr.wkbMultiPolygon)
+    zones.CreateField(ogr.FieldDefn('zone', ogr.OFTInteger))
+    basin_ids = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef().Clone()
+        if transform is not None:
+            geometry.Transform(transform)
+        zone = ogr.Feature(zones.GetLayerDefn())
+        zone.SetGeometry(geometry)
+        basin_ids.append(feature.GetField(id_field))
+        zone.SetField('zone', len(basin_ids))
+        zones.CreateFeature(zone)
+
+    ulx, uly = grid_origin(date)
+    cell = utilities.SNODAS_CELL_SIZE
+    raster = gdal.GetDriverByName('MEM').Create('', utilities.SNODAS_NCOLS, utilities.SNODAS_NROWS, 1, gdal.GDT_Int32)
+    # The origin of the grid is the center of the upper left cell.
+    raster.SetGeoTransform((ulx - cell / 2, cell, 0, uly + cell / 2, 0, -cell))
+    raster.SetProjection(wgs84.ExportToWkt())
+    gdal.RasterizeLayer(raster, [1], zones, options=['ATTRIBUTE=zone'])
+    labels = raster.GetRasterBand(1).ReadAsArray().astype(np.int32)
+
+    logger.info('rasterize_basins: Burned {} basins of {} onto the SNODAS grid'.format(len(basin_ids), basin_shp))
+    return labels, basin_ids
+
+
+def snodas_cell_area(date):
+    """
+    Get the area of the grid cells in square meters. Cells are 30 arc-seconds wide, so their area only depends on the
+    latitude of their row.
+    date: the date of the grid in date or datetime format
+
+    Returns
+    -------
+    float64 array of the cell area of each row, of length SNODAS_NROWS
+    """
+    _, uly = grid_origin(date)
+    cell = np.radians(utilities.SNODAS_CELL_SIZE)
+    lat = np.radians(uly - np.arange(utilities.SNODAS_NROWS) * utilities.SNODAS_CELL_SIZE)
+    return EARTH_RADIUS_M ** 2 * cell * (np.sin(lat + cell / 2) - np.sin(lat - cell / 2))
+
+
+def _file_identity(path: Path) -> list:
+    """Return [full pathname, size, modification time in ns] of a file, which change whenever the file is rewritten."""
+    stat = Path(path).stat()
+    return [str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+def read_snodas_dem(dem_file: Path, date):
+    """
+    Read a DEM resampled onto the SNODAS grid of a date, averaging the DEM cells that fall in each SNODAS cell.
+    dem_file: full pathname of any raster GDAL can reproject. Ex: a 1 arc-second NED mosaic of the basins
+    date: the date of the grid in date or datetime format. The grid origin changed on October 1, 2013.
+
+    Returns
+    -------
+    float32 array of shape (SNODAS_NROWS, SNODAS_NCOLS), NaN where the DEM has no data
+    """
+    ulx, uly = grid_origin(date)
+    cell = utilities.SNODAS_CELL_SIZE
+    bounds = (ulx - cell / 2, uly + cell / 2 - utilities.SNODAS_NROWS * cell,
+              ulx - cell / 2 + utilities.SNODAS_NCOLS * cell, uly + cell / 2)
+    raster = gdal.Warp('', str(dem_file), format='MEM', dstSRS='EPSG:4326', outputBounds=bounds,
+                       width=utilities.SNODAS_NCOLS, height=utilities.SNODAS_NROWS, resampleAlg='average',
+                       outputType=gdal.GDT_Float32, dstNodata=float('nan'))
+    return raster.GetRasterBand(1).ReadAsArray().astype(np.float32)
+
+
+def elevation_band_labels(basin_shp: Path, id_field: str, dem_file: Path, breakpoints, date,
+                          cache_file: Path = None) -> tuple:
+    """
+    Combine the basin labels and the elevation bands of a DEM into one label grid, so that one pass over a grid gives
+    the statistics of every (basin, elevation band) and the basin statistics are the sums over the bands. Band 0 is
+    below breakpoints[0], band i is from breakpoints[i - 1] to breakpoints[i], and the last band holds the cells where
+    the DEM has no data, so every basin cell is in exactly one band. Without breakpoints, band 0 holds every cell with
+    an elevation.
+    The label of (basin b, band i) is (b - 1) * n_bands + i + 1, where n_bands = len(breakpoints) + 2, and 0 is outside
+    every basin.
+
+    Rasterizing the basins and resampling the DEM are the slow parts, and the result only changes with the basin
+    shapefile, the DEM, the breakpoints or the grid origin. The combined labels and the basin labels are saved to
+    cache_file, keyed by the path, size and modification time of the files, and loaded from there while those are
+    unchanged.
+    Parameters
+    ----------
+    basin_shp: full pathname of the basin boundary shapefile
+    id_field: attribute field holding the basin id. Ex: 'LOCAL_ID'
+    dem_file: full pathname of the DEM (see read_snodas_dem)
+    breakpoints: ascending elevations separating the bands, in the units of the DEM
+    date: the date of the grid in date or datetime format. The grid origin changed on October 1, 2013.
+    cache_file: optional full pathname of the .npz file caching the labels
+
+    Returns
+    -------
+    tuple of (int32 array of the combined labels, int32 array of the basin labels, list of the basin ids of labels 1
+    to n), as returned by rasterize_basins for the last two
+    """
+    breakpoints = np.asarray(breakpoints, dtype=np.float64)
+    if np.any(np.diff(breakpoints) <= 0):
+        raise ValueError('elevation_band_labels: The breakpoints {} are not ascending'.format(breakpoints.tolist()))
+    n_bands = len(breakpoints) + 2
+    # The .dbf holds the basin ids, the .shp their geometry.
+    key = json.dumps({'basins': [_file_identity(Path(basin_shp).with_suffix(ext)) for ext in ('.shp', '.dbf')],
+                      'id_field': id_field, 'dem': _file_identity(dem_file), 'breakpoints': breakpoints.tolist(),
+                      'origin': list(grid_origin(date))})
+
+    if cache_file is not None and Path(cache_file).exists():
+        with np.load(cache_file) as npz:
+            if str(npz['key']) == key:
+                return npz['labels'], npz['basin_labels'], npz['basin_ids'].tolist()
+        logger.info('elevation_band_labels: {} is out of date and is rebuilt'.format(cache_file))
+
+    basin_labels, basin_ids = rasterize_basins(basin_shp, id_field, date)
+    dem = read_snodas_dem(dem_file, date)
+    bands = np.digitize(dem, breakpoints).astype(np.int32)
+    bands[np.isnan(dem)] = n_bands - 1
+    labels = np.where(basin_labels > 0, (basin_labels - 1) * n_bands + bands + 1, 0).astype(np.int32)
+
+    if cache_file is not None:
+        tmp_file = Path(cache_file).with_name('{}.{}.tmp'.format(Path(cache_file).name, os.getpid()))
+        with open(tmp_file, 'wb') as file:
+            np.savez_compressed(file, labels=labels, basin_labels=basin_labels, basin_ids=np.array(basin_ids),
+                                key=np.array(key))
+        os.replace(tmp_file, cache_file)
+        logger.info('elevation_band_labels: Saved the labels of {} basins to {}'.format(len(basin_ids), cache_file))
+    return labels, basin_labels, basin_ids
+
+
+def _zone_block(grids: dict, task: tuple) -> dict:
+    """Per-zone sums of the rows row_start to row_stop of the grids named 'grid_<name>' (see zone_sums)."""
+    row_start, row_stop, n_zones, names, moments = task
+    labels = grids['labels'][row_start:row_stop]
+    inside = labels > 0
+    zones = labels[inside] - 1
+    area = None
+    if 'cell_area' in grids:
+        area = np.broadcast_to(grids['cell_area'][row_start:row_stop, np.newaxis], labels.shape)[inside]
+
+    block_sums = {}
+    for name in names:
+        values = grids['grid_' + name][row_start:row_stop][inside]
+        valid = ~np.isnan(values)
+        sums = {'cells': np.bincount(zones, weights=valid, minlength=n_zones),
+                'nonzero_cells': np.bincount(zones, weights=valid & (values != 0), minlength=n_zones)}
+        if area is not None:
+            sums['area_m2'] = np.bincount(zones, weights=valid * area, minlength=n_zones)
+            sums['weighted_sum'] = np.bincount(zones, weights=np.where(valid, values, 0) * area, minlength=n_zones)
+        if moments:
+            sums.update(ZoneMoments.from_values(values, zones + 1, n_zones).sums())
+        block_sums[name] = sums
+    return block_sums
+
+
+def zone_sums(grids: dict, labels, n_zones: int, cell_area=None, moments: bool = False, processes: int = None,
+              block_rows: int = ZONAL_BLOCK_ROWS) -> dict:
+    """
+    Reduce the grids of any number of products to per-zone sums in a single pass over the label grid, one block of
+    rows at a time. The cells of a block inside a zone, their zone and their area are found once, and each product
+    only adds a few bincounts over them, so adding a product, or its moments, adds arithmetic rather than another pass
+    over the labels. These sums are what every zone statistic is derived from (see zone_stats and zonal_stats), and
+    the sums of zones can be combined into the sums of their union (see group_sums).
+    With more than one process, the grids and the labels are placed in shared memory once and each worker reduces
+    blocks of rows of every grid, so the memory used does not grow with the number of workers and only the per-zone
+    sums of each block are sent back.
+    Parameters
+    ----------
+    grids: {product code: grid in the units of utilities.snodas_param_info with null cells set to NaN}
+    labels: int array of the zone of each cell, 1 to n_zones, 0 outside every zone
+    n_zones: number of zones
+    cell_area: area of the cells of each row in square meters (see snodas_cell_area). If None, the area sums are not
+    computed.
+    moments: if True, also compute the moments of the cell values (see ZoneMoments)
+    processes: number of worker processes. 1 computes the sums in this process. Defaults to the CPU count if the
+    grids hold at least ZONAL_POOL_MIN_CELLS cells in all, and to 1 otherwise.
+    block_rows: rows of the grids reduced per task
+
+    Returns
+    -------
+    dictionary of {product code: sums}, where sums is a dictionary of float64 arrays of length n_zones, indexed by
+    label - 1: 'cells' (cells that are not null), 'nonzero_cells' (cells with a value that is not 0), 'area_m2' (area
+    of the cells that are not null) and 'weighted_sum' (sum of value * cell area), and with moments, 'mean' (mean of
+    the cell values), 'm2' (sum of the squared deviations from the mean), 'min' and 'max' (inf and -inf for zones with
+    no valid cells)
+    """
+    if processes is None and labels.size * len(grids) < ZONAL_POOL_MIN_CELLS:
+        processes = 1
+    shared = {'grid_' + name: grid for name, grid in grids.items()}
+    shared['labels'] = labels
+    if cell_area is not None:
+        shared['cell_area'] = np.asarray(cell_area, dtype=np.float64)
+
+    nrows = labels.shape[0]
+    tasks = [(row, min(row + block_rows, nrows), n_zones, list(grids), moments) for row in range(0, nrows, block_rows)]
+    blocks = map_shared(_zone_block, shared, tasks, processes)
+    # Combine the sums of every block, each zone of each block being grouped with the same zone of the other blocks.
+    groups = np.tile(np.arange(n_zones), len(blocks))
+    return {name: group_sums({key: np.concatenate([block[name][key] for block in blocks]) for key in blocks[0][name]},
+                             groups, n_zones)
+            for name in grids}
+
+
+def group_sums(sums: dict, groups, n_groups: int) -> dict:
+    """
+    Combine per-zone sums into the sums of groups of zones, as if the cells of the zones of each group had been
+    reduced as one zone. Counts, areas and sums are added, min and max are reduced, and the moments are merged with
+    the pairwise update of Chan et al. (see ZoneMoments.merge).
+    Ex: the sums of every basin from the sums of its elevation bands, or the sums of row blocks of a grid.
+    Parameters
+    ----------
+    sums: dictionary of per-zone arrays, as returned by zone_sums for one product
+    groups: int array of the group of each zone, 0 to n_groups - 1
+    n_groups: number of groups
+
+    Returns
+    -------
+    dictionary of arrays of length n_groups, with the keys of sums
+    """
+    grouped = {}
+    for name, values in sums.items():
+        if name == 'min':
+            grouped[name] = np.full(n_groups, np.inf)
+            np.minimum.at(grouped[name], groups, values)
+        elif name == 'max':
+            grouped[name] = np.full(n_groups, -np.inf)
+            np.maximum.at(grouped[name], groups, values)
+        elif name not in ('mean', 'm2'):
+            grouped[name] = np.bincount(groups, weights=values, minlength=n_groups)
+    if 'm2' in sums:
+        count = sums['cells']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(grouped['cells'] > 0,
+                            np.bincount(groups, weights=count * sums['mean'], minlength=n_groups) / grouped['cells'], 0)
+        grouped['mean'] = mean
+        grouped['m2'] = np.bincount(groups, weights=sums['m2'] + count * (sums['mean'] - mean[groups]) ** 2,
+                                    minlength=n_groups)
+    return grouped
+
+
+def swe_zone_sums(swe, labels, n_zones: int, cell_area, moments: bool = False) -> dict:
+    """Per-zone sums of a SWE grid in millimeters. See zone_sums."""
+    return zone_sums({'1034': swe}, labels, n_zones, cell_area, moments)['1034']
+
+
+def _moment_columns(sums: dict, name: str, units: str) -> dict:
+    """Min, max and standard deviation columns of the cell values, if sums holds moments. Ex: 'SNODAS_SWE_Min_mm'"""
+    if 'm2' not in sums:
+        return {}
+    stats = ZoneMoments.from_sums(sums).stats()
+    return {'{}_Min_{}'.format(name, units): stats['min'], '{}_Max_{}'.format(name, units): stats['max'],
+            '{}_StdDev_{}'.format(name, units): stats['std']}
+
+
+def swe_zone_stats(sums: dict) -> dict:
+    """
+    Derive the snowpack statistics of the byDate and byBasin csv files from per-zone sums.
+    sums: dictionary of arrays, as returned by swe_zone_sums (or combined by group_sums)
+
+    Returns
+    -------
+    dictionary of arrays: 'SNODAS_SWE_Mean_mm' and 'SNODAS_SWE_Mean_in' (area-weighted), 'SNODAS_EffectiveArea_sqmi',
+    'SNODAS_SWE_Volume_acft' and 'SNODAS_SnowCover_percent', and if sums holds moments, the optional statistics
+    'SNODAS_SWE_Min_mm', 'SNODAS_SWE_Max_mm' and 'SNODAS_SWE_StdDev_mm' and their '_in' conversions. Zones with no
+    valid cells are NaN.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_mm = np.where(sums['area_m2'] > 0, sums['weighted_sum'] / sums['area_m2'], np.nan)
+        snow_cover = np.where(sums['cells'] > 0, sums['nonzero_cells'] / sums['cells'] * 100, np.nan)
+    columns = {'SNODAS_SWE_Mean_mm': mean_mm,
+               'SNODAS_SWE_Mean_in': mean_mm / MM_PER_INCH,
+               'SNODAS_EffectiveArea_sqmi': sums['area_m2'] / SQ_METERS_PER_SQ_MILE,
+               'SNODAS_SWE_Volume_acft': sums['weighted_sum'] / 1000 / CUBIC_METERS_PER_ACRE_FOOT,
+               'SNODAS_SnowCover_percent': snow_cover}
+    for column, values in _moment_columns(sums, 'SNODAS_SWE', 'mm').items():
+        columns[column] = values
+        columns[column[:-len('mm')] + 'in'] = values / MM_PER_INCH
+    return columns
+
+
+def zone_stats(product_sums: dict) -> dict:
+    """
+    Derive the statistics of every product from per-zone sums. SWE has the columns of swe_zone_stats. Every other
+    product has its area-weighted mean, Ex: 'SNODAS_Snow_Depth_Mean_mm', and the products that are depths of water
+    (melt, sublimation and precipitation) also have their volume, Ex: 'SNODAS_Snow_Melt_Runoff_at_Base_Volume_acft'.
+    Sums with moments add the min, max and standard deviation of the cells, Ex: 'SNODAS_Snow_Depth_StdDev_mm'.
+    product_sums: dictionary of {product code: sums}, as returned by zone_sums
+
+    Returns
+    -------
+    dictionary of {column name: array}
+    """
+    columns = {}
+    for product, sums in product_sums.items():
+        if product == '1034':
+            columns.update(swe_zone_stats(sums))
+            continue
+        info = utilities.snodas_param_info[product]
+        name = 'SNODAS_' + info['name'].replace(' ', '_')
+        units = UNIT_ABBREVIATIONS[info['units']]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(sums['area_m2'] > 0, sums['weighted_sum'] / sums['area_m2'], np.nan)
+        columns['{}_Mean_{}'.format(name, units)] = mean
+        if product in WATER_PRODUCTS:
+            columns[name + '_Volume_acft'] = sums['weighted_sum'] / 1000 / CUBIC_METERS_PER_ACRE_FOOT
+        columns.update(_moment_columns(sums, name, units))
+    return columns
+
+
+def elevation_band_stats(grids, band_labels, n_basins: int, n_bands: int, cell_area, moments: bool = False) -> tuple:
+    """
+    Compute the statistics of every basin and of every elevation band of every basin in one pass over the grids.
+    Parameters
+    ----------
+    grids: {product code: grid with null cells set to NaN} (see zone_sums), or a SWE grid in millimeters
+    band_labels: combined labels, as returned by elevation_band_labels
+    n_basins: number of basins
+    n_bands: number of bands, len(breakpoints) + 2
+    cell_area: area of the cells of each row in square meters (see snodas_cell_area)
+    moments: if True, also compute the min, max and standard deviation of the cells (see zone_stats)
+
+    Returns
+    -------
+    tuple of (basin statistics {column: array of length n_basins}, band statistics {column: array of shape
+    (n_basins, n_bands)}, per-basin sums {product code: sums of length n_basins})
+    """
+    if not isinstance(grids, dict):
+        grids = {'1034': grids}
+    product_sums = zone_sums(grids, band_labels, n_basins * n_bands, cell_area, moments)
+    # Label (b - 1) * n_bands + i + 1 is at index (b - 1) * n_bands + i, so the bands of a basin are consecutive.
+    basins = np.arange(n_basins * n_bands) // n_bands
+    band_sums, basin_sums = {}, {}
+    for product, sums in product_sums.items():
+        band_sums[product] = {name: values.reshape(n_basins, n_bands) for name, values in sums.items()}
+        basin_sums[product] = group_sums(sums, basins, n_basins)
+    return zone_stats(basin_sums), zone_stats(band_sums), basin_sums
+
+
+def band_names(breakpoints) -> list:
+    """Return a name for each elevation band. Ex: ['<2000', '2000-2500', '>=2500', 'NoData'], or ['All', 'NoData']
+    without breakpoints."""
+    if len(breakpoints) == 0:
+        return ['All', 'NoData']
+    names = ['<{:g}'.format(breakpoints[0])]
+    names += ['{:g}-{:g}'.format(low, high) for low, high in zip(breakpoints[:-1], breakpoints[1:])]
+    return names + ['>={:g}'.format(breakpoints[-1]), 'NoData']
+
+
+def write_elevation_band_csv(out_file: Path, date_name: str, basin_ids: list, breakpoints, band_stats: dict,
+                             id_field: str = 'LOCAL_ID') -> None:
+    """
+    Save the elevation band statistics of a day to a .csv file with one row per (basin, band).
+    Parameters
+    ----------
+    out_file: full pathname of the .csv file
+    date_name: date of the statistics in the format YYYYMMDD
+    basin_ids: id of basins 1 to n, as returned by rasterize_basins
+    breakpoints: the breakpoints of the bands
+    band_stats: band statistics, as returned by elevation_band_stats
+    id_field: name of the basin id column
+    """
+    names = band_names(breakpoints)
+    fieldnames = ['Date_YYYYMMDD', id_field, 'Elevation_Band'] + list(band_stats)
+    with open(out_file, 'w', newline='') as csv_file:
+        csv_writer = csv.DictWriter(csv_file, delimiter=',', fieldnames=fieldnames)
+        csv_writer.writeheader()
+        for basin, basin_id in enumerate(basin_ids):
+            for band, name in enumerate(names):
+                row = {'Date_YYYYMMDD': date_name, id_field: basin_id, 'Elevation_Band': name}
+                for key, values in band_stats.items():
+                    value = values[basin, band]
+                    row[key] = '' if np.isnan(value) else round(float(value), 2)
+                csv_writer.writerow(row)
+
+
+def read_basin_field(basin_shp: Path, field: str) -> list:
+    """
+    Read an attribute of every basin of a shapefile, in the order of the labels of rasterize_basins.
+    Ex: read_basin_field(basin_shp, 'DOWNSTREAM_ID') for the id of the basin each basin drains to.
+    """
+    source = ogr.Open(str(basin_shp))
+    return [feature.GetField(field) for feature in source.GetLayer()]
+
+
+def build_basin_tree(basin_ids: list, downstream_ids: list) -> tuple:
+    """
+    Build the drainage tree of the basins once, so that the totals of every basin and all the basins upstream of it
+    are one accumulation over the per-basin sums (see upstream_sums), without rasterizing unions of basins.
+    Basins are grouped by level, the number of basins on the longest path draining into them: level 0 basins have
+    nothing upstream, and every basin upstream of a level n basin is in a lower level. The basins of a level never
+    drain into each other, so a whole level is added to its downstream basins at once.
+    Parameters
+    ----------
+    basin_ids: id of basins 1 to n, as returned by rasterize_basins
+    downstream_ids: id of the basin each basin drains to, in the same order. An empty value, or an id that is not one
+    of basin_ids, marks an outlet.
+
+    Returns
+    -------
+    tuple of (int array of the index of the downstream basin of each basin, -1 for outlets, list of int arrays of the
+    basin indices of each level). The index of a basin is its label - 1, the index of the per-basin sums.
+    """
+    index = {basin_id: i for i, basin_id in enumerate(basin_ids)}
+    downstream = np.array([index.get(downstream_id, -1) for downstream_id in downstream_ids], dtype=np.int64)
+    for i, basin_id in enumerate(basin_ids):
+        if downstream[i] == i:
+            logger.warning('build_basin_tree: Basin {} drains to itself and is treated as an outlet'.format(basin_id))
+            downstream[i] = -1
+
+    # Remove the basins with nothing left upstream, one level at a time.
+    n_upstream = np.bincount(downstream[downstream >= 0], minlength=len(basin_ids))
+    levels = []
+    current = np.flatnonzero(n_upstream == 0)
+    while current.size:
+        levels.append(current)
+        receivers = downstream[current]
+        receivers = receivers[receivers >= 0]
+        np.subtract.at(n_upstream, receivers, 1)
+        current = np.unique(receivers[n_upstream[receivers] == 0])
+    if sum(level.size for level in levels) < len(basin_ids):
+        cycle = [basin_ids[i] for i in np.flatnonzero(n_upstream > 0)]
+        raise ValueError('build_basin_tree: The downstream ids form a cycle through basins {}'.format(cycle))
+    return downstream, levels
+
+
+def upstream_sums(sums: dict, basin_tree: tuple) -> dict:
+    """
+    Accumulate per-basin sums down the basin tree, so each basin holds the sums of itself and every basin upstream of
+    it. The statistics of the upstream totals are then swe_zone_stats(upstream_sums(sums, basin_tree)), or
+    zone_stats({product: upstream_sums(sums, basin_tree)}).
+    Parameters
+    ----------
+    sums: dictionary of arrays of length n_basins, indexed by label - 1, Ex: the per-basin sums of one product
+    returned by zone_sums for the labels of rasterize_basins, or by elevation_band_stats. Moments are merged too.
+    basin_tree: as returned by build_basin_tree
+
+    Returns
+    -------
+    dictionary of the upstream totals, with the keys and shapes of sums
+    """
+    downstream, levels = basin_tree
+    totals = {name: np.array(values, dtype=np.float64) for name, values in sums.items()}
+    basins = np.arange(len(downstream))
+    for level in levels:
+        level = level[downstream[level] >= 0]
+        if not level.size:
+            continue
+        # Every basin keeps its own sums, and a copy of the sums of the level is grouped with their downstream basins.
+        groups = np.concatenate([basins, downstream[level]])
+        totals = group_sums({name: np.concatenate([values, values[level]]) for name, values in totals.items()},
+                            groups, len(downstream))
+    return totals
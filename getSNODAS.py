@@ -1,14 +1,21 @@
+import argparse
 import logging
+import multiprocessing as mp
 import os
 import sys
 import time
 import rasterio
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 from logging.config import fileConfig
 
+import SNODAS_Accumulation
+import SNODAS_Archive
 import utilities
+from SNODAS_JobState import DONE, JOB_DB_NAME, JobStageError, JobStore
+from SNODAS_Manifest import RunManifest
 
 # Create and configures logging file
 CONFIG_FILE = 'logging.conf'
@@ -21,23 +28,238 @@ print('Running getSNODAS.py Version 1')
 logger.info('Running getSNODAS.py Version 1\n')
 
 
-def download_multiband_range(startDate, endDate, rootdir):
+def download_snodas_day(current, download_path):
     """
-    Function to download a range of SNODAS datasets, scale them, and combine into a multiband
-    raster for analysis or display.
+    Download the SNODAS .tar file of a single day.
     Parameters
     ----------
-    startDate: in the format "yyyy-mm-dd"
-    endDate: in the format "yyyy-mm-dd"
-    rootdir: root directory for which all raw and processed output will be saved, the function will
-    create default sub-directories for organization
+    current: the date of interest in date format
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+
+    Returns
+    -------
+    The failed date if the download was unsuccessful, otherwise the string 'None'.
+    """
+    # Format date into string with format YYYYMMDD
+    current_date = utilities.format_date_yyyymmdd(current)
+    current_date_tar = 'SNODAS_' + current_date + '.tar'
+
+    # Check to see if this date of data has already been processed in the folder
+    possible_file = download_path / current_date_tar
+
+    # If date has already been processed within the folder, the download & zonal statistics are rerun.
+    if possible_file.exists():
+        logger.info('This date ({}) has already been processed. The files will be reprocessed and '
+                    'rewritten.\n'.format(current_date))
+
+    # Download current date SNODAS .tar file from the FTP site at
+    # ftp://sidads.colorado.edu/DATASETS/NOAA/G02158/masked/
+    returnedList = utilities.download_snodas(download_path, current)
+
+    return returnedList[1]
+
+
+def process_multiband_day(current, download_path, processed_path, max_band_workers=None, manifest=None,
+                          accumulation_path=None, packed=False):
+    """
+    Untar the downloaded .tar file of a single day, scale it, and combine it into a multiband raster.
+    Parameters
+    ----------
+    current: the date of interest in date format
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    processed_path: full pathname to the folder where the multiband rasters are saved
+    max_band_workers: number of threads used to extract the bands of the day. Defaults to the ThreadPoolExecutor
+    default
+    manifest: RunManifest shared by the days of a run. The stacked .tif and the moved metadata files of the day are
+    left in it under the stages 'tif' and 'txt'. A new manifest is used if not given.
+    accumulation_path: full pathname to the folder of the water-year running sums of the flux products. The sums are
+    not updated if not given. See SNODAS_Accumulation.update_accumulation.
+    packed: if True, save the multiband raster as int16 with per-band scale factors instead of float32. See
+    utilities.stack_snodas_bil_to_multiband_tif.
 
     Returns
     -------
-    None - function completes successfully with processed files in the root directory.
+    full pathname of the multiband .tif file, or None if the .tar file of the day has not been downloaded
+    """
+    if manifest is None:
+        manifest = RunManifest()
+
+    current_date = utilities.format_date_yyyymmdd(current)
+    possible_file = download_path / ('SNODAS_' + current_date + '.tar')
+
+    if not possible_file.exists():
+        logger.warning('process_multiband_day: {} does not exist. {} was not processed.'
+                       .format(possible_file, current_date))
+        return None
+
+    # Untar current date's data. Every file produced from here on is recorded in the manifest by (date, stage,
+    # product), so each stage looks its inputs up directly instead of listing the processed folder.
+    for member in utilities.untar_snodas_file(possible_file.name, download_path, processed_path):
+        # Stage is the file extension. Ex: 'dat.gz' or 'txt.gz'
+        manifest.add(current_date, member.name.split('.', 1)[-1], member)
+
+    # Extract current date's .gz files. Each SNODAS parameter files are zipped within a .gz file. The bands are
+    # independent and every output path is explicit, so they are extracted on a thread pool.
+    gz_files = manifest.files(current_date, 'dat.gz') + manifest.files(current_date, 'txt.gz')
+    with ThreadPoolExecutor(max_workers=max_band_workers) as executor:
+        for extracted in executor.map(lambda gz_file: utilities.extract_snodas_gz_file(gz_file, processed_path),
+                                      gz_files):
+            manifest.add(current_date, extracted.suffix.lstrip('.'), extracted)
+    manifest.remove(current_date, 'dat.gz')
+    manifest.remove(current_date, 'txt.gz')
+
+    # Convert current date's SNODAS .dat files into .bil format.
+    for product, file in manifest.products(current_date, 'dat').items():
+        manifest.add(current_date, 'bil', utilities.convert_snodas_dat_to_bil(file), product)
+    manifest.remove(current_date, 'dat')
+
+    # Create current date's custom .Hdr file. In order to convert today's SNODAS SWE .bil file into a usable
+    # .tif file, a custom .Hdr must be created. Refer to the function in the SNODAS_utilities.py for more
+    # information on the contents of the custom .HDR file.
+    for product, file in manifest.products(current_date, 'bil').items():
+        if current >= datetime(2013, 10, 1).date():
+            utilities.create_snodas_hdr_file_post2013(str(file))
+        else:
+            utilities.create_snodas_hdr_file_pre2013(str(file))
+        manifest.add(current_date, 'hdr', file.with_suffix('.hdr'), product)
+
+    # Convert current date's .bil files to .tif files
+    out_filenm = processed_path / (current_date + 'WGS84')
+    utilities.stack_snodas_bil_to_multiband_tif(manifest.files(current_date, 'bil'), str(out_filenm), packed)
+    manifest.add(current_date, 'tif', out_filenm.with_suffix('.tif'), 'multiband')
+
+    # Add the day's flux products to the water-year running sums, read from the .bil files already extracted above
+    # instead of decoding the .tar file again.
+    if accumulation_path is not None:
+        grids = {product: utilities.read_snodas_bil_grid(file, sparse=True)
+                 for product, file in manifest.products(current_date, 'bil').items()
+                 if product in SNODAS_Accumulation.ACCUMULATION_PRODUCTS}
+        SNODAS_Accumulation.update_accumulation(accumulation_path, current, grids)
+
+    # Delete current date's .bil and .hdr files, along with any .Hdr or .prj sidecar written next to the .bil file.
+    for file in manifest.files(current_date, 'bil'):
+        for sidecar in (file, file.with_suffix('.hdr'), file.with_suffix('.Hdr'), file.with_suffix('.prj')):
+            utilities.delete_snodas_files(sidecar)
+    manifest.remove(current_date, 'bil')
+    manifest.remove(current_date, 'hdr')
+
+    # Move current date's metadata files to sub-directory.
+    txt_path = processed_path / 'orig_metadata'
+    if not os.path.exists(txt_path):
+        os.makedirs(txt_path, exist_ok=True)
+    for product, file in manifest.products(current_date, 'txt').items():
+        utilities.move_snodas_txt_files(str(file), txt_path)
+        manifest.add(current_date, 'txt', txt_path / file.name, product)
+
+    return manifest.get(current_date, 'tif', 'multiband')
+
+
+def download_multiband_day(current, download_path, processed_path, max_band_workers=None, manifest=None,
+                           accumulation_path=None, packed=False):
     """
-    download_path = Path(rootdir) / 'RAW_data'
-    processed_path = Path(rootdir) / 'geotiff'
+    Download a single day of SNODAS data, scale it, and combine it into a multiband raster.
+    Parameters
+    ----------
+    current: the date of interest in date format
+    download_path: full pathname to the folder where the downloaded SNODAS .tar files are stored
+    processed_path: full pathname to the folder where the multiband rasters are saved
+    max_band_workers: see process_multiband_day
+    manifest: see process_multiband_day
+    accumulation_path: see process_multiband_day
+    packed: see process_multiband_day
+
+    Returns
+    -------
+    The failed date if the download was unsuccessful, otherwise the string 'None'.
+    """
+    # The start time is used to calculate the elapsed time of the running script. The elapsed time will be
+    # displayed at the end of the log file.
+    start_day = time.time()
+
+    failed_date = download_snodas_day(current, download_path)
+    process_multiband_day(current, download_path, processed_path, max_band_workers, manifest, accumulation_path,
+                          packed)
+
+    # Display elapsed time of current date's processing in log.
+    current_date = utilities.format_date_yyyymmdd(current)
+    end_day = time.time()
+    elapsed_day = end_day - start_day
+    logger.info('{}: Completed.'.format(current_date))
+    logger.info('Elapsed time (date: {}): {} seconds'.format(current_date, elapsed_day))
+
+    return failed_date
+
+
+def report_failed_dates(failed_dates_lst):
+    """
+    Print and log the dates that were unsuccessfully downloaded.
+    Parameters
+    ----------
+    failed_dates_lst: list of failed dates (date format) or 'None' for each processed date
+
+    Returns
+    -------
+    list of the failed dates as strings, sorted in ascending order
+    """
+    failed_dates_lst_updated = sorted(str(item) for item in failed_dates_lst if item != 'None')
+
+    if not failed_dates_lst_updated:
+        print('All dates successfully downloaded!')
+        logger.info('All dates successfully downloaded!')
+    else:
+        print('\nDates unsuccessfully downloaded: ')
+        logger.info('\nDates unsuccessfully downloaded: ')
+        for item in failed_dates_lst_updated:
+            print(item)
+            logger.info('{}'.format(item))
+
+    return failed_dates_lst_updated
+
+
+def _report_elapsed(start, startDate, endDate):
+    """
+    Print and log the elapsed time of a full run.
+    Parameters
+    ----------
+    start: the time.time() value recorded at the start of the run
+    startDate: start date of the processed range
+    endDate: end date of the processed range
+
+    Returns
+    -------
+    None
+    """
+    # Close logging including the elapsed time of the running script in seconds.
+    elapsed = time.time() - start
+    elapsed_hours = int(elapsed / 3600)
+    elapsed_hours_remainder = elapsed % 3600
+    elapsed_minutes = int(elapsed_hours_remainder / 60)
+    elapsed_seconds = int(elapsed_hours_remainder % 60)
+    stringStart = str(startDate)
+    stringEnd = str(endDate)
+    print('getSNODAS.py: Completed. Dates Processed: From {} to {}.'.format(stringStart, stringEnd))
+    print('Elapsed time (full script): approximately {} hours, {} minutes and {} seconds\n'
+          .format(elapsed_hours, elapsed_minutes, elapsed_seconds))
+    logger.info('getSNODAS.py: Completed. Dates Processed: From {} to {}.'
+                .format(stringStart, stringEnd))
+    logger.info('Elapsed time (full script): approximately {} hours, {} minutes and {} seconds\n'
+                .format(elapsed_hours, elapsed_minutes, elapsed_seconds))
+
+
+def _create_folders(rootdir):
+    """
+    Create the default sub-directories of rootdir.
+    Parameters
+    ----------
+    rootdir: root directory for which all raw and processed output will be saved
+
+    Returns
+    -------
+    tuple of (download_path, processed_path)
+    """
+    # Resolve to absolute paths. No stage changes the working directory, so every output path is explicit.
+    download_path = Path(rootdir).resolve() / 'RAW_data'
+    processed_path = Path(rootdir).resolve() / 'geotiff'
 
     all_folders = [download_path, processed_path]
 
@@ -45,6 +267,29 @@ def download_multiband_range(startDate, endDate, rootdir):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
+    return download_path, processed_path
+
+
+def download_multiband_range(startDate, endDate, rootdir, accumulate=False, packed=False):
+    """
+    Function to download a range of SNODAS datasets, scale them, and combine into a multiband
+    raster for analysis or display.
+    Parameters
+    ----------
+    startDate: in the format "yyyy-mm-dd"
+    endDate: in the format "yyyy-mm-dd"
+    rootdir: root directory for which all raw and processed output will be saved, the function will
+    create default sub-directories for organization
+    accumulate: if True, add the flux products of each day to the water-year running sums in rootdir/accumulation
+    packed: if True, save the multiband rasters as int16 with per-band scale factors instead of float32
+
+    Returns
+    -------
+    list of the dates that failed to download, as strings
+    """
+    download_path, processed_path = _create_folders(rootdir)
+    accumulation_path = Path(rootdir).resolve() / 'accumulation' if accumulate else None
+
     # The start time is used to calculate the elapsed time of the running script. The elapsed time will be displayed at
     # the end of the log file.
     start = time.time()
@@ -62,147 +307,249 @@ def download_multiband_range(startDate, endDate, rootdir):
     # Define the current day depending on the user's interest in one or range of dates.
     for day_number in range(total_days):
         current = (startDate + timedelta(days=day_number)).date()
+        failed_dates_lst.append(download_multiband_day(current, download_path, processed_path,
+                                                       accumulation_path=accumulation_path, packed=packed))
 
-        # The start time is used to calculate the elapsed time of the running script. The elapsed time will be
-        # displayed at the end of the log file.
-        start_day = time.time()
-
-        # Format date into string with format YYYYMMDD
-        current_date = utilities.format_date_yyyymmdd(current)
-        current_date_tar = 'SNODAS_' + current_date + '.tar'
-
-        # Check to see if this date of data has already been processed in the folder
-        possible_file = download_path / current_date_tar
+    _report_elapsed(start, startDate, endDate)
 
-        # If date has already been processed within the folder, the download & zonal statistics are rerun.
-        if possible_file.exists():
-            logger.info('This date ({}) has already been processed. The files will be reprocessed and '
-                        'rewritten.\n'.format(current_date))
-
-        # Download current date SNODAS .tar file from the FTP site at
-        # ftp://sidads.colorado.edu/DATASETS/NOAA/G02158/masked/
-        returnedList = utilities.download_snodas(download_path, current)
-
-        failed_dates_lst.append(returnedList[1])
+    # If any dates were unsuccessfully downloaded, print those dates to the console and the logging file.
+    return report_failed_dates(failed_dates_lst)
 
-        # Untar current date's data.
-        for file in utilities.list_dir(download_path, '*.tar'):
-            if current_date in str(file):
-                utilities.untar_snodas_file(file, download_path, processed_path)
 
+def _run_job_day(args):
+    """
+    Run the stages of one date of a job that are not done yet, recording each stage in the job-state database.
+    Called directly or by the worker processes of a pool, so the database is opened here.
+    Parameters
+    ----------
+    args: tuple of (current, download_path, processed_path, db_path, job_id, accumulation_path, packed), where
+    accumulation_path is None when the running sums are not updated, and packed is passed to process_multiband_day
 
-        # Extract current date's .gz files. Each SNODAS parameter files are zipped within a .gz file.
-        for file in utilities.list_dir(processed_path, '*.gz'):
-            if current_date in str(file):
-                utilities.extract_snodas_gz_file(file)
+    Returns
+    -------
+    tuple of (current, failed date or 'None')
+    """
+    current, download_path, processed_path, db_path, job_id, accumulation_path, packed = args
+    with JobStore(db_path) as store:
+        status = store.stage_status(job_id, current)
+        try:
+            if status.get('download') != DONE:
+                with store.stage(job_id, current, 'download'):
+                    if download_snodas_day(current, download_path) != 'None':
+                        raise JobStageError('SNODAS data was not available for download.')
+            if status.get('process') != DONE:
+                with store.stage(job_id, current, 'process'):
+                    if process_multiband_day(current, download_path, processed_path,
+                                             accumulation_path=accumulation_path, packed=packed) is None:
+                        raise JobStageError('The downloaded .tar file does not exist.')
+        except Exception:
+            logger.error('_run_job_day: Job {} failed for {}'.format(job_id, current), exc_info=True)
+            return current, current
+    return current, 'None'
+
+
+def run_job(rootdir, job_id, dates, processes=1, accumulate=False, packed=False):
+    """
+    Run the given dates of a job, skipping the stages that are already done.
+    Parameters
+    ----------
+    rootdir: root directory of the job. The job-state database is saved here.
+    job_id: id of the job in the job-state database
+    dates: list of dates (date format) to run
+    processes: number of worker processes. 1 runs the dates in this process.
+    accumulate: if True, add the flux products of each processed day to the water-year running sums in
+    rootdir/accumulation. A day that is processed again replaces its earlier contribution to the sums.
+    packed: if True, save the multiband rasters as int16 with per-band scale factors instead of float32
 
-        # Convert current date's SNODAS SWE .dat file into .bil format.
-        for file in utilities.list_dir(processed_path, '*.dat'):
-            if current_date in str(file):
-                utilities.convert_snodas_dat_to_bil(file)
+    Returns
+    -------
+    list of the dates that failed, as strings
+    """
+    download_path, processed_path = _create_folders(rootdir)
+    db_path = Path(rootdir).resolve() / JOB_DB_NAME
 
+    start = time.time()
 
-        # Create current date's custom .Hdr file. In order to convert today's SNODAS SWE .bil file into a usable
-        # .tif file, a custom .Hdr must be created. Refer to the function in the SNODAS_utilities.py for more
-        # information on the contents of the custom .HDR file.
-        for file in utilities.list_dir(processed_path, '*.bil'):
-            if current_date in str(file):
-                if current >= datetime(2013, 10, 1).date():
-                    utilities.create_snodas_hdr_file_post2013(str(file))
-                else:
-                    utilities.create_snodas_hdr_file_pre2013(str(file))
+    accumulation_path = Path(rootdir).resolve() / 'accumulation' if accumulate else None
 
+    tasks = [(current, download_path, processed_path, db_path, job_id, accumulation_path, packed)
+             for current in dates]
+    logger.info('run_job: Running {} dates of job {}'.format(len(tasks), job_id))
 
-        # Convert current date's .bil files to .tif files
-        tif_fl_lst = []
-        for file in utilities.list_dir(processed_path, '*.bil'):
-            if current_date in str(file):
-                tif_fl_lst.append(file)
-        utilities.stack_snodas_bil_to_multiband_tif(tif_fl_lst, str(processed_path) + '\\' + current_date + 'WGS84')
+    failed_dates_lst = []
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        for task in tasks:
+            failed_dates_lst.append(_run_job_day(task)[1])
+    else:
+        # chunksize=1 hands out one day at a time, which balances the load when days take uneven amounts of time.
+        with mp.Pool(processes=processes) as pool:
+            for current, failed_date in pool.imap_unordered(_run_job_day, tasks, chunksize=1):
+                failed_dates_lst.append(failed_date)
 
-        # Delete current date's .bil and .hdr files
-        for file in utilities.list_dir(processed_path, ('*.bil', '*.hdr', '*.Hdr', '*.prj'),
-                                              multiple_types=True):
-            if current_date in str(file):
-                utilities.delete_snodas_files(file)
+    if dates:
+        _report_elapsed(start, min(dates), max(dates))
 
-        # Move metadata files to sub-directory
-        for file in utilities.list_dir(processed_path, '*.txt'):
-            txt_path = processed_path / 'orig_metadata'
-            if not os.path.exists(txt_path):
-                os.makedirs(txt_path)
-            utilities.move_snodas_txt_files(file, processed_path / 'orig_metadata')
+    with JobStore(db_path) as store:
+        logger.info('run_job: Job {} stage summary: {}'.format(job_id, store.summary(job_id)))
+        for date, stage, error in store.stage_errors(job_id):
+            logger.info('run_job: {} {} failed: {}'.format(date, stage, error.strip().splitlines()[-1]))
 
+    return report_failed_dates(failed_dates_lst)
 
-        # Display elapsed time of current date's processing in log.
-        end_day = time.time()
-        elapsed_day = end_day - start_day
-        logger.info('{}: Completed.'.format(current_date))
-        logger.info('Elapsed time (date: {}): {} seconds'.format(current_date, elapsed_day))
 
-    # Close logging including the elapsed time of the running script in seconds.
-    elapsed = time.time() - start
-    elapsed_hours = int(elapsed / 3600)
-    elapsed_hours_remainder = elapsed % 3600
-    elapsed_minutes = int(elapsed_hours_remainder / 60)
-    elapsed_seconds = int(elapsed_hours_remainder % 60)
-    stringStart = str(startDate)
-    stringEnd = str(endDate)
-    print('getSNODAS.py: Completed. Dates Processed: From {} to {}.'.format(stringStart, stringEnd))
-    print('Elapsed time (full script): approximately {} hours, {} minutes and {} seconds\n'
-          .format(elapsed_hours, elapsed_minutes, elapsed_seconds))
+def start_job(startDate, endDate, rootdir, processes=1, accumulate=False, packed=False):
+    """
+    Create a job in the job-state database of rootdir and run it. If the run stops part way through, it can be
+    picked up again with resume_job.
+    Parameters
+    ----------
+    startDate: in the format "yyyy-mm-dd"
+    endDate: in the format "yyyy-mm-dd"
+    rootdir: root directory for which all raw and processed output will be saved
+    processes: number of worker processes
+    accumulate: see run_job
+    packed: see run_job
 
-    # If any dates were unsuccessfully downloaded, print those dates to the console and the logging file.
-    failed_dates_lst_updated = []
-    failed_dates_lst_1Week = []
-    for item in failed_dates_lst:
-        if item != 'None':
-            item_str = str(item)
-            item_plus_seven = item + timedelta(days=7)
-            item_plus_seven_str = str(item_plus_seven)
-            failed_dates_lst_updated.append(item_str)
-            failed_dates_lst_1Week.append(item_plus_seven_str)
+    Returns
+    -------
+    tuple of (job id, list of the dates that failed, as strings)
+    """
+    startDate = datetime.strptime(startDate, '%Y-%m-%d').date()
+    endDate = datetime.strptime(endDate, '%Y-%m-%d').date()
+    _create_folders(rootdir)
+    with JobStore(Path(rootdir).resolve() / JOB_DB_NAME) as store:
+        job_id = store.create_job(startDate, endDate, Path(rootdir).resolve())
+        dates = store.incomplete_dates(job_id)
+    print('Started job {}'.format(job_id))
+    return job_id, run_job(rootdir, job_id, dates, processes, accumulate, packed)
 
-    if not failed_dates_lst_updated:
-        print('All dates successfully downloaded!')
-        logger.info('All dates successfully downloaded!')
-    else:
-        print('\nDates unsuccessfully downloaded: ')
-        logger.info('\nDates unsuccessfully downloaded: ')
-        for item in failed_dates_lst_1Week:
-            print(item)
-            logger.info('{}'.format(item))
 
-    logger.info('getSNODAS.py: Completed. Dates Processed: From {} to {}.'
-                .format(stringStart, stringEnd))
-    logger.info('Elapsed time (full script): approximately {} hours, {} minutes and {} seconds\n'
-                .format(elapsed_hours, elapsed_minutes, elapsed_seconds))
+def resume_job(rootdir, job_id=None, processes=1, accumulate=False, packed=False):
+    """
+    Resume a job that stopped part way through. Only the stages that are pending, or were left running by the
+    stopped run, are re-run. Failed stages are left for retry_job.
+    Parameters
+    ----------
+    rootdir: root directory of the job
+    job_id: id of the job. Defaults to the most recent job.
+    processes: number of worker processes
+    accumulate: see run_job
+    packed: see run_job
 
-# def download_day(date, rootdir: Path):
-#     sdf
+    Returns
+    -------
+    list of the dates that failed, as strings
+    """
+    with JobStore(Path(rootdir).resolve() / JOB_DB_NAME) as store:
+        job_id = job_id if job_id is not None else store.latest_job_id()
+        if job_id is None or store.job(job_id) is None:
+            print('No job to resume in {}'.format(rootdir))
+            return []
+        dates = store.incomplete_dates(job_id)
+    print('Resuming job {}: {} dates left'.format(job_id, len(dates)))
+    return run_job(rootdir, job_id, dates, processes, accumulate, packed)
 
-# def download_current(rootdir: Path):
 
-if __name__ == '__main__':
-    import multiprocessing as mp
+def retry_job(rootdir, job_id=None, processes=1, accumulate=False, packed=False):
+    """
+    Re-run the failed stages of a job, for example once SNODAS data that was missing on the FTP site is available.
+    Parameters
+    ----------
+    rootdir: root directory of the job
+    job_id: id of the job. Defaults to the most recent job.
+    processes: number of worker processes
+    accumulate: see run_job
+    packed: see run_job
 
-    parallel = False
+    Returns
+    -------
+    list of the dates that failed again, as strings
+    """
+    with JobStore(Path(rootdir).resolve() / JOB_DB_NAME) as store:
+        job_id = job_id if job_id is not None else store.latest_job_id()
+        if job_id is None or store.job(job_id) is None:
+            print('No job to retry in {}'.format(rootdir))
+            return []
+        dates = store.reset_failed(job_id)
+    print('Retrying job {}: {} failed dates'.format(job_id, len(dates)))
+    return run_job(rootdir, job_id, dates, processes, accumulate, packed)
 
-    startD = '2003-09-30'
-    endD = '2003-12-31'
-    fldr = r'D:\Spatial_Data\Statewide_Data\Raster\NSIDC\SNODAS'
 
-    if parallel:
-        # start = time.time()
-        dts = utilities.split_date_range(startD, endD, mp.cpu_count())
+def repack_archive(rootdir, water_years, overwrite=False):
+    """
+    Repack the downloaded .tar files of water years into the water year archives in rootdir/archive.
+    Parameters
+    ----------
+    rootdir: root directory of the raw data
+    water_years: list of water years to repack
+    overwrite: if True, repack dates that are already in the archives
 
-        processes = [mp.Process(target=download_range, args=(dt[0], dt[1], fldr)) for dt in dts]
-        print('Parallel Processing enabled using {0} CPUs'.format(mp.cpu_count()))
-        for process in processes:
-            process.start()
-        for process in processes:
-            process.join()
+    Returns
+    -------
+    list of the dates that were added to the archives
+    """
+    download_path, processed_path = _create_folders(rootdir)
+    archive_path = Path(rootdir).resolve() / 'archive'
+
+    added = []
+    for wy in water_years:
+        wy_added = SNODAS_Archive.repack_water_year(download_path, archive_path, wy, overwrite)
+        print('Water year {0}: added {1} dates to {2}'.format(wy, len(wy_added),
+                                                              SNODAS_Archive.archive_file(archive_path, wy)))
+        added += wy_added
+    return added
+
+
+def arg_parse():
+    """ Parse command line arguments. Currently implemented commands are:\n
+
+     run START END ROOTDIR: Create a job for the dates START to END (yyyy-mm-dd) and run it.\n
+     resume ROOTDIR: Resume the stages of a job that did not finish.\n
+     retry ROOTDIR: Re-run the failed dates of a job.\n
+     repack ROOTDIR WY [WY ...]: Repack the downloaded .tar files of water years into one archive file each.\n
+     --job: Id of the job to resume or retry. Defaults to the most recent job.\n
+     --processes: Number of worker processes. Defaults to 1.\n
+     --accumulate: Add the flux products of each processed day to the water-year running sums.\n
+     --packed: Save the multiband rasters as int16 with per-band scale factors instead of float32."""
+
+    parser = argparse.ArgumentParser(prog='getSNODAS', description='Download and stack SNODAS data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Create and run a job for a range of dates.')
+    run_parser.add_argument('start', help='Start date in the format yyyy-mm-dd')
+    run_parser.add_argument('end', help='End date in the format yyyy-mm-dd')
+    run_parser.add_argument('rootdir', help='Root directory for the raw and processed output')
+
+    for command, help_text in (('resume', 'Resume the stages of a job that did not finish.'),
+                               ('retry', 'Re-run the failed dates of a job.')):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument('rootdir', help='Root directory of the job')
+        command_parser.add_argument('--job', type=int, default=None, help='Job id. Defaults to the most recent job.')
+
+    for command_parser in subparsers.choices.values():
+        command_parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+        command_parser.add_argument('--accumulate', action='store_true',
+                                    help='Add the flux products of each processed day to the water-year running sums')
+        command_parser.add_argument('--packed', action='store_true',
+                                    help='Save the multiband rasters as int16 with per-band scale factors')
+
+    repack_parser = subparsers.add_parser('repack', help='Repack water years of .tar files into archive files.')
+    repack_parser.add_argument('rootdir', help='Root directory of the raw data')
+    repack_parser.add_argument('water_years', type=int, nargs='+', help='Water years to repack. Ex: 2023')
+    repack_parser.add_argument('--overwrite', action='store_true', help='Repack dates already in the archive')
+
+    return parser.parse_args()
 
 
-    else:
-        download_range(startDate=startD, endDate=endD, rootdir=fldr)
+if __name__ == '__main__':
+    args = arg_parse()
+
+    if args.command == 'run':
+        start_job(args.start, args.end, args.rootdir, args.processes, args.accumulate, args.packed)
+    elif args.command == 'resume':
+        resume_job(args.rootdir, args.job, args.processes, args.accumulate, args.packed)
+    elif args.command == 'retry':
+        retry_job(args.rootdir, args.job, args.processes, args.accumulate, args.packed)
+    elif args.command == 'repack':
+        repack_archive(args.rootdir, args.water_years, args.overwrite)
@@ -8,6 +8,7 @@ import gdal
 import glob
 import gzip
 import logging
+import numpy as np
 import ogr
 import os
 import osr
@@ -17,11 +18,14 @@ import tarfile
 import time
 import zipfile
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from logging.config import fileConfig
 from pathlib import Path
 from shutil import copy, copyfile
 
+from SNODAS_Manifest import snodas_product_code
+from SNODAS_Sparse import SparseGrid
+
 # from PyQt5.QtCore import QVariant
 # from qgis.analysis import (
 #     QgsRasterCalculator,
@@ -80,6 +84,22 @@ snodas_param_info = {'1034': {'name': 'SWE',
                               'na_SF': -9999}
                      }
 
+# Dimensions of the masked (contiguous U.S.) SNODAS grid. Every band is stored in the .dat files as big-endian 16 bit
+# signed integers in band interleaved by line (BIL) order, with -9999 as the null value.
+SNODAS_NROWS = 3351
+SNODAS_NCOLS = 6935
+SNODAS_DTYPE = '>i2'
+SNODAS_NODATA = -9999
+
+# Size of a grid cell in decimal degrees, and the center of the upper left cell before and from October 1, 2013, when
+# the grid was shifted by half a cell (see create_snodas_hdr_file_pre2013 and create_snodas_hdr_file_post2013).
+SNODAS_CELL_SIZE = 0.00833333333333333
+SNODAS_ORIGIN_PRE2013 = (-124.729583333333, 52.8704166666666)
+SNODAS_ORIGIN_POST2013 = (-124.729166666666, 52.8708333333333)
+
+# Order of the products in the bands of the multiband rasters written by stack_snodas_bil_to_multiband_tif
+SNODAS_BAND_ORDER = ['1034', '1036', '1044', '1050', '1039', '1025SlL01', '1025SlL00', '1038']
+
 
 def download_snodas(download_dir: Path, single_date: datetime) -> list:
     """Access the SNODAS FTP site and download the .tar file of single_date. The .tar file saves to the specified
@@ -113,8 +133,6 @@ def download_snodas(download_dir: Path, single_date: datetime) -> list:
     # Direct to folder within FTP site storing the SNODAS masked data.
     ftp.cwd(SNODAS_FTP_FOLDER)
 
-    os.chdir(download_dir)
-
     # Move into FTP folder containing the data from single_date's year
     ftp.cwd(str(single_date.year) + '/')
 
@@ -131,7 +149,7 @@ def download_snodas(download_dir: Path, single_date: datetime) -> list:
     filenames = ftp.nlst()
     for file in filenames:
         if file.endswith('{}.tar'.format(day)):
-            local_file = open(file, 'wb')
+            local_file = open(download_dir / file, 'wb')
             ftp.retrbinary('RETR ' + file, local_file.write, 1024)
 
             logger.info('download_snodas: Downloaded {}'.format(single_date))
@@ -182,11 +200,12 @@ def format_date_yyyymmdd(date: datetime) -> str:
     # Return string.
     return day_string
 
-def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> None:
+def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> list:
     """Untar downloaded SNODAS .tar file and extract the contained files to the folder_output
     file: SNODAS .tar file to untar
     folder_input: the full pathname to the folder containing 'file'
-    folder_output: the full pathname to the folder containing the extracted files"""
+    folder_output: the full pathname to the folder containing the extracted files
+    Returns: list of the full pathnames of the extracted files"""
 
     logger.info('untar_snodas_file: Starting {}'.format(file))
 
@@ -196,17 +215,18 @@ def untar_snodas_file(file: Path, folder_input: Path, folder_output: Path) -> No
     # Open .tar file
     tar = tarfile.open(file_full)
 
-    # Change working directory to output folder
-    os.chdir(folder_output)
-
-    # Extract .tar file and save contents in output directory
-    tar.extractall()
+    # Extract .tar file and save contents in output directory. The output directory is passed explicitly rather than
+    # changing the working directory so that several dates can be untarred at the same time.
+    tar.extractall(path=folder_output)
+    extracted = [Path(folder_output) / member.name for member in tar.getmembers() if member.isfile()]
 
     # Close .tar file
     tar.close()
 
     logger.info('untar_snodas_file: {} has been untarred.\n'.format(file))
 
+    return extracted
+
 def list_dir(path: Path, ext, multiple_types=False):
     """ List all files that end with the provided extension(s).
      path: The directory to search through.
@@ -223,17 +243,22 @@ def list_dir(path: Path, ext, multiple_types=False):
         return all_files
 
 
-def extract_snodas_gz_file(file: Path) -> None:
+def extract_snodas_gz_file(file: Path, folder_output: Path = None) -> Path:
     """Extract .dat and .Hdr files from SNODAS .gz file. Each daily SNODAS raster has 2 files associated with it
     (.dat and .Hdr) Both are zipped within a .gz file.
-    file: .gz file to be extracted"""
+    file: .gz file to be extracted
+    folder_output: full pathname to the folder where the extracted file is written. Defaults to the folder of 'file'
+    Returns: full pathname of the extracted file"""
 
     logger.info('extract_snodas_gz_file: Starting {}'.format(file))
 
+    if folder_output is None:
+        folder_output = file.parent
+
     # This block of script was based off of the script from the following resource:
     # http://stackoverflow.com/questions/20635245/using-gzip-module-with-python
     in_file = gzip.open(str(file), 'r')
-    with open(file.stem, 'wb') as out_file:
+    with open(folder_output / file.stem, 'wb') as out_file:
         out_file.write(in_file.read())
     in_file.close()
 
@@ -242,11 +267,14 @@ def extract_snodas_gz_file(file: Path) -> None:
 
     logger.info('extract_snodas_gz_file: {} has been extracted.\n'.format(file))
 
+    return folder_output / file.stem
+
 
-def convert_snodas_dat_to_bil(file: Path) -> None:
+def convert_snodas_dat_to_bil(file: Path) -> Path:
     """Convert SNODAS .dat file into supported file format (.tif). The .dat and .Hdr files are not supported file
     formats to use with QGS processing tools. The QGS processing tools are used to calculate the daily zonal stats.
-    file: .dat file to be converted to .bil format"""
+    file: .dat file to be converted to .bil format
+    Returns: full pathname of the .bil file"""
 
     logger.info('convert_snodas_dat_to_bil: Starting {}'.format(file))
 
@@ -255,6 +283,8 @@ def convert_snodas_dat_to_bil(file: Path) -> None:
 
     logger.info('convert_snodas_dat_to_bil: {} has been converted into .bil format.\n'.format(file))
 
+    return file.with_suffix('.bil')
+
 
 def create_snodas_hdr_file_pre2013(file: str) -> None:
     """Create custom .hdr file. A custom .Hdr file needs to be created to indicate the raster settings of the .bil file.
@@ -421,7 +451,7 @@ def assign_snodas_datum(file: str, folder: Path) -> None:
 
     logger.info('assign_snodas_datum: Successfully converted {} to {}.\n'.format(file, output_raster.name))
 
-def stack_snodas_bil_to_multiband_tif(in_file_list, out_filenm):
+def stack_snodas_bil_to_multiband_tif(in_file_list, out_filenm, packed=False):
     """
     Scale (to millimeters) and Stack SNODAS .bil files into multiband raster containing all parameters,
     save as geotiff
@@ -430,6 +460,9 @@ def stack_snodas_bil_to_multiband_tif(in_file_list, out_filenm):
     ----------
     in_file_list - list of filenames for single band rasters to stack
     out_filenm - the output filename for the stacked multi-band raster
+    packed - if True, keep the bands as int16 in the units of the .dat files and record the scale of each band in the
+    GDAL band metadata and as CF scale_factor/add_offset tags instead of writing scaled float32 bands. The raster is
+    half the size and read_snodas_band decodes it.
 
     Returns
     -------
@@ -443,72 +476,163 @@ def stack_snodas_bil_to_multiband_tif(in_file_list, out_filenm):
     # Update meta to reflect the number of layers
     meta.update(count=len(in_file_list),
                 driver='GTiff',
-                dtype=rasterio.float32,
+                dtype=rasterio.int16 if packed else rasterio.float32,
                 nodata=-9999,
                 compress='lzw')
 
-    # Organize bands
-    bnd_order = ['1034', '1036', '1044', '1050', '1039', '1025SlL01', '1025SlL00', '1038']
-
     # Read each layer and write it to stack
     with rasterio.open('{0}.tif'.format(out_filenm), 'w', **meta) as dst:
-        for bnd, param in enumerate(bnd_order, start=1):
+        for bnd, param in enumerate(SNODAS_BAND_ORDER, start=1):
             for layer in in_file_list:
-                if param in str(layer):
+                if snodas_product_code(layer) == param:
                     with rasterio.open(layer) as src1:
                         array = src1.read(1)
-                        sc_array = array / snodas_param_info[param]['dataSF']
-                        if snodas_param_info[param]['dataSF'] != 1.0:
-                            sc_array[sc_array == snodas_param_info[param]['na_SF']] = -9999
-                        dst.write_band(bnd, sc_array)
+                        if packed:
+                            dst.write_band(bnd, array.astype(np.int16))
+                        else:
+                            sc_array = array / snodas_param_info[param]['dataSF']
+                            if snodas_param_info[param]['dataSF'] != 1.0:
+                                sc_array[sc_array == snodas_param_info[param]['na_SF']] = -9999
+                            dst.write_band(bnd, sc_array)
                         dst.set_band_description(bnd, 'Band {0} - {1}'.format(bnd, snodas_param_info[param]['name']))
                 else:
                     continue
 
-def move_snodas_txt_files(file: str, folder_output: Path) -> None:
-    """Move the .txt file SNODAS metadata files to their own sub-directory
-    file: .txt file extracted from the downloaded SNODAS .tar file
-    folder_output: full pathname to folder where the other-than-SWE files are contained, OtherParameters"""
+        if packed:
+            scales = [1.0 / snodas_param_info[param]['dataSF'] for param in SNODAS_BAND_ORDER[:meta['count']]]
+            dst.scales = scales
+            dst.offsets = [0.0] * len(scales)
+            dst.units = [snodas_param_info[param]['units'] for param in SNODAS_BAND_ORDER[:meta['count']]]
+            for bnd, scale in enumerate(scales, start=1):
+                dst.update_tags(bnd, scale_factor=scale, add_offset=0.0, _FillValue=-9999)
 
-    logger.info('move_snodas_txt_files: Starting {}'.format(file))
 
-    # Move copy of file to folder_output. Delete original file from original location.
-    copy(file, folder_output)
-    logger.info('move_snodas_txt_files: {} has been moved to {}.'.format(file, folder_output))
-    Path(file).unlink()
+def read_snodas_band(src, product: str, window=None):
+    """
+    Read the band of a product from an open multiband raster written by stack_snodas_bil_to_multiband_tif, packed or
+    not. Packed int16 bands are decoded with the scale and offset of the band.
+    Parameters
+    ----------
+    src: multiband raster opened with rasterio
+    product: product code, a key of snodas_param_info
+    window: optional rasterio window to read only part of the band
 
+    Returns
+    -------
+    float32 array in the units of snodas_param_info with null cells set to NaN
+    """
+    bnd = SNODAS_BAND_ORDER.index(product) + 1
+    array = src.read(bnd, window=window)
+    null = array == SNODAS_NODATA
+    array = array.astype(np.float32) * np.float32(src.scales[bnd - 1]) + np.float32(src.offsets[bnd - 1])
+    array[null] = np.nan
+    return array
 
-    logger.info('move_snodas_txt_files: Finished {} \n'.format(file))
 
+def read_snodas_tar_grids(tar_file: Path, products=None, sparse: bool = False) -> dict:
+    """
+    Decode the .dat.gz members of a daily SNODAS .tar file directly into arrays, without writing any files.
+    Parameters
+    ----------
+    tar_file: full pathname of the SNODAS .tar file
+    products: list of product codes (keys of snodas_param_info) to decode. Defaults to all products.
+    sparse: if True, return each grid as a SparseGrid, which is much smaller on days with little snow
 
-def split_date_range(startDate, endDate, chunks):
+    Returns
+    -------
+    dictionary of {product code: native-endian int16 array of shape (SNODAS_NROWS, SNODAS_NCOLS)} in the unscaled
+    units of the .dat file (see scale_snodas_grid), or of SparseGrid if sparse is True
     """
-    Split a date range into a specified number of chunks.
+    grids = {}
+    with tarfile.open(tar_file) as tar:
+        for member in tar.getmembers():
+            if not member.name.endswith('.dat.gz'):
+                continue
+            product = snodas_product_code(member.name)
+            if product is None or (products is not None and product not in products):
+                continue
+            data = gzip.decompress(tar.extractfile(member).read())
+            grids[product] = np.frombuffer(data, dtype=SNODAS_DTYPE).reshape(SNODAS_NROWS, SNODAS_NCOLS)\
+                .astype(np.int16)
+            if sparse:
+                grids[product] = SparseGrid.from_dense(grids[product], SNODAS_NODATA)
+
+    return grids
+
+
+def read_snodas_bil_grid(file: Path, sparse: bool = False):
+    """
+    Read an extracted .dat or .bil file of one product into an array (see read_snodas_tar_grids).
     Parameters
     ----------
-    startDate: start date of the entire range in "yyyy-mm-dd" format
-    endDate: end date of the entire range in "yyyy-mm-dd" format
-    chunks: number of chunks of dates to split into
+    file: full pathname of the .dat or .bil file
+    sparse: if True, return the grid as a SparseGrid
 
     Returns
     -------
-    list of tuples representing the start and end dates of each chunk
+    native-endian int16 array of shape (SNODAS_NROWS, SNODAS_NCOLS) in the unscaled units of the .dat file, or
+    SparseGrid if sparse is True
     """
-    s = datetime.strptime(startDate, '%Y-%m-%d')
-    e = datetime.strptime(endDate, '%Y-%m-%d')
-    ditems = e - s
-    incrm = int(ditems.days / chunks) + 1
-
-    date_chnks = []
-    for c in range(chunks):
-        if c == chunks - 1:
-            st = s + timedelta(days=(c * incrm) + c)
-            en = e
-            dt_chnk = (st, en)
-        else:
-            st = s + timedelta(days=(c * incrm) + c)
-            en = s + timedelta(days=((c+1) * incrm) + c)
-            dt_chnk = (st, en)
-        date_chnks.append(dt_chnk)
+    grid = np.fromfile(file, dtype=SNODAS_DTYPE).reshape(SNODAS_NROWS, SNODAS_NCOLS).astype(np.int16)
+    return SparseGrid.from_dense(grid, SNODAS_NODATA) if sparse else grid
 
-    return date_chnks
+
+def scale_snodas_grid(array, product: str):
+    """
+    Scale an unscaled SNODAS array to the units of snodas_param_info (see stack_snodas_bil_to_multiband_tif).
+    Parameters
+    ----------
+    array: unscaled array of the product, as read from the .dat file
+    product: product code, a key of snodas_param_info
+
+    Returns
+    -------
+    float32 array with null cells set to NaN
+    """
+    sc_array = array.astype(np.float32) / snodas_param_info[product]['dataSF']
+    sc_array[array == SNODAS_NODATA] = np.nan
+    return sc_array
+
+
+def snodas_grid_index(lons, lats, date):
+    """
+    Get the row and column of the grid cells that contain points.
+    Parameters
+    ----------
+    lons: longitudes of the points in decimal degrees
+    lats: latitudes of the points in decimal degrees
+    date: the date of the grid in date or datetime format. The grid origin changed on October 1, 2013.
+
+    Returns
+    -------
+    tuple of (rows, cols) int arrays. Points outside the grid have row and column -1.
+    """
+    if isinstance(date, datetime):
+        date = date.date()
+    if date >= datetime(2013, 10, 1).date():
+        ulx, uly = SNODAS_ORIGIN_POST2013
+    else:
+        ulx, uly = SNODAS_ORIGIN_PRE2013
+    # The origin is the center of the upper left cell.
+    cols = np.rint((np.asarray(lons, dtype=float) - ulx) / SNODAS_CELL_SIZE).astype(int)
+    rows = np.rint((uly - np.asarray(lats, dtype=float)) / SNODAS_CELL_SIZE).astype(int)
+    outside = (rows < 0) | (rows >= SNODAS_NROWS) | (cols < 0) | (cols >= SNODAS_NCOLS)
+    rows[outside] = -1
+    cols[outside] = -1
+    return rows, cols
+
+
+def move_snodas_txt_files(file: str, folder_output: Path) -> None:
+    """Move the .txt file SNODAS metadata files to their own sub-directory
+    file: .txt file extracted from the downloaded SNODAS .tar file
+    folder_output: full pathname to folder where the other-than-SWE files are contained, OtherParameters"""
+
+    logger.info('move_snodas_txt_files: Starting {}'.format(file))
+
+    # Move copy of file to folder_output. Delete original file from original location.
+    copy(file, folder_output)
+    logger.info('move_snodas_txt_files: {} has been moved to {}.'.format(file, folder_output))
+    Path(file).unlink()
+
+
+    logger.info('move_snodas_txt_files: Finished {} \n'.format(file))